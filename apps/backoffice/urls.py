@@ -8,6 +8,14 @@ urlpatterns = [
     path("", views.DashboardView.as_view(), name="dashboard"),
     path("shipments/", views.ShipmentListView.as_view(), name="shipment-list"),
     path("shipments/create/", views.ShipmentCreateView.as_view(), name="shipment-create"),
+    path("shipments/auto-assign/", views.AutoAssignView.as_view(), name="shipment-auto-assign"),
+    path("shipments/sla/", views.ShipmentSlaView.as_view(), name="shipment-sla"),
+    path("shipments/waybills/", views.WaybillPrintView.as_view(), name="waybill-print"),
+    path(
+        "shipments/waybills/<uuid:uuid>/",
+        views.WaybillBatchDetailView.as_view(),
+        name="waybill-batch",
+    ),
     path("shipments/<uuid:uuid>/", views.ShipmentDetailView.as_view(), name="shipment-detail"),
     path(
         "shipments/<uuid:uuid>/transition/",
@@ -1,13 +1,25 @@
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db.models import Count, Q
+from django.core.exceptions import ValidationError
+from django.db.models import Case, Count, Value, When
+from django.http import Http404
 from django.shortcuts import get_object_or_404, redirect
 from django.utils import timezone
 from django.views.generic import CreateView, DetailView, ListView, TemplateView, View
 
+from apps.common.pagination import InvalidCursor, estimate_count, paginate_keyset
 from apps.customers.models import Customer
+from apps.customers.search import search_customers
 from apps.drivers.models import Driver
-from apps.shipments.models import Shipment, ShipmentEvent
-from apps.shipments.state_machine import InvalidTransitionError, transition_shipment
+from apps.reports.stats import dashboard_stats
+from apps.shipments.models import Shipment, WaybillBatch
+from apps.shipments.search import search_shipments
+from apps.shipments.sla import open_shipments
+from apps.shipments.state_machine import (
+    InvalidTransitionError,
+    record_creation_event,
+    transition_shipment,
+)
+from apps.shipments.tasks import schedule_waybill_prerender, start_waybill_batch
 
 
 class DashboardView(LoginRequiredMixin, TemplateView):
@@ -17,19 +29,7 @@ class DashboardView(LoginRequiredMixin, TemplateView):
         context = super().get_context_data(**kwargs)
         today = timezone.localdate()
 
-        stats = Shipment.objects.aggregate(
-            total=Count("id"),
-            created=Count("id", filter=Q(status="created")),
-            assigned=Count("id", filter=Q(status="assigned")),
-            in_transit=Count("id", filter=Q(status__in=["picked_up", "in_transit"])),
-            out_for_delivery=Count("id", filter=Q(status="out_for_delivery")),
-            delivered_today=Count(
-                "id",
-                filter=Q(status="delivered", actual_delivery_date__date=today),
-            ),
-            not_delivered=Count("id", filter=Q(status="not_delivered")),
-        )
-        context["stats"] = stats
+        context["stats"] = dashboard_stats(today)
 
         context["recent_shipments"] = (
             Shipment.objects.select_related("sender", "driver", "driver__user")
@@ -40,35 +40,34 @@ class DashboardView(LoginRequiredMixin, TemplateView):
         return context
 
 
+def filter_shipments(qs, params):
+    """Filtri della lista spedizioni (stato, ricerca, tipo di consegna)."""
+    status = params.get("status")
+    if status:
+        qs = qs.filter(status=status)
+
+    q = params.get("q")
+    if q:
+        qs = search_shipments(qs, q)
+
+    delivery_type = params.get("delivery_type")
+    if delivery_type:
+        qs = qs.filter(delivery_type=delivery_type)
+
+    return qs
+
+
 class ShipmentListView(LoginRequiredMixin, ListView):
     template_name = "backoffice/shipments/list.html"
     context_object_name = "shipments"
-    paginate_by = 25
+    # Paginazione keyset (vedi get_context_data): niente COUNT(*) né OFFSET
+    page_size = 25
 
     def get_queryset(self):
         qs = Shipment.objects.select_related(
             "sender", "driver", "driver__user", "external_carrier",
         ).order_by("-created_at")
-
-        # Filtri
-        status = self.request.GET.get("status")
-        if status:
-            qs = qs.filter(status=status)
-
-        q = self.request.GET.get("q")
-        if q:
-            qs = qs.filter(
-                Q(tracking_code__icontains=q)
-                | Q(reference__icontains=q)
-                | Q(recipient_name__icontains=q)
-                | Q(sender__company_name__icontains=q)
-            )
-
-        delivery_type = self.request.GET.get("delivery_type")
-        if delivery_type:
-            qs = qs.filter(delivery_type=delivery_type)
-
-        return qs
+        return filter_shipments(qs, self.request.GET)
 
     def get_template_names(self):
         if self.request.htmx:
@@ -77,6 +76,24 @@ class ShipmentListView(LoginRequiredMixin, ListView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        try:
+            page = paginate_keyset(
+                self.object_list,
+                cursor=self.request.GET.get("cursor", ""),
+                page_size=self.page_size,
+            )
+        except InvalidCursor:
+            raise Http404("Cursore non valido")
+
+        context["page"] = page
+        context["shipments"] = context["object_list"] = page.object_list
+        context["total_estimate"] = estimate_count(self.object_list)
+
+        filters = self.request.GET.copy()
+        filters.pop("cursor", None)
+        filters.pop("page", None)
+        context["filter_querystring"] = filters.urlencode()
+
         context["statuses"] = Shipment.Status.choices
         context["current_status"] = self.request.GET.get("status", "")
         context["current_q"] = self.request.GET.get("q", "")
@@ -137,12 +154,8 @@ class ShipmentCreateView(LoginRequiredMixin, CreateView):
         form.instance.created_by = self.request.user
         response = super().form_valid(form)
         # Crea evento iniziale
-        ShipmentEvent.objects.create(
-            shipment=self.object,
-            status="created",
-            description="Spedizione creata",
-            recorded_by=self.request.user,
-        )
+        record_creation_event(self.object, user=self.request.user)
+        schedule_waybill_prerender(self.object)
         return response
 
     def get_success_url(self):
@@ -179,6 +192,118 @@ class ShipmentTransitionView(LoginRequiredMixin, View):
         return redirect(f"/shipments/{uuid}/")
 
 
+class WaybillPrintView(LoginRequiredMixin, View):
+    """Stampa dei fogli di vettura selezionati (o di tutti quelli filtrati)."""
+
+    def post(self, request):
+        from django.http import HttpResponse
+
+        uuids = request.POST.getlist("uuids")[:WaybillBatch.MAX_SHIPMENTS]
+        if uuids:
+            try:
+                ids_by_uuid = {
+                    str(uuid): pk
+                    for uuid, pk in Shipment.objects.filter(uuid__in=uuids).values_list("uuid", "id")
+                }
+            except ValidationError:
+                return redirect("/shipments/")
+            shipment_ids = [ids_by_uuid[u] for u in dict.fromkeys(uuids) if u in ids_by_uuid]
+        else:
+            qs = filter_shipments(Shipment.objects.order_by("-created_at"), request.POST)
+            shipment_ids = list(qs.values_list("id", flat=True)[:WaybillBatch.MAX_SHIPMENTS])
+
+        if not shipment_ids:
+            return redirect("/shipments/")
+
+        if len(shipment_ids) > WaybillBatch.SYNC_LIMIT:
+            batch = start_waybill_batch(shipment_ids, user=request.user)
+            return redirect(f"/shipments/waybills/{batch.uuid}/")
+
+        from apps.shipments.waybill import print_waybills
+
+        response = HttpResponse(print_waybills(shipment_ids), content_type="application/pdf")
+        response["Content-Disposition"] = 'inline; filename="fogli_vettura.pdf"'
+        return response
+
+
+class WaybillBatchDetailView(LoginRequiredMixin, DetailView):
+    model = WaybillBatch
+    template_name = "backoffice/shipments/waybill_batch.html"
+    context_object_name = "batch"
+    slug_field = "uuid"
+    slug_url_kwarg = "uuid"
+
+
+class AutoAssignView(LoginRequiredMixin, TemplateView):
+    """Anteprima e conferma dell'assegnazione automatica ai corrieri interni."""
+
+    template_name = "backoffice/shipments/auto_assign.html"
+
+    def get_context_data(self, **kwargs):
+        from apps.shipments.assignment import auto_assign
+
+        context = super().get_context_data(**kwargs)
+        if "plan" not in context:
+            # Il piano si calcola solo su richiesta (?preview=1): la sola
+            # apertura della pagina conta le spedizioni da assegnare
+            if self.request.GET.get("preview"):
+                context["plan"] = auto_assign(dry_run=True)
+            else:
+                context["plan"] = None
+                context["pending_count"] = Shipment.objects.filter(
+                    status=Shipment.Status.CREATED,
+                ).count()
+        if context["plan"] is not None:
+            context["unassigned_preview"] = context["plan"].unassigned[:50]
+        return context
+
+    def post(self, request):
+        from apps.shipments.assignment import auto_assign
+
+        plan = auto_assign(user=request.user)
+        return self.render_to_response(self.get_context_data(plan=plan, done=True))
+
+
+class ShipmentSlaView(LoginRequiredMixin, ListView):
+    """Spedizioni aperte a rischio o in ritardo rispetto alla data prevista."""
+
+    template_name = "backoffice/shipments/sla.html"
+    context_object_name = "shipments"
+    paginate_by = 50
+
+    def get_queryset(self):
+        from apps.shipments.assignment import PRIORITY_RANK
+
+        sla_status = self.request.GET.get("sla")
+        if sla_status not in (Shipment.SlaStatus.AT_RISK, Shipment.SlaStatus.BREACHED):
+            sla_status = None
+        qs = open_shipments().filter(
+            sla_status__in=[sla_status] if sla_status else [
+                Shipment.SlaStatus.AT_RISK, Shipment.SlaStatus.BREACHED,
+            ],
+        )
+        # A parità di data prima le più urgenti: "priority" come testo
+        # ordinerebbe high < low < normal < urgent
+        priority_rank = Case(
+            *[When(priority=priority, then=Value(rank)) for priority, rank in PRIORITY_RANK.items()],
+            default=Value(len(PRIORITY_RANK)),
+        )
+        return qs.select_related(
+            "sender", "driver", "driver__user", "external_carrier",
+        ).order_by("estimated_delivery_date", priority_rank, "id")
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        counts = dict(
+            open_shipments().exclude(sla_status=Shipment.SlaStatus.ON_TIME)
+            .order_by().values_list("sla_status").annotate(total=Count("id"))
+        )
+        context["at_risk_count"] = counts.get(Shipment.SlaStatus.AT_RISK, 0)
+        context["breached_count"] = counts.get(Shipment.SlaStatus.BREACHED, 0)
+        context["current_sla"] = self.request.GET.get("sla", "")
+        return context
+
+
 class CustomerListView(LoginRequiredMixin, ListView):
     template_name = "backoffice/customers/list.html"
     context_object_name = "customers"
@@ -188,7 +313,5 @@ class CustomerListView(LoginRequiredMixin, ListView):
         qs = Customer.objects.filter(is_active=True).order_by("company_name")
         q = self.request.GET.get("q")
         if q:
-            qs = qs.filter(
-                Q(company_name__icontains=q) | Q(contact_name__icontains=q)
-            )
+            qs = search_customers(qs, q)
         return qs
@@ -0,0 +1,23 @@
+from rest_framework.filters import SearchFilter
+
+
+class QuerySearchFilter(SearchFilter):
+    """
+    SearchFilter che delega la ricerca a funzioni del modulo di ricerca,
+    invece di combinare `search_fields`.
+
+    Un solo termine va a `search(queryset, query)`, che può usare i percorsi
+    esatti sui codici; più termini sono in AND come in SearchFilter, ognuno
+    con la condizione per sottostringa `search_q(query)`.
+    """
+
+    search = None
+    search_q = None
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        if len(terms) == 1:
+            return self.search(queryset, terms[0])
+        return queryset.filter(*[self.search_q(term) for term in terms])
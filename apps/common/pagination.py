@@ -0,0 +1,204 @@
+"""Paginazione keyset su (created_at, id) e conteggi stimati dal planner."""
+import base64
+import binascii
+import json
+from dataclasses import dataclass, field
+
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+@dataclass
+class KeysetPage:
+    object_list: list = field(default_factory=list)
+    next_cursor: str = ""
+    previous_cursor: str = ""
+
+    @property
+    def has_next(self):
+        return bool(self.next_cursor)
+
+    @property
+    def has_previous(self):
+        return bool(self.previous_cursor)
+
+
+def encode_cursor(obj, reverse: bool = False) -> str:
+    raw = f"{'p' if reverse else 'n'}|{obj.created_at.isoformat()}|{obj.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """Ritorna (reverse, created_at, pk) oppure solleva InvalidCursor."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        direction, created_at, pk = (
+            base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+        )
+        created_at = parse_datetime(created_at)
+        pk = int(pk)
+    except (ValueError, TypeError, UnicodeDecodeError, binascii.Error):
+        raise InvalidCursor(cursor)
+    if created_at is None or direction not in ("n", "p"):
+        raise InvalidCursor(cursor)
+    return direction == "p", created_at, pk
+
+
+def paginate_keyset(queryset, cursor: str = "", page_size: int = 25) -> KeysetPage:
+    """
+    Pagina un queryset in ordine (-created_at, -id) senza OFFSET.
+
+    Il cursore punta all'ultimo elemento della pagina precedente (o al primo
+    della successiva, per tornare indietro): ogni pagina costa una scansione
+    dell'indice a partire da quella posizione, indipendentemente dalla
+    profondità.
+    """
+    reverse = False
+    if cursor:
+        reverse, created_at, pk = decode_cursor(cursor)
+        if reverse:
+            queryset = queryset.filter(created_at__gte=created_at).filter(
+                Q(created_at__gt=created_at) | Q(pk__gt=pk),
+            )
+        else:
+            queryset = queryset.filter(created_at__lte=created_at).filter(
+                Q(created_at__lt=created_at) | Q(pk__lt=pk),
+            )
+
+    ordering = ("created_at", "pk") if reverse else ("-created_at", "-pk")
+    rows = list(queryset.order_by(*ordering)[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if reverse:
+        rows.reverse()
+
+    page = KeysetPage(object_list=rows)
+    if not rows:
+        return page
+
+    # Andando avanti esiste sempre una pagina precedente se si è partiti da un
+    # cursore; tornando indietro esiste sempre una pagina successiva.
+    has_previous = has_more if reverse else bool(cursor)
+    if has_previous:
+        page.previous_cursor = encode_cursor(rows[0], reverse=True)
+    if reverse or has_more:
+        page.next_cursor = encode_cursor(rows[-1])
+    return page
+
+
+def estimate_count(queryset) -> int:
+    """
+    Numero di righe stimato dal planner di PostgreSQL (EXPLAIN), senza COUNT(*).
+
+    Sugli altri database ricade sul conteggio esatto.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return queryset.count()
+
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginazione a cursore per le liste ordinate per data di creazione.
+
+    Attiva con ?pagination=cursor oppure passando ?cursor=. Con ?count=estimate
+    la risposta include il totale stimato dal planner, con ?count=exact il
+    conteggio esatto; di default il totale non viene calcolato.
+
+    Il cursore segue solo l'ordine (-created_at, -id): se si chiede un altro
+    ordinamento (?ordering= di OrderingFilter) si ricade sulla paginazione a
+    pagine, che lo rispetta.
+    """
+
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 100
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    count_query_param = "count"
+    ordering_query_param = api_settings.ORDERING_PARAM
+    # Valori di ?ordering= compatibili con l'ordine del cursore
+    keyset_orderings = ("", "-created_at")
+
+    @classmethod
+    def is_requested(cls, request) -> bool:
+        params = request.query_params
+        if params.get(cls.ordering_query_param, "").strip() not in cls.keyset_orderings:
+            return False
+        return cls.cursor_query_param in params or params.get("pagination") == "cursor"
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.count = None
+        self.count_is_estimate = False
+
+        count_mode = request.query_params.get(self.count_query_param)
+        if count_mode == "exact":
+            self.count = queryset.count()
+        elif count_mode == "estimate":
+            self.count = estimate_count(queryset)
+            self.count_is_estimate = True
+
+        try:
+            self.page = paginate_keyset(
+                queryset,
+                cursor=request.query_params.get(self.cursor_query_param, ""),
+                page_size=self.get_page_size(request),
+            )
+        except InvalidCursor:
+            raise NotFound("Cursore non valido")
+        return self.page.object_list
+
+    def get_link(self, cursor):
+        if not cursor:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        payload = {
+            "next": self.get_link(self.page.next_cursor),
+            "previous": self.get_link(self.page.previous_cursor),
+        }
+        if self.count is not None:
+            payload["count"] = self.count
+            payload["count_is_estimate"] = self.count_is_estimate
+        payload["results"] = data
+        return Response(payload)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "count": {"type": "integer"},
+                "count_is_estimate": {"type": "boolean"},
+                "results": schema,
+            },
+        }
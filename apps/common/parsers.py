@@ -0,0 +1,44 @@
+import io
+import zlib
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+
+
+class GzipJSONParser(JSONParser):
+    """
+    JSON eventualmente compresso (Content-Encoding: gzip).
+
+    La decompressione è incrementale e si ferma oltre max_decompressed_size,
+    così un payload piccolo ma molto comprimibile non esaurisce la memoria.
+    """
+
+    chunk_size = 64 * 1024
+
+    @property
+    def max_decompressed_size(self) -> int:
+        return settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = (parser_context or {}).get("request")
+        encoding = request.META.get("HTTP_CONTENT_ENCODING", "") if request else ""
+        if encoding.lower() == "gzip" and stream is not None:
+            stream = io.BytesIO(self.decompress(stream))
+        return super().parse(stream, media_type, parser_context)
+
+    def decompress(self, stream) -> bytes:
+        limit = self.max_decompressed_size
+        decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+        data = bytearray()
+        try:
+            while not decompressor.eof:
+                chunk = decompressor.unconsumed_tail or stream.read(self.chunk_size)
+                if not chunk:
+                    raise ParseError("Payload gzip troncato")
+                data += decompressor.decompress(chunk, limit + 1 - len(data))
+                if len(data) > limit:
+                    raise ParseError(f"Payload decompresso oltre {limit} byte")
+        except zlib.error as e:
+            raise ParseError(f"Payload gzip non valido: {e}")
+        return bytes(data)
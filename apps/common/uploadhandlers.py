@@ -0,0 +1,30 @@
+import hashlib
+
+from django.core.files.uploadhandler import FileUploadHandler
+
+
+class SHA256UploadHandler(FileUploadHandler):
+    """
+    SHA-256 dei file caricati, calcolato sui chunk mentre arrivano.
+
+    Non memorizza nulla: passa i dati agli handler successivi (memoria o file
+    temporaneo) e aggiunge l'attributo `sha256` al file che producono. Va
+    messo per primo in FILE_UPLOAD_HANDLERS.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.hasher = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hasher.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        handlers = self.request.upload_handlers
+        for handler in handlers[handlers.index(self) + 1:]:
+            file = handler.file_complete(file_size)
+            if file is not None:
+                file.sha256 = self.hasher.hexdigest()
+                return file
+        return None
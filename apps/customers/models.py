@@ -1,4 +1,6 @@
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.db import models
+from django.db.models.functions import Upper
 
 from apps.common.models import TimeStampedModel, UUIDModel
 
@@ -26,6 +28,17 @@ class Customer(UUIDModel, TimeStampedModel):
     class Meta:
         db_table = "customers_customer"
         ordering = ["company_name"]
+        indexes = [
+            # Ricerca per sottostringa (pg_trgm), vedi apps/customers/search.py
+            GinIndex(
+                OpClass(Upper("company_name"), name="gin_trgm_ops"),
+                name="customer_company_name_trgm",
+            ),
+            GinIndex(
+                OpClass(Upper("contact_name"), name="gin_trgm_ops"),
+                name="customer_contact_name_trgm",
+            ),
+        ]
 
     def __str__(self):
         return self.company_name
@@ -0,0 +1,20 @@
+"""Ricerca clienti (indici GIN pg_trgm su UPPER(colonna), vedi Customer.Meta)."""
+from django.db.models import Q
+
+from apps.common.filters import QuerySearchFilter
+
+
+def customer_search_q(query: str) -> Q:
+    return Q(company_name__icontains=query) | Q(contact_name__icontains=query)
+
+
+def search_customers(queryset, query: str):
+    query = query.strip()
+    if not query:
+        return queryset
+    return queryset.filter(customer_search_q(query))
+
+
+class CustomerSearchFilter(QuerySearchFilter):
+    search = staticmethod(search_customers)
+    search_q = staticmethod(customer_search_q)
@@ -1,14 +1,18 @@
+from django_filters import rest_framework as filters
 from rest_framework import viewsets
+from rest_framework.filters import OrderingFilter
 
 from apps.accounts.permissions import IsOperatorOrAdmin
 
 from .models import Address, Customer
+from .search import CustomerSearchFilter
 from .serializers import AddressSerializer, CustomerListSerializer, CustomerSerializer
 
 
 class CustomerViewSet(viewsets.ModelViewSet):
     queryset = Customer.objects.filter(is_active=True).prefetch_related("addresses")
     permission_classes = [IsOperatorOrAdmin]
+    filter_backends = [filters.DjangoFilterBackend, CustomerSearchFilter, OrderingFilter]
 
     def get_serializer_class(self):
         if self.action == "list":
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import NotificationLog
+from .models import NotificationLog, OutboxMessage
 
 
 @admin.register(NotificationLog)
@@ -10,3 +10,10 @@ class NotificationLogAdmin(admin.ModelAdmin):
     search_fields = ("recipient", "shipment__tracking_code")
     readonly_fields = ("uuid", "created_at")
     raw_id_fields = ("shipment",)
+
+
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ("id", "topic", "created_at", "processed_at")
+    list_filter = ("topic",)
+    readonly_fields = ("topic", "payload", "created_at", "processed_at")
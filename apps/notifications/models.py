@@ -38,3 +38,44 @@ class NotificationLog(UUIDModel, TimeStampedModel):
 
     def __str__(self):
         return f"{self.channel} → {self.recipient} ({self.status})"
+
+
+class OutboxMessage(models.Model):
+    """
+    Outbox transazionale degli effetti collaterali delle spedizioni.
+
+    I messaggi sono scritti nella stessa transazione dello ShipmentEvent e
+    smistati ai task Celery da dispatch_outbox, così le notifiche partono
+    solo per modifiche confermate e la richiesta non attende il broker.
+    """
+
+    class Topic(models.TextChoices):
+        STATUS_CHANGED = "shipment.status_changed", "Cambio stato spedizione"
+
+    topic = models.CharField(max_length=50, choices=Topic.choices)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = "notifications_outbox"
+        ordering = ["id"]
+        verbose_name = "Messaggio outbox"
+        verbose_name_plural = "Outbox"
+        indexes = [
+            models.Index(
+                fields=["id"], name="notifications_outbox_pending",
+                condition=models.Q(processed_at__isnull=True),
+            ),
+            models.Index(fields=["processed_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.topic} #{self.pk}"
+
+    @classmethod
+    def status_changed(cls, shipment_id: int, new_status: str):
+        return cls(
+            topic=cls.Topic.STATUS_CHANGED,
+            payload={"shipment_id": shipment_id, "status": new_status},
+        )
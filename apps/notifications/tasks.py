@@ -1,13 +1,19 @@
 import logging
+from datetime import timedelta
 
 from celery import shared_task
 from django.conf import settings
 from django.core.mail import send_mail
+from django.db import transaction
 from django.template.loader import render_to_string
 from django.utils import timezone
 
 logger = logging.getLogger(__name__)
 
+OUTBOX_BATCH_SIZE = 500
+OUTBOX_MAX_BATCHES = 20
+OUTBOX_RETENTION_DAYS = 7
+
 STATUS_MESSAGES = {
     "created": "La tua spedizione {tracking_code} è stata creata.",
     "assigned": "La tua spedizione {tracking_code} è stata assegnata al corriere.",
@@ -22,7 +28,6 @@ STATUS_MESSAGES = {
 
 @shared_task(bind=True, max_retries=3, default_retry_delay=60)
 def send_status_notification(self, shipment_id: int, new_status: str):
-    from apps.notifications.models import NotificationLog
     from apps.shipments.models import Shipment
 
     try:
@@ -31,6 +36,27 @@ def send_status_notification(self, shipment_id: int, new_status: str):
         logger.error(f"Shipment {shipment_id} non trovata")
         return
 
+    _notify_shipment(shipment, new_status)
+
+
+@shared_task
+def send_status_notifications_bulk(notifications: list):
+    """Notifiche per un blocco di transizioni: lista di coppie (shipment_id, new_status)."""
+    from apps.shipments.models import Shipment
+
+    shipments = Shipment.objects.select_related("sender").in_bulk(
+        {shipment_id for shipment_id, _ in notifications},
+    )
+
+    for shipment_id, new_status in notifications:
+        shipment = shipments.get(shipment_id)
+        if shipment is None:
+            logger.error(f"Shipment {shipment_id} non trovata")
+            continue
+        _notify_shipment(shipment, new_status)
+
+
+def _notify_shipment(shipment, new_status):
     # Notifica al destinatario (se ha email)
     if shipment.recipient_email:
         _send_email_notification(shipment, new_status, shipment.recipient_email)
@@ -85,3 +111,57 @@ def _send_email_notification(shipment, new_status, recipient_email):
         notification.error_message = str(e)
 
     notification.save()
+
+
+@shared_task
+def dispatch_outbox(batch_size: int = OUTBOX_BATCH_SIZE, max_batches: int = OUTBOX_MAX_BATCHES):
+    """
+    Smista i messaggi pendenti dell'outbox ai task di notifica.
+
+    Ogni batch è bloccato con SELECT ... FOR UPDATE SKIP LOCKED, quindi più
+    dispatcher possono girare in parallelo senza processare due volte lo
+    stesso messaggio. Se l'invio al broker fallisce la transazione viene
+    annullata e i messaggi restano pendenti per il giro successivo.
+    """
+    from apps.notifications.models import OutboxMessage
+    from apps.reports.tasks import refresh_shipment_lead_times
+
+    dispatched = 0
+    for _ in range(max_batches):
+        with transaction.atomic():
+            messages = list(
+                OutboxMessage.objects.select_for_update(skip_locked=True)
+                .filter(processed_at__isnull=True)
+                .order_by("id")[:batch_size]
+            )
+            if not messages:
+                break
+
+            notifications = [
+                (message.payload["shipment_id"], message.payload["status"])
+                for message in messages
+                if message.topic == OutboxMessage.Topic.STATUS_CHANGED
+            ]
+            if notifications:
+                send_status_notifications_bulk.delay(notifications)
+                # Fan-out: tempi di consegna delle spedizioni cambiate
+                refresh_shipment_lead_times.delay(
+                    sorted({shipment_id for shipment_id, _ in notifications}),
+                )
+
+            OutboxMessage.objects.filter(
+                pk__in=[message.pk for message in messages],
+            ).update(processed_at=timezone.now())
+            dispatched += len(messages)
+
+    return dispatched
+
+
+@shared_task
+def purge_outbox(retention_days: int = OUTBOX_RETENTION_DAYS):
+    """Elimina i messaggi outbox già smistati più vecchi di retention_days."""
+    from apps.notifications.models import OutboxMessage
+
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    deleted, _ = OutboxMessage.objects.filter(processed_at__lt=cutoff).delete()
+    return deleted
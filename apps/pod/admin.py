@@ -6,7 +6,10 @@ from .models import PODPhoto, PODRecord
 class PODPhotoInline(admin.TabularInline):
     model = PODPhoto
     extra = 0
-    readonly_fields = ("uuid",)
+    readonly_fields = (
+        "uuid", "sha256", "thumbnail", "web_image", "width", "height", "file_size",
+        "processed_at",
+    )
 
 
 @admin.register(PODRecord)
@@ -17,6 +20,9 @@ class PODRecordAdmin(admin.ModelAdmin):
     )
     list_filter = ("delivery_result", "synced_from_offline")
     search_fields = ("shipment__tracking_code", "recipient_signer_name")
-    readonly_fields = ("uuid", "created_at", "updated_at")
+    readonly_fields = (
+        "uuid", "signature_web", "signature_processed_at", "signature_strokes",
+        "created_at", "updated_at",
+    )
     inlines = [PODPhotoInline]
     raw_id_fields = ("shipment", "driver")
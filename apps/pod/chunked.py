@@ -0,0 +1,209 @@
+"""
+Upload riprendibili a blocchi di foto e firme dei POD (protocollo sul
+modello di tus).
+
+Il client crea l'upload dichiarando tipo, dimensione ed eventualmente
+SHA-256, poi invia i byte con PATCH successivi indicando l'offset di
+partenza (header Upload-Offset). Se la connessione cade a metà i byte
+ricevuti restano: con HEAD il client legge l'offset raggiunto e riprende da
+lì invece di ricominciare. A upload completo la conclusione registra la
+foto (o la firma) sullo storage indirizzato per contenuto (apps.pod.content).
+
+I blocchi si assemblano in un file locale in POD_CHUNKED_UPLOAD_DIR, da
+condividere tra i processi web: le immagini sono già ridotte dalla PWA
+(POD_UPLOAD_MAX_BYTES) e stanno sotto la parte minima di un multipart S3,
+quindi lo storage finale riceve sempre un solo file.
+"""
+import fcntl
+import hashlib
+import logging
+import os
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+
+from .content import SIGNATURE_PREFIX, create_photo, store_content
+from .models import PODChunkedUpload, PODRecord
+from .tasks import schedule_media_processing
+from .uploads import KIND_SIGNATURE, UPLOAD_CONTENT_TYPES, InvalidUpload
+
+logger = logging.getLogger(__name__)
+
+TUS_VERSION = "1.0.0"
+CHUNK_CONTENT_TYPE = "application/offset+octet-stream"
+
+# Upload fermi da più di così vengono eliminati con i loro blocchi
+CHUNKED_UPLOAD_EXPIRY = timedelta(hours=24)
+
+_CHUNK_SIZE = 64 * 1024
+
+
+class OffsetMismatch(InvalidUpload):
+    """L'offset del blocco non coincide con quello raggiunto dall'upload."""
+
+    def __init__(self, offset: int):
+        super().__init__(f"Offset non valido: l'upload è a {offset} byte")
+        self.offset = offset
+
+
+class UploadGone(InvalidUpload):
+    """L'upload non è più utilizzabile: blocchi scaduti o foto eliminata."""
+
+
+def part_path(upload) -> Path:
+    return Path(settings.POD_CHUNKED_UPLOAD_DIR) / f"{upload.uuid}.part"
+
+
+def create_upload(pod_record, kind: str, content_type: str, size: int,
+                  sha256: str = "") -> PODChunkedUpload:
+    upload = PODChunkedUpload.objects.create(
+        pod_record=pod_record,
+        kind=kind,
+        content_type=content_type,
+        length=size,
+        sha256=sha256,
+    )
+    path = part_path(upload)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.touch()
+    return upload
+
+
+def append_chunk(upload, offset: int, stream, length: int) -> int:
+    """
+    Scrive un blocco a partire da `offset` e ritorna il nuovo offset. Se il
+    corpo arriva troncato (client disconnesso) tiene i byte ricevuti.
+    """
+    if upload.status != PODChunkedUpload.Status.UPLOADING:
+        raise OffsetMismatch(upload.length)
+    if offset + length > upload.length:
+        raise InvalidUpload(f"Blocco oltre i {upload.length} byte dichiarati")
+
+    path = part_path(upload)
+    try:
+        part = open(path, "r+b")
+    except FileNotFoundError:
+        raise UploadGone("Upload scaduto")
+    with part:
+        # Il lock sul file serializza PATCH concorrenti dello stesso upload
+        # (reinvii del client), anche tra processi diversi
+        fcntl.flock(part, fcntl.LOCK_EX)
+        current = PODChunkedUpload.objects.values_list("offset", flat=True).get(pk=upload.pk)
+        if offset != current:
+            raise OffsetMismatch(current)
+
+        # Eventuali byte oltre l'offset registrato sono di una scrittura interrotta
+        part.truncate(offset)
+        part.seek(offset)
+        received = 0
+        while received < length:
+            try:
+                chunk = stream.read(min(_CHUNK_SIZE, length - received))
+            except OSError:
+                break
+            if not chunk:
+                break
+            part.write(chunk)
+            received += len(chunk)
+        part.flush()
+        os.fsync(part.fileno())
+
+        upload.offset = offset + received
+        PODChunkedUpload.objects.filter(pk=upload.pk).update(
+            offset=upload.offset, updated_at=timezone.now(),
+        )
+    return upload.offset
+
+
+def finish_upload(upload, caption: str = "", taken_at=None, latitude=None, longitude=None):
+    """
+    Registra l'immagine di un upload completo. Ritorna (istanza, creata): il
+    PODPhoto per le foto, il PODRecord per la firma. Idempotente, così un
+    client può ripetere la conclusione.
+    """
+    with transaction.atomic():
+        # Il lock sull'upload serializza conclusioni concorrenti: la seconda
+        # lo trova già completo invece di cercare i blocchi già rimossi
+        list(PODChunkedUpload.objects.select_for_update().filter(pk=upload.pk).values_list("pk"))
+        upload.refresh_from_db(fields=["status", "offset", "sha256", "photo"])
+        if upload.status == PODChunkedUpload.Status.COMPLETE:
+            if upload.kind == KIND_SIGNATURE:
+                return upload.pod_record, False
+            if upload.photo is None:
+                raise UploadGone("La foto di questo upload è stata eliminata")
+            return upload.photo, False
+        if upload.offset < upload.length:
+            raise InvalidUpload(
+                f"Upload incompleto: ricevuti {upload.offset} di {upload.length} byte"
+            )
+
+        path = part_path(upload)
+        try:
+            part = open(path, "rb")
+        except FileNotFoundError:
+            raise UploadGone("Upload scaduto")
+        with part:
+            hasher = hashlib.sha256()
+            for chunk in iter(lambda: part.read(_CHUNK_SIZE), b""):
+                hasher.update(chunk)
+            sha256 = hasher.hexdigest()
+            if upload.sha256 and sha256 != upload.sha256:
+                raise InvalidUpload("Contenuto diverso dallo SHA-256 dichiarato")
+            part.seek(0)
+
+            image = File(part, name=f"{upload.uuid}.{UPLOAD_CONTENT_TYPES[upload.content_type]}")
+            image.sha256 = sha256
+            if upload.kind == KIND_SIGNATURE:
+                instance, created = _register_signature(upload.pod_record, image)
+            else:
+                instance, created = create_photo(
+                    upload.pod_record, image,
+                    caption=caption, taken_at=taken_at, latitude=latitude, longitude=longitude,
+                )
+                upload.photo = instance
+                if created:
+                    schedule_media_processing(photo_ids=[instance.id])
+            upload.status = PODChunkedUpload.Status.COMPLETE
+            upload.sha256 = sha256
+            upload.save(update_fields=["status", "sha256", "photo", "updated_at"])
+            transaction.on_commit(lambda: path.unlink(missing_ok=True))
+    return instance, created
+
+
+def _register_signature(pod_record, image):
+    # Il lock sul POD serializza con gli altri canali di upload della firma
+    pod_record = PODRecord.objects.select_for_update().get(pk=pod_record.pk)
+    if pod_record.signature_image:
+        return pod_record, False
+    pod_record.signature_image.name = store_content(image, SIGNATURE_PREFIX, image.sha256)
+    pod_record.save(update_fields=["signature_image", "updated_at"])
+    schedule_media_processing(pod_record_ids=[pod_record.id])
+    return pod_record, True
+
+
+def delete_upload(upload) -> None:
+    part_path(upload).unlink(missing_ok=True)
+    upload.delete()
+
+
+def purge_stale_uploads(now=None) -> int:
+    """Elimina gli upload fermi da oltre CHUNKED_UPLOAD_EXPIRY e i blocchi orfani."""
+    cutoff = (now or timezone.now()) - CHUNKED_UPLOAD_EXPIRY
+    stale = list(PODChunkedUpload.objects.filter(updated_at__lt=cutoff))
+    for upload in stale:
+        delete_upload(upload)
+
+    # File rimasti senza upload (record eliminato con il POD, crash)
+    directory = Path(settings.POD_CHUNKED_UPLOAD_DIR)
+    if directory.is_dir():
+        active = {str(uuid) for uuid in PODChunkedUpload.objects.values_list("uuid", flat=True)}
+        for path in directory.glob("*.part"):
+            if path.stem in active or path.stat().st_mtime >= cutoff.timestamp():
+                continue
+            logger.info(f"Blocco di upload orfano eliminato: {path.name}")
+            path.unlink(missing_ok=True)
+    return len(stale)
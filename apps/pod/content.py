@@ -0,0 +1,70 @@
+"""
+Storage delle immagini POD indirizzato per contenuto.
+
+Foto e firme sono salvate in <prefisso>/sha256/<aa>/<bb>/<hash>.<ext>: la
+stessa immagine caricata più volte (reinvii della PWA su rete instabile)
+occupa un solo file. L'hash arriva già calcolato dall'upload handler
+(apps.common.uploadhandlers.SHA256UploadHandler) mentre il file viene
+ricevuto; per i file che non passano da lì si calcola leggendo a blocchi.
+"""
+import hashlib
+import os
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from .models import PODPhoto, PODRecord
+
+PHOTO_PREFIX = "pod/photos"
+SIGNATURE_PREFIX = "pod/signatures"
+
+
+def content_name(prefix: str, sha256: str, extension: str) -> str:
+    return f"{prefix}/sha256/{sha256[:2]}/{sha256[2:4]}/{sha256}{extension.lower()}"
+
+
+def is_content_name(name: str) -> bool:
+    return "/sha256/" in (name or "")
+
+
+def file_sha256(file) -> str:
+    """SHA-256 di un file (caricato o su storage), dall'upload handler se c'è."""
+    sha256 = getattr(file, "sha256", None)
+    if sha256:
+        return sha256
+    hasher = hashlib.sha256()
+    file.open("rb")
+    try:
+        for chunk in file.chunks():
+            hasher.update(chunk)
+    finally:
+        file.seek(0)
+    return hasher.hexdigest()
+
+
+def store_content(file, prefix: str, sha256: str | None = None) -> str:
+    """Salva il file nel percorso del suo hash, se non c'è già, e ne ritorna il nome."""
+    sha256 = sha256 or file_sha256(file)
+    extension = os.path.splitext(file.name or "")[1] or ".jpg"
+    name = content_name(prefix, sha256, extension)
+    if default_storage.exists(name):
+        return name
+    return default_storage.save(name, file)
+
+
+def create_photo(pod_record, image, **fields):
+    """
+    Registra una foto del POD, o ritorna quella con lo stesso contenuto già
+    presente. Ritorna (foto, creata).
+    """
+    sha256 = file_sha256(image)
+    with transaction.atomic():
+        # Il lock sul POD serializza i reinvii concorrenti della stessa foto
+        list(PODRecord.objects.select_for_update().filter(pk=pod_record.pk).values_list("pk"))
+        photo = PODPhoto.objects.filter(pod_record=pod_record, sha256=sha256).first()
+        if photo:
+            return photo, False
+        photo = PODPhoto(pod_record=pod_record, sha256=sha256, **fields)
+        photo.image.name = store_content(image, PHOTO_PREFIX, sha256)
+        photo.save()
+    return photo, True
@@ -0,0 +1,142 @@
+import os
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from apps.pod.content import (
+    PHOTO_PREFIX,
+    SIGNATURE_PREFIX,
+    content_name,
+    file_sha256,
+    is_content_name,
+)
+from apps.pod.models import PODPhoto, PODRecord
+from apps.tracking.cache import invalidate_tracking
+
+
+class Command(BaseCommand):
+    help = (
+        "Porta foto e firme POD esistenti sullo storage indirizzato per contenuto "
+        "ed elimina foto duplicate e file non più referenziati"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=200, help="POD per blocco")
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="Calcola e mostra i conteggi senza modificare nulla",
+        )
+
+    def handle(self, *args, **options):
+        self.dry_run = options["dry_run"]
+        self.stats = {"duplicates": 0, "moved": 0, "deleted_files": 0, "missing": 0}
+
+        last_pk = 0
+        while True:
+            records = list(
+                PODRecord.objects.filter(pk__gt=last_pk)
+                .select_related("shipment")
+                .order_by("pk")[:options["batch_size"]]
+            )
+            if not records:
+                break
+            photos = {}
+            for photo in PODPhoto.objects.filter(pod_record__in=records).order_by("created_at", "id"):
+                photos.setdefault(photo.pod_record_id, []).append(photo)
+            for record in records:
+                self.dedupe_record(record, photos.get(record.pk, []))
+            last_pk = records[-1].pk
+            self.stdout.write(f"POD fino a {last_pk}: {self.stats}")
+
+        prefix = "[dry-run] " if self.dry_run else ""
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}Completato: {self.stats['duplicates']} foto duplicate, "
+            f"{self.stats['moved']} file spostati, {self.stats['deleted_files']} file eliminati, "
+            f"{self.stats['missing']} file mancanti"
+        ))
+
+    def dedupe_record(self, record, photos):
+        seen = set()
+        duplicates = []
+        moves = []
+        for photo in photos:
+            # Sempre dal contenuto: l'hash salvato può essere quello dichiarato
+            # dal client (upload diretto su S3) e non verificato
+            sha256 = self.sha256_of(photo.image)
+            if sha256 is None:
+                continue
+            if sha256 in seen:
+                duplicates.append(photo)
+                continue
+            seen.add(sha256)
+            target = content_name(PHOTO_PREFIX, sha256, os.path.splitext(photo.image.name)[1])
+            if photo.image.name != target or photo.sha256 != sha256:
+                moves.append((photo, sha256, target))
+
+        self.stats["duplicates"] += len(duplicates)
+        if not self.dry_run:
+            for photo in duplicates:
+                names = [photo.image.name, photo.thumbnail.name, photo.web_image.name]
+                photo.delete()
+                self.delete_unreferenced(*names)
+            if duplicates:
+                invalidate_tracking(record.shipment.public_tracking_token)
+
+        # Gli hash dichiarati e sbagliati si azzerano prima, per non violare
+        # l'unicità (pod_record, sha256) quando si scrivono quelli veri
+        wrong = [photo.pk for photo, sha256, _ in moves if photo.sha256 and photo.sha256 != sha256]
+        if wrong and not self.dry_run:
+            PODPhoto.objects.filter(pk__in=wrong).update(sha256="")
+
+        for photo, sha256, target in moves:
+            old_name = photo.image.name
+            if old_name != target:
+                self.stats["moved"] += 1
+                if not self.dry_run:
+                    self.copy(photo.image, target)
+            if not self.dry_run:
+                PODPhoto.objects.filter(pk=photo.pk).update(image=target, sha256=sha256)
+                self.delete_unreferenced(old_name)
+
+        if record.signature_image and not is_content_name(record.signature_image.name):
+            old_name = record.signature_image.name
+            sha256 = self.sha256_of(record.signature_image)
+            if sha256 is None:
+                return
+            target = content_name(SIGNATURE_PREFIX, sha256, os.path.splitext(old_name)[1])
+            if old_name != target:
+                self.stats["moved"] += 1
+                if not self.dry_run:
+                    self.copy(record.signature_image, target)
+                    PODRecord.objects.filter(pk=record.pk).update(signature_image=target)
+                    self.delete_unreferenced(old_name)
+
+    def sha256_of(self, field):
+        try:
+            return file_sha256(field)
+        except OSError:
+            self.stderr.write(f"File mancante: {field.name}")
+            self.stats["missing"] += 1
+            return None
+        finally:
+            field.close()
+
+    def copy(self, field, target):
+        if default_storage.exists(target):
+            return
+        with field.open("rb"):
+            saved = default_storage.save(target, field)
+        if saved != target:
+            default_storage.delete(saved)
+            raise RuntimeError(f"Impossibile salvare {target}: salvato come {saved}")
+
+    def delete_unreferenced(self, *names):
+        for name in filter(None, names):
+            referenced = (
+                PODPhoto.objects.filter(Q(image=name) | Q(thumbnail=name) | Q(web_image=name)).exists()
+                or PODRecord.objects.filter(Q(signature_image=name) | Q(signature_web=name)).exists()
+            )
+            if not referenced and default_storage.exists(name):
+                default_storage.delete(name)
+                self.stats["deleted_files"] += 1
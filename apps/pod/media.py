@@ -0,0 +1,107 @@
+"""
+Elaborazione delle immagini POD dopo l'upload (task Celery in apps.pod.tasks).
+
+Per ogni foto genera una miniatura di dimensione fissa e una versione web
+ridotta, in WebP (JPEG se Pillow non lo supporta); registra dimensioni e
+peso dell'originale e, se manca, la data di scatto dall'EXIF. Per la firma
+genera solo la versione web. Gli originali restano intatti.
+"""
+from datetime import datetime
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.utils import timezone
+from PIL import Image, ImageOps, features
+
+THUMBNAIL_SIZE = (320, 240)
+WEB_MAX_DIMENSION = 1280
+SIGNATURE_MAX_DIMENSION = 600
+
+THUMBNAIL_QUALITY = 70
+WEB_QUALITY = 80
+
+_EXIF_IFD = 0x8769
+_EXIF_DATETIME_ORIGINAL = 0x9003
+_EXIF_DATETIME = 0x0132
+
+
+def rendition_format() -> tuple[str, str]:
+    """(formato Pillow, estensione) delle versioni generate."""
+    return ("WEBP", "webp") if features.check("webp") else ("JPEG", "jpg")
+
+
+def open_image(field) -> Image.Image:
+    """Apre e decodifica un'immagine dallo storage."""
+    with field.open("rb") as f:
+        image = Image.open(f)
+        image.load()
+    return image
+
+
+def exif_taken_at(image: Image.Image):
+    """Data di scatto dall'EXIF (ora locale della fotocamera), o None."""
+    exif = image.getexif()
+    value = exif.get_ifd(_EXIF_IFD).get(_EXIF_DATETIME_ORIGINAL) or exif.get(_EXIF_DATETIME)
+    try:
+        taken_at = datetime.strptime(str(value).strip("\x00 "), "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        return None
+    return timezone.make_aware(taken_at)
+
+
+def encode(image: Image.Image, quality: int) -> bytes:
+    image_format, _ = rendition_format()
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGBA")
+        if image_format == "JPEG":
+            # JPEG non ha trasparenza: fondo bianco (firme)
+            background = Image.new("RGB", image.size, "white")
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+    buffer = BytesIO()
+    if image_format == "WEBP":
+        image.save(buffer, "WEBP", quality=quality, method=4)
+    else:
+        image.save(buffer, "JPEG", quality=quality, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def downscale(image: Image.Image, max_dimension: int) -> Image.Image:
+    image = image.copy()
+    image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+    return image
+
+
+def process_photo(photo) -> None:
+    """Genera miniatura e versione web della foto e ne aggiorna i metadati."""
+    original = open_image(photo.image)
+    if photo.taken_at is None:
+        photo.taken_at = exif_taken_at(original)
+    image = ImageOps.exif_transpose(original)
+
+    photo.width, photo.height = image.size
+    photo.file_size = photo.image.size
+    _, extension = rendition_format()
+    name = f"{photo.uuid}.{extension}"
+
+    thumbnail = ImageOps.fit(image, THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
+    photo.thumbnail.save(name, ContentFile(encode(thumbnail, THUMBNAIL_QUALITY)), save=False)
+    photo.web_image.save(
+        name, ContentFile(encode(downscale(image, WEB_MAX_DIMENSION), WEB_QUALITY)), save=False,
+    )
+    photo.processed_at = timezone.now()
+    photo.save(update_fields=[
+        "thumbnail", "web_image", "width", "height", "file_size", "taken_at",
+        "processed_at", "updated_at",
+    ])
+
+
+def process_signature(pod_record) -> None:
+    """Genera la versione web della firma."""
+    image = downscale(open_image(pod_record.signature_image), SIGNATURE_MAX_DIMENSION)
+    _, extension = rendition_format()
+    pod_record.signature_web.save(
+        f"{pod_record.uuid}.{extension}", ContentFile(encode(image, WEB_QUALITY)), save=False,
+    )
+    pod_record.signature_processed_at = timezone.now()
+    pod_record.save(update_fields=["signature_web", "signature_processed_at", "updated_at"])
@@ -41,6 +41,12 @@ class PODRecord(UUIDModel, TimeStampedModel):
     signature_image = models.ImageField(
         "Firma", upload_to="pod/signatures/%Y/%m/%d/", blank=True,
     )
+    # Versione per il web generata da apps.pod.media
+    signature_web = models.ImageField(upload_to="pod/signatures/web/%Y/%m/%d/", blank=True)
+    # Elaborazione conclusa, anche senza versione web (immagine non decodificabile)
+    signature_processed_at = models.DateTimeField(null=True, blank=True)
+    # In alternativa all'immagine: tratti della firma (formato in apps.pod.signature)
+    signature_strokes = models.JSONField("Firma (tratti)", null=True, blank=True)
 
     # Sincronizzazione offline
     synced_from_offline = models.BooleanField(default=False)
@@ -65,6 +71,21 @@ class PODRecord(UUIDModel, TimeStampedModel):
     def __str__(self):
         return f"POD {self.shipment.tracking_code} - {self.get_delivery_result_display()}"
 
+    @property
+    def has_signature(self) -> bool:
+        return bool(self.signature_image or self.signature_strokes)
+
+    @property
+    def signature_url(self) -> str:
+        signature = self.signature_web or self.signature_image
+        if signature:
+            return signature.url
+        if self.signature_strokes:
+            from .signature import signature_data_uri
+
+            return signature_data_uri(self.signature_strokes)
+        return ""
+
 
 class PODPhoto(UUIDModel, TimeStampedModel):
     pod_record = models.ForeignKey(
@@ -73,11 +94,79 @@ class PODPhoto(UUIDModel, TimeStampedModel):
     image = models.ImageField("Foto", upload_to="pod/photos/%Y/%m/%d/")
     caption = models.CharField(max_length=255, blank=True)
     taken_at = models.DateTimeField(null=True, blank=True)
+    # Posizione di scatto dall'EXIF originale: la PWA ricomprime la foto e
+    # scarta tutti gli altri metadati
+    latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    # Identificativo della foto nella coda offline della PWA (dedup dei reinvii)
+    local_photo_id = models.CharField(max_length=64, blank=True)
+    # Hash del contenuto: il file è salvato in un percorso derivato dall'hash
+    # (apps.pod.content) e un reinvio della stessa foto non crea un'altra riga
+    sha256 = models.CharField(max_length=64, blank=True)
+
+    # Versioni ridotte e metadati dell'originale, generati da apps.pod.media
+    thumbnail = models.ImageField(upload_to="pod/photos/thumbs/%Y/%m/%d/", blank=True)
+    web_image = models.ImageField(upload_to="pod/photos/web/%Y/%m/%d/", blank=True)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    file_size = models.PositiveIntegerField("Dimensione (byte)", null=True, blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         db_table = "pod_photo"
         verbose_name = "Foto POD"
         verbose_name_plural = "Foto POD"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["pod_record", "local_photo_id"],
+                name="unique_offline_pod_photo",
+                condition=~models.Q(local_photo_id=""),
+            ),
+            models.UniqueConstraint(
+                fields=["pod_record", "sha256"],
+                name="unique_pod_photo_content",
+                condition=~models.Q(sha256=""),
+            ),
+        ]
 
     def __str__(self):
         return f"Foto {self.pod_record.shipment.tracking_code}"
+
+    # Finché l'elaborazione non è conclusa si ripiega sull'originale
+    @property
+    def thumbnail_url(self) -> str:
+        return (self.thumbnail or self.web_image or self.image).url
+
+    @property
+    def web_url(self) -> str:
+        return (self.web_image or self.image).url
+
+
+class PODChunkedUpload(UUIDModel, TimeStampedModel):
+    """Upload riprendibile a blocchi di una foto o della firma (apps.pod.chunked)."""
+
+    class Status(models.TextChoices):
+        UPLOADING = "uploading", "In corso"
+        COMPLETE = "complete", "Completato"
+
+    pod_record = models.ForeignKey(
+        PODRecord, on_delete=models.CASCADE, related_name="chunked_uploads",
+    )
+    kind = models.CharField(max_length=20)
+    content_type = models.CharField(max_length=50)
+    length = models.PositiveIntegerField()
+    offset = models.PositiveIntegerField(default=0)
+    sha256 = models.CharField(max_length=64, blank=True)
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.UPLOADING)
+    photo = models.ForeignKey(
+        PODPhoto, on_delete=models.SET_NULL, null=True, blank=True, related_name="+",
+    )
+
+    class Meta:
+        db_table = "pod_chunked_upload"
+        indexes = [
+            models.Index(fields=["status", "updated_at"]),
+        ]
+
+    def __str__(self):
+        return f"Upload {self.uuid} ({self.offset}/{self.length})"
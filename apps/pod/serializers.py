@@ -1,13 +1,50 @@
+from django.conf import settings
 from rest_framework import serializers
 
 from .models import PODPhoto, PODRecord
+from .signature import InvalidStrokes, validate_strokes
+from .uploads import KIND_PHOTO, KIND_SIGNATURE, UPLOAD_CONTENT_TYPES
+
+
+def validate_upload_size(image):
+    """Rifiuta le immagini oltre POD_UPLOAD_MAX_BYTES (la PWA le ricomprime prima)."""
+    if image and image.size > settings.POD_UPLOAD_MAX_BYTES:
+        raise serializers.ValidationError(
+            f"Immagine troppo grande: massimo {settings.POD_UPLOAD_MAX_BYTES} byte",
+        )
+    return image
+
+
+class SignatureStrokesField(serializers.JSONField):
+    """Firma vettoriale (apps.pod.signature); nel multipart arriva come stringa JSON."""
+
+    def to_internal_value(self, data):
+        try:
+            return validate_strokes(super().to_internal_value(data))
+        except InvalidStrokes as e:
+            raise serializers.ValidationError(str(e))
 
 
 class PODPhotoSerializer(serializers.ModelSerializer):
     class Meta:
         model = PODPhoto
-        fields = ("uuid", "image", "caption", "taken_at")
-        read_only_fields = ("uuid",)
+        fields = (
+            "uuid", "image", "thumbnail", "web_image", "caption", "taken_at",
+            "latitude", "longitude", "width", "height", "file_size",
+        )
+        read_only_fields = ("uuid", "thumbnail", "web_image", "width", "height", "file_size")
+
+
+class PODPhotoUploadSerializer(serializers.Serializer):
+    image = serializers.ImageField(validators=[validate_upload_size])
+    caption = serializers.CharField(required=False, default="", allow_blank=True)
+    taken_at = serializers.DateTimeField(required=False, allow_null=True)
+    latitude = serializers.DecimalField(
+        max_digits=9, decimal_places=6, required=False, allow_null=True,
+    )
+    longitude = serializers.DecimalField(
+        max_digits=9, decimal_places=6, required=False, allow_null=True,
+    )
 
 
 class PODRecordSerializer(serializers.ModelSerializer):
@@ -18,10 +55,10 @@ class PODRecordSerializer(serializers.ModelSerializer):
         fields = (
             "uuid", "delivery_result", "recipient_signer_name", "notes",
             "recorded_at", "latitude", "longitude",
-            "signature_image", "photos",
+            "signature_image", "signature_web", "signature_strokes", "photos",
             "synced_from_offline", "created_at",
         )
-        read_only_fields = ("uuid",)
+        read_only_fields = ("uuid", "signature_web")
 
 
 class PODCreateSerializer(serializers.Serializer):
@@ -35,7 +72,8 @@ class PODCreateSerializer(serializers.Serializer):
     longitude = serializers.DecimalField(
         max_digits=9, decimal_places=6, required=False, allow_null=True,
     )
-    signature_image = serializers.ImageField(required=False)
+    signature_image = serializers.ImageField(required=False, validators=[validate_upload_size])
+    signature_strokes = SignatureStrokesField(required=False, allow_null=True)
 
     # Offline sync fields
     synced_from_offline = serializers.BooleanField(default=False)
@@ -57,5 +95,62 @@ class PODSyncSerializer(serializers.Serializer):
     longitude = serializers.DecimalField(
         max_digits=9, decimal_places=6, required=False, allow_null=True,
     )
+    # La firma vettoriale viaggia nel batch JSON, senza upload a parte
+    signature_strokes = SignatureStrokesField(required=False, allow_null=True)
     device_uuid = serializers.CharField()
     local_record_id = serializers.CharField()
+
+
+class PODPhotoSyncSerializer(serializers.Serializer):
+    """Foto (o firma) di un POD offline, nel batch multipart di sincronizzazione."""
+
+    KIND_PHOTO = "photo"
+    KIND_SIGNATURE = "signature"
+
+    device_uuid = serializers.CharField()
+    local_record_id = serializers.CharField()
+    local_photo_id = serializers.CharField(max_length=64)
+    kind = serializers.ChoiceField(choices=[KIND_PHOTO, KIND_SIGNATURE], default=KIND_PHOTO)
+    caption = serializers.CharField(required=False, default="", allow_blank=True)
+    taken_at = serializers.DateTimeField(required=False, allow_null=True)
+    latitude = serializers.DecimalField(
+        max_digits=9, decimal_places=6, required=False, allow_null=True,
+    )
+    longitude = serializers.DecimalField(
+        max_digits=9, decimal_places=6, required=False, allow_null=True,
+    )
+    image = serializers.ImageField(validators=[validate_upload_size])
+
+
+class PODUploadRequestSerializer(serializers.Serializer):
+    """Richiesta di upload diretto di un'immagine del POD."""
+
+    kind = serializers.ChoiceField(choices=[KIND_PHOTO, KIND_SIGNATURE], default=KIND_PHOTO)
+    content_type = serializers.ChoiceField(choices=list(UPLOAD_CONTENT_TYPES))
+    size = serializers.IntegerField(min_value=1)
+    # Facoltativo: una foto già registrata con lo stesso hash non si ricarica
+    sha256 = serializers.RegexField(r"^[0-9a-f]{64}$", required=False, default="")
+
+    def validate_size(self, value):
+        if value > settings.POD_UPLOAD_MAX_BYTES:
+            raise serializers.ValidationError(
+                f"Immagine troppo grande: massimo {settings.POD_UPLOAD_MAX_BYTES} byte",
+            )
+        return value
+
+
+class PODImageMetadataSerializer(serializers.Serializer):
+    """Metadati registrati con un'immagine caricata a parte (diretta o a blocchi)."""
+
+    caption = serializers.CharField(required=False, default="", allow_blank=True)
+    taken_at = serializers.DateTimeField(required=False, allow_null=True, default=None)
+    latitude = serializers.DecimalField(
+        max_digits=9, decimal_places=6, required=False, allow_null=True, default=None,
+    )
+    longitude = serializers.DecimalField(
+        max_digits=9, decimal_places=6, required=False, allow_null=True, default=None,
+    )
+
+
+class PODUploadConfirmSerializer(PODImageMetadataSerializer):
+    token = serializers.CharField()
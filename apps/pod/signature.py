@@ -0,0 +1,164 @@
+"""
+Firma vettoriale dei POD: i tratti catturati dal canvas della PWA.
+
+    {"v": 1, "w": 360, "h": 200, "strokes": [[x0, y0, t0, dx, dy, dt, ...], ...]}
+
+Ogni tratto è una lista piatta di interi: il primo punto è assoluto (pixel
+del canvas w×h, millisecondi dall'inizio della firma), i successivi sono
+differenze dal punto precedente. Pochi KB invece delle centinaia di un PNG,
+abbastanza da viaggiare dentro il batch JSON della sincronizzazione offline.
+
+SVG e PNG si generano solo quando servono (tracking, backoffice, PDF, API) e
+restano in cache: la chiave è l'hash dei tratti, che non cambiano.
+"""
+import base64
+import hashlib
+import json
+from io import BytesIO
+
+from django.core.cache import cache
+from PIL import Image, ImageColor, ImageDraw
+
+from .media import SIGNATURE_MAX_DIMENSION
+
+STROKES_VERSION = 1
+MAX_CANVAS_DIMENSION = 4096
+MAX_STROKES = 200
+MAX_POINTS = 10000
+# Coordinate entro ±MAX_CANVAS_DIMENSION, tempi entro un'ora dal primo tratto
+MAX_SIGNATURE_DURATION_MS = 60 * 60 * 1000
+
+STROKE_WIDTH = 2.5
+STROKE_COLOR = "#111"
+# Il PNG si disegna più grande e si riduce, per avere i bordi sfumati
+_SUPERSAMPLE = 4
+
+SIGNATURE_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+
+
+class InvalidStrokes(ValueError):
+    pass
+
+
+def _is_int(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def validate_strokes(data) -> dict:
+    """Verifica il formato dei tratti e ne ritorna la forma normalizzata."""
+    if not isinstance(data, dict):
+        raise InvalidStrokes("Firma vettoriale non valida: atteso un oggetto")
+    if data.get("v") != STROKES_VERSION:
+        raise InvalidStrokes(f"Versione della firma non supportata: {data.get('v')!r}")
+    width, height = data.get("w"), data.get("h")
+    if not all(_is_int(n) and 0 < n <= MAX_CANVAS_DIMENSION for n in (width, height)):
+        raise InvalidStrokes("Dimensioni del canvas non valide")
+
+    strokes = data.get("strokes")
+    if not isinstance(strokes, list) or not strokes:
+        raise InvalidStrokes("La firma non contiene tratti")
+    if len(strokes) > MAX_STROKES:
+        raise InvalidStrokes(f"Firma troppo complessa: massimo {MAX_STROKES} tratti")
+    points = 0
+    for stroke in strokes:
+        if (
+            not isinstance(stroke, list) or not stroke or len(stroke) % 3
+            or not all(_is_int(n) for n in stroke)
+        ):
+            raise InvalidStrokes("Tratto non valido: attese terne di interi")
+        points += len(stroke) // 3
+        if points > MAX_POINTS:
+            break
+        # Limiti sui punti assoluti, quindi anche sui delta: valori enormi
+        # farebbero fallire il rendering
+        x = y = t = 0
+        for i in range(0, len(stroke), 3):
+            x, y, t = x + stroke[i], y + stroke[i + 1], t + stroke[i + 2]
+            if abs(x) > MAX_CANVAS_DIMENSION or abs(y) > MAX_CANVAS_DIMENSION:
+                raise InvalidStrokes(
+                    f"Tratto non valido: coordinate oltre ±{MAX_CANVAS_DIMENSION}"
+                )
+            if not 0 <= t <= MAX_SIGNATURE_DURATION_MS:
+                raise InvalidStrokes("Tratto non valido: tempi fuori intervallo")
+    if points > MAX_POINTS:
+        raise InvalidStrokes(f"Firma troppo complessa: massimo {MAX_POINTS} punti")
+
+    return {"v": STROKES_VERSION, "w": width, "h": height, "strokes": strokes}
+
+
+def decode_strokes(data) -> list[list[tuple[int, int, int]]]:
+    """Tratti come liste di punti assoluti (x, y, t)."""
+    decoded = []
+    for stroke in data["strokes"]:
+        x = y = t = 0
+        points = []
+        for i in range(0, len(stroke), 3):
+            x, y, t = x + stroke[i], y + stroke[i + 1], t + stroke[i + 2]
+            points.append((x, y, t))
+        decoded.append(points)
+    return decoded
+
+
+def strokes_key(data) -> str:
+    canonical = json.dumps(data, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def render_svg(data) -> str:
+    # I delta dei tratti sono già le coordinate relative del path ("l")
+    path = " ".join(
+        f"M{stroke[0]} {stroke[1]}l"
+        + (" ".join(f"{stroke[i]} {stroke[i + 1]}" for i in range(3, len(stroke), 3)) or "0 0")
+        for stroke in data["strokes"]
+    )
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {data["w"]} {data["h"]}" '
+        f'width="{data["w"]}" height="{data["h"]}">'
+        f'<path d="{path}" fill="none" stroke="{STROKE_COLOR}" stroke-width="{STROKE_WIDTH}" '
+        f'stroke-linecap="round" stroke-linejoin="round"/></svg>'
+    )
+
+
+def render_png(data, max_dimension: int = SIGNATURE_MAX_DIMENSION) -> bytes:
+    scale = min(1.0, max_dimension / max(data["w"], data["h"]))
+    size = (max(1, round(data["w"] * scale)), max(1, round(data["h"] * scale)))
+    factor = scale * _SUPERSAMPLE
+    width = max(1, round(STROKE_WIDTH * factor))
+    radius = width / 2
+
+    image = Image.new("L", (size[0] * _SUPERSAMPLE, size[1] * _SUPERSAMPLE), 255)
+    draw = ImageDraw.Draw(image)
+    color = ImageColor.getcolor(STROKE_COLOR, "L")
+    for stroke in decode_strokes(data):
+        points = [(x * factor, y * factor) for x, y, _ in stroke]
+        if len(points) > 1:
+            draw.line(points, fill=color, width=width, joint="curve")
+        # Estremi arrotondati, e i tratti di un solo punto
+        for x, y in {points[0], points[-1]}:
+            draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=color)
+
+    buffer = BytesIO()
+    image.resize(size, Image.Resampling.LANCZOS).save(buffer, "PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def signature_svg(strokes) -> str:
+    return cache.get_or_set(
+        f"pod:signature:svg:{strokes_key(strokes)}",
+        lambda: render_svg(strokes),
+        SIGNATURE_CACHE_TIMEOUT,
+    )
+
+
+def signature_png(strokes) -> bytes:
+    return cache.get_or_set(
+        f"pod:signature:png:{strokes_key(strokes)}",
+        lambda: render_png(strokes),
+        SIGNATURE_CACHE_TIMEOUT,
+    )
+
+
+def signature_data_uri(strokes) -> str:
+    """SVG della firma come data URI, da usare in <img> (pagine e PDF)."""
+    encoded = base64.b64encode(signature_svg(strokes).encode()).decode()
+    return f"data:image/svg+xml;base64,{encoded}"
@@ -0,0 +1,225 @@
+"""Sincronizzazione in blocco dei POD registrati offline dalla PWA."""
+from django.db import transaction
+
+from apps.shipments.models import Shipment
+from apps.shipments.state_machine import InvalidTransitionError, apply_transitions_bulk
+from apps.tracking.cache import invalidate_tracking
+
+from .content import PHOTO_PREFIX, SIGNATURE_PREFIX, file_sha256, store_content
+from .models import PODPhoto, PODRecord
+from .tasks import schedule_media_processing
+
+SYNC_MAX_RECORDS = 500
+SYNC_MAX_PHOTOS = 20
+
+
+def status_for_delivery_result(delivery_result: str) -> str:
+    """Stato spedizione corrispondente all'esito del POD."""
+    if delivery_result in ("delivered", "partial"):
+        return "delivered"
+    return "not_delivered"
+
+
+def sync_offline_pods(records, driver, user=None):
+    """
+    Registra un blocco di POD offline già validati (PODSyncSerializer).
+
+    Tutte le spedizioni sono risolte e bloccate con una sola query, i duplicati
+    (device_uuid, local_record_id) sono individuati con una sola query, i
+    PODRecord e gli eventi sono inseriti con bulk_create e le transizioni di
+    stato applicate in blocco. Ritorna un risultato per record, nello stesso
+    ordine: "created", "duplicate", "unknown_shipment" o "invalid_transition"
+    (POD registrato ma stato della spedizione invariato).
+    """
+    results = [None] * len(records)
+    pending = []
+
+    with transaction.atomic():
+        # Il lock sulle spedizioni serializza sync concorrenti degli stessi record
+        shipments = (
+            Shipment.objects.select_for_update()
+            .order_by("pk")
+            .in_bulk({record["shipment_uuid"] for record in records}, field_name="uuid")
+        )
+
+        # Anche i POD creati online: se la risposta si è persa il client ha
+        # messo in coda lo stesso record, che va riconosciuto con il suo uuid
+        existing = {
+            (device_uuid, local_record_id): pod_uuid
+            for device_uuid, local_record_id, pod_uuid in PODRecord.objects.filter(
+                device_uuid__in={record["device_uuid"] for record in records},
+                local_record_id__in={record["local_record_id"] for record in records},
+            ).values_list("device_uuid", "local_record_id", "uuid")
+        }
+        shipments_with_pod = set(
+            PODRecord.objects.filter(
+                shipment_id__in=[shipment.pk for shipment in shipments.values()],
+            ).values_list("shipment_id", flat=True)
+        )
+
+        for index, record in enumerate(records):
+            key = (record["device_uuid"], record["local_record_id"])
+            result = {"local_record_id": record["local_record_id"]}
+            results[index] = result
+
+            if key in existing:
+                result.update(status="duplicate", uuid=str(existing[key]))
+                continue
+
+            shipment = shipments.get(record["shipment_uuid"])
+            if shipment is None:
+                result.update(status="unknown_shipment", error="Spedizione non trovata")
+                continue
+
+            if shipment.pk in shipments_with_pod:
+                # La spedizione ha già un POD (one-to-one)
+                result.update(status="duplicate")
+                continue
+
+            pod_record = PODRecord(
+                shipment=shipment,
+                driver=driver,
+                delivery_result=record["delivery_result"],
+                recipient_signer_name=record.get("recipient_signer_name", ""),
+                notes=record.get("notes", ""),
+                recorded_at=record["recorded_at"],
+                latitude=record.get("latitude"),
+                longitude=record.get("longitude"),
+                signature_strokes=record.get("signature_strokes"),
+                synced_from_offline=True,
+                device_uuid=record["device_uuid"],
+                local_record_id=record["local_record_id"],
+            )
+            existing[key] = pod_record.uuid
+            shipments_with_pod.add(shipment.pk)
+            pending.append((index, pod_record))
+
+        PODRecord.objects.bulk_create([pod_record for _, pod_record in pending])
+        # Anche i POD con transizione non valida compaiono nel tracking
+        invalidate_tracking(
+            *(pod_record.shipment.public_tracking_token for _, pod_record in pending)
+        )
+
+        outcomes = apply_transitions_bulk(
+            [
+                (
+                    pod_record.shipment,
+                    status_for_delivery_result(pod_record.delivery_result),
+                    {
+                        "description": (
+                            "POD offline sincronizzato: "
+                            f"{pod_record.get_delivery_result_display()}"
+                        ),
+                        "latitude": pod_record.latitude,
+                        "longitude": pod_record.longitude,
+                    },
+                )
+                for _, pod_record in pending
+            ],
+            user=user,
+        )
+
+    for (index, pod_record), outcome in zip(pending, outcomes):
+        result = results[index]
+        result["uuid"] = str(pod_record.uuid)
+        if isinstance(outcome, InvalidTransitionError):
+            result.update(status="invalid_transition", error=str(outcome))
+        else:
+            result["status"] = "created"
+
+    return results
+
+
+def sync_offline_photos(items, driver):
+    """
+    Registra un blocco di foto e firme di POD offline già validate
+    (PODPhotoSyncSerializer).
+
+    I POD del corriere sono risolti per (device_uuid, local_record_id) e le
+    foto già ricevute per local_photo_id o per contenuto (SHA-256), una query
+    ciascuno; le foto nuove sono inserite con bulk_create. Ritorna un risultato per elemento, nello
+    stesso ordine: "created", "duplicate" o "unknown_record" (POD non ancora
+    sincronizzato: il client riprova dopo).
+    """
+    results = []
+    photos = []
+    signed = []
+
+    with transaction.atomic():
+        # Il lock sui POD serializza reinvii concorrenti delle stesse foto.
+        # Vale anche per i POD creati online, come in sync_offline_pods
+        records = {
+            (record.device_uuid, record.local_record_id): record
+            for record in PODRecord.objects.select_for_update(of=("self",))
+            .select_related("shipment")
+            .filter(
+                driver=driver,
+                device_uuid__in={item["device_uuid"] for item in items},
+                local_record_id__in={item["local_record_id"] for item in items},
+            )
+        }
+        existing = set(
+            PODPhoto.objects.filter(
+                pod_record__in=records.values(),
+                local_photo_id__in={item["local_photo_id"] for item in items},
+            ).values_list("pod_record_id", "local_photo_id")
+        )
+        hashes = [file_sha256(item["image"]) for item in items]
+        existing_content = set(
+            PODPhoto.objects.filter(
+                pod_record__in=records.values(), sha256__in=set(hashes),
+            ).values_list("pod_record_id", "sha256")
+        )
+
+        for item, sha256 in zip(items, hashes):
+            result = {"local_photo_id": item["local_photo_id"]}
+            results.append(result)
+
+            record = records.get((item["device_uuid"], item["local_record_id"]))
+            if record is None:
+                result.update(status="unknown_record", error="POD non ancora sincronizzato")
+                continue
+
+            if item["kind"] == "signature":
+                if record.signature_image:
+                    result["status"] = "duplicate"
+                    continue
+                record.signature_image.name = store_content(
+                    item["image"], SIGNATURE_PREFIX, sha256,
+                )
+                signed.append(record)
+                result.update(status="created", uuid=str(record.uuid))
+                continue
+
+            key = (record.pk, item["local_photo_id"])
+            content_key = (record.pk, sha256)
+            if key in existing or content_key in existing_content:
+                result["status"] = "duplicate"
+                continue
+            existing.add(key)
+            existing_content.add(content_key)
+
+            photo = PODPhoto(
+                pod_record=record,
+                image=store_content(item["image"], PHOTO_PREFIX, sha256),
+                sha256=sha256,
+                caption=item.get("caption", ""),
+                taken_at=item.get("taken_at"),
+                latitude=item.get("latitude"),
+                longitude=item.get("longitude"),
+                local_photo_id=item["local_photo_id"],
+            )
+            photos.append(photo)
+            result.update(status="created", uuid=str(photo.uuid))
+
+        PODPhoto.objects.bulk_create(photos)
+        PODRecord.objects.bulk_update(signed, ["signature_image"])
+        schedule_media_processing(
+            photo_ids=[photo.id for photo in photos],
+            pod_record_ids=[record.id for record in signed],
+        )
+        invalidate_tracking(*{
+            photo.pod_record.shipment.public_tracking_token for photo in photos
+        } | {record.shipment.public_tracking_token for record in signed})
+
+    return results
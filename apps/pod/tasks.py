@@ -0,0 +1,133 @@
+import logging
+from datetime import timedelta
+
+from celery import shared_task
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# Le immagini rimaste senza versioni (task perso, worker fermo) sono riprese
+# dalla scansione periodica dopo MEDIA_RETRY_AFTER, fino a MEDIA_SWEEP_WINDOW
+MEDIA_RETRY_AFTER = timedelta(minutes=15)
+MEDIA_SWEEP_WINDOW = timedelta(days=2)
+MEDIA_SWEEP_LIMIT = 500
+
+# Errori di Pillow su immagini corrotte, troncate o troppo grandi: riprovare
+# non serve. Gli altri OSError (storage non raggiungibile) si riprovano
+UNDECODABLE_IMAGE_ERRORS = (
+    UnidentifiedImageError,
+    Image.DecompressionBombError,
+    Image.DecompressionBombWarning,
+    ValueError,
+    SyntaxError,
+)
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def process_pod_photo(self, photo_id: int):
+    """Miniatura, versione web e metadati di una foto POD."""
+    from apps.tracking.cache import invalidate_tracking
+
+    from .media import process_photo
+    from .models import PODPhoto
+
+    try:
+        photo = PODPhoto.objects.select_related("pod_record__shipment").get(id=photo_id)
+    except PODPhoto.DoesNotExist:
+        return
+    if photo.processed_at:
+        return
+
+    try:
+        process_photo(photo)
+    except UNDECODABLE_IMAGE_ERRORS as e:
+        # Non recuperabile: si continua a servire l'originale
+        logger.error(f"Foto POD {photo.uuid} non elaborabile: {e}")
+        PODPhoto.objects.filter(id=photo.id).update(processed_at=timezone.now())
+        return
+    except OSError as e:
+        # Originale illeggibile o storage non raggiungibile
+        logger.warning(f"Elaborazione foto POD {photo.uuid} fallita: {e}")
+        raise self.retry(exc=e)
+    invalidate_tracking(photo.pod_record.shipment.public_tracking_token)
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def process_pod_signature(self, pod_record_id: int):
+    """Versione web della firma di un POD."""
+    from apps.tracking.cache import invalidate_tracking
+
+    from .media import process_signature
+    from .models import PODRecord
+
+    try:
+        pod_record = PODRecord.objects.select_related("shipment").get(id=pod_record_id)
+    except PODRecord.DoesNotExist:
+        return
+    if not pod_record.signature_image or pod_record.signature_web or pod_record.signature_processed_at:
+        return
+
+    try:
+        process_signature(pod_record)
+    except UNDECODABLE_IMAGE_ERRORS as e:
+        # Non recuperabile: si continua a servire l'originale
+        logger.error(f"Firma POD {pod_record.uuid} non elaborabile: {e}")
+        PODRecord.objects.filter(id=pod_record.id).update(signature_processed_at=timezone.now())
+        return
+    except OSError as e:
+        logger.warning(f"Elaborazione firma POD {pod_record.uuid} fallita: {e}")
+        raise self.retry(exc=e)
+    invalidate_tracking(pod_record.shipment.public_tracking_token)
+
+
+def schedule_media_processing(photo_ids=(), pod_record_ids=()):
+    """Accoda l'elaborazione di foto e firme a transazione confermata."""
+    photo_ids = list(photo_ids)
+    pod_record_ids = list(pod_record_ids)
+
+    def enqueue():
+        for photo_id in photo_ids:
+            process_pod_photo.delay(photo_id)
+        for pod_record_id in pod_record_ids:
+            process_pod_signature.delay(pod_record_id)
+
+    if photo_ids or pod_record_ids:
+        transaction.on_commit(enqueue)
+
+
+@shared_task
+def process_pending_media():
+    """Riaccoda foto e firme caricate da tempo e non ancora elaborate."""
+    from .models import PODPhoto, PODRecord
+
+    now = timezone.now()
+    cutoff = now - MEDIA_RETRY_AFTER
+    since = now - MEDIA_SWEEP_WINDOW
+    photo_ids = list(
+        PODPhoto.objects.filter(
+            processed_at__isnull=True, created_at__lt=cutoff, created_at__gte=since,
+        )
+        .order_by("created_at")
+        .values_list("id", flat=True)[:MEDIA_SWEEP_LIMIT]
+    )
+    pod_record_ids = list(
+        PODRecord.objects.filter(
+            signature_web="", signature_processed_at__isnull=True,
+            updated_at__lt=cutoff, updated_at__gte=since,
+        )
+        .exclude(signature_image="")
+        .order_by("updated_at")
+        .values_list("id", flat=True)[:MEDIA_SWEEP_LIMIT]
+    )
+    schedule_media_processing(photo_ids, pod_record_ids)
+    return len(photo_ids) + len(pod_record_ids)
+
+
+@shared_task
+def purge_chunked_uploads():
+    """Elimina gli upload a blocchi abbandonati e i loro file parziali."""
+    from .chunked import purge_stale_uploads
+
+    return purge_stale_uploads()
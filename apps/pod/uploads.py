@@ -0,0 +1,219 @@
+"""
+Upload diretti di foto e firme dei POD, senza far passare i byte dai worker.
+
+Il corriere chiede l'autorizzazione per un'immagine (tipo, contenuto e
+dimensione) e riceve un URL firmato: con USE_S3 è un POST presigned verso
+il bucket, che impone content-type e dimensione massima; senza S3 è un PUT
+verso PODLocalUploadView, che scrive sullo storage locale. Il token che
+accompagna l'URL lega chiave, POD, corriere e vincoli; la conferma lo
+ripresenta e registra la foto (o la firma) dalla chiave già caricata.
+
+Alla conferma l'oggetto caricato è riletto: il server ne calcola lo SHA-256
+(quello dichiarato dal client, se c'è, deve coincidere), lo copia nel
+percorso indirizzato per contenuto (apps.pod.content) ed elimina la chiave
+di upload. Le immagini sono già ridotte dalla PWA (POD_UPLOAD_MAX_BYTES),
+la rilettura costa poco. Il fallback locale verifica l'hash dichiarato già
+durante la ricezione.
+"""
+import hashlib
+import tempfile
+import uuid
+
+from django.conf import settings
+from django.core import signing
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from .content import SIGNATURE_PREFIX, create_photo, file_sha256, store_content
+from .models import PODPhoto, PODRecord
+from .tasks import schedule_media_processing
+
+UPLOAD_CONTENT_TYPES = {"image/webp": "webp", "image/jpeg": "jpg", "image/png": "png"}
+
+KIND_PHOTO = "photo"
+KIND_SIGNATURE = "signature"
+UPLOAD_PREFIXES = {KIND_PHOTO: "pod/photos", KIND_SIGNATURE: "pod/signatures"}
+
+# Validità dell'URL di upload; la conferma può arrivare molto dopo (rete
+# instabile), il token resta valido più a lungo
+UPLOAD_URL_EXPIRY = 15 * 60
+UPLOAD_TOKEN_MAX_AGE = 24 * 60 * 60
+
+_SALT = "pod.uploads"
+_CHUNK_SIZE = 64 * 1024
+
+
+class InvalidUpload(Exception):
+    pass
+
+
+def upload_key(kind: str, content_type: str, now=None) -> str:
+    """Chiave dell'oggetto, con la stessa struttura di upload_to dei modelli."""
+    now = timezone.localtime(now)
+    extension = UPLOAD_CONTENT_TYPES[content_type]
+    return f"{UPLOAD_PREFIXES[kind]}/{now:%Y/%m/%d}/{uuid.uuid4().hex}.{extension}"
+
+
+def issue_upload(pod_record, kind: str, content_type: str, size: int, sha256: str = "") -> dict:
+    """Autorizza l'upload di un'immagine del POD e ritorna URL e token."""
+    key = upload_key(kind, content_type)
+    token = signing.dumps(
+        {
+            "key": key,
+            "pod": str(pod_record.uuid),
+            "driver": pod_record.driver_id,
+            "kind": kind,
+            "type": content_type,
+            "size": size,
+            "sha256": sha256,
+        },
+        salt=_SALT,
+        compress=True,
+    )
+    grant = {
+        "key": key,
+        "token": token,
+        "expires_in": UPLOAD_URL_EXPIRY,
+        "max_bytes": size,
+    }
+    if settings.USE_S3:
+        grant.update(_presigned_post(key, content_type, size))
+    else:
+        grant.update(
+            method="PUT",
+            url=reverse("pod:pod-local-upload", kwargs={"token": token}),
+            fields={},
+            headers={"Content-Type": content_type},
+        )
+    return grant
+
+
+def _presigned_post(key: str, content_type: str, size: int) -> dict:
+    client = default_storage.bucket.meta.client
+    post = client.generate_presigned_post(
+        Bucket=default_storage.bucket_name,
+        Key=key,
+        Fields={"Content-Type": content_type},
+        Conditions=[
+            {"Content-Type": content_type},
+            ["content-length-range", 1, size],
+        ],
+        ExpiresIn=UPLOAD_URL_EXPIRY,
+    )
+    return {"method": "POST", "url": post["url"], "fields": post["fields"], "headers": {}}
+
+
+def duplicate_photo(pod_record, sha256: str):
+    """Foto del POD con lo stesso contenuto, se già registrata."""
+    if not sha256:
+        return None
+    return PODPhoto.objects.filter(pod_record=pod_record, sha256=sha256).first()
+
+
+def read_upload_token(token: str, max_age: int = UPLOAD_TOKEN_MAX_AGE) -> dict:
+    try:
+        return signing.loads(token, salt=_SALT, max_age=max_age)
+    except signing.SignatureExpired:
+        raise InvalidUpload("Autorizzazione di upload scaduta")
+    except signing.BadSignature:
+        raise InvalidUpload("Autorizzazione di upload non valida")
+
+
+def save_local_upload(grant: dict, stream, length: int) -> None:
+    """Scrive sullo storage locale il corpo di un PUT autorizzato (fallback senza S3)."""
+    if length > grant["size"]:
+        raise InvalidUpload(f"Immagine oltre i {grant['size']} byte autorizzati")
+    if default_storage.exists(grant["key"]):
+        return  # Reinvio dello stesso upload
+
+    hasher = hashlib.sha256()
+    with tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE) as buffer:
+        remaining = length
+        while remaining > 0:
+            chunk = stream.read(min(_CHUNK_SIZE, remaining))
+            if not chunk:
+                raise InvalidUpload("Upload troncato")
+            hasher.update(chunk)
+            buffer.write(chunk)
+            remaining -= len(chunk)
+        if grant.get("sha256") and hasher.hexdigest() != grant["sha256"]:
+            raise InvalidUpload("Contenuto diverso dallo SHA-256 dichiarato")
+        buffer.seek(0)
+        name = default_storage.save(grant["key"], File(buffer))
+
+    if name != grant["key"]:
+        default_storage.delete(name)
+        raise InvalidUpload("Chiave di upload già in uso")
+
+
+def confirm_upload(pod_record, token: str, caption: str = "", taken_at=None,
+                   latitude=None, longitude=None):
+    """
+    Registra l'immagine caricata con il token. Ritorna (istanza, creata):
+    il PODPhoto per le foto, il PODRecord per la firma. Idempotente, così un
+    client può ripetere la conferma: la foto già registrata si ritrova con lo
+    SHA-256 dichiarato all'autorizzazione, la firma perché il POD ce l'ha già.
+    """
+    grant = read_upload_token(token)
+    if grant["pod"] != str(pod_record.uuid) or grant["driver"] != pod_record.driver_id:
+        raise InvalidUpload("Autorizzazione di upload di un altro POD")
+
+    with transaction.atomic():
+        # Il lock sul POD serializza conferme ripetute dello stesso upload
+        pod_record = PODRecord.objects.select_for_update().get(pk=pod_record.pk)
+        return _register_upload(pod_record, grant, caption, taken_at, latitude, longitude)
+
+
+def _register_upload(pod_record, grant, caption, taken_at, latitude, longitude):
+    key = grant["key"]
+    if grant["kind"] == KIND_SIGNATURE:
+        if pod_record.signature_image:
+            return pod_record, False
+    else:
+        # Foto confermate quando restavano sulla chiave di upload
+        photo = PODPhoto.objects.filter(pod_record=pod_record, image=key).first()
+        if photo:
+            return photo, False
+        photo = duplicate_photo(pod_record, grant.get("sha256"))
+        if photo:
+            # Stessa foto già arrivata per altra via: l'oggetto caricato è superfluo
+            default_storage.delete(key)
+            return photo, False
+
+    if not default_storage.exists(key):
+        if grant.get("sha256"):
+            raise InvalidUpload("Immagine non ancora caricata")
+        # Senza hash dichiarato una conferma ripetuta non ritrova la foto:
+        # la chiave è già stata spostata nel percorso del contenuto
+        raise InvalidUpload("Immagine non ancora caricata o già registrata")
+    if default_storage.size(key) > grant["size"]:
+        default_storage.delete(key)
+        raise InvalidUpload(f"Immagine oltre i {grant['size']} byte autorizzati")
+
+    # Hash calcolato dall'oggetto: quello dichiarato non è verificato dallo storage
+    with default_storage.open(key, "rb") as image:
+        sha256 = file_sha256(image)
+        if grant.get("sha256") and sha256 != grant["sha256"]:
+            default_storage.delete(key)
+            raise InvalidUpload("Contenuto diverso dallo SHA-256 dichiarato")
+        image.sha256 = sha256
+
+        if grant["kind"] == KIND_SIGNATURE:
+            pod_record.signature_image.name = store_content(image, SIGNATURE_PREFIX, sha256)
+            pod_record.save(update_fields=["signature_image", "updated_at"])
+            schedule_media_processing(pod_record_ids=[pod_record.id])
+            instance, created = pod_record, True
+        else:
+            instance, created = create_photo(
+                pod_record, image,
+                caption=caption, taken_at=taken_at, latitude=latitude, longitude=longitude,
+            )
+            if created:
+                schedule_media_processing(photo_ids=[instance.id])
+
+    # La copia nel percorso del contenuto rende superflua la chiave di upload
+    transaction.on_commit(lambda: default_storage.delete(key))
+    return instance, created
@@ -10,11 +10,44 @@ urlpatterns = [
         views.PODCreateView.as_view(),
         name="pod-create",
     ),
+    path("pod/upload-config/", views.PODUploadConfigView.as_view(), name="pod-upload-config"),
     path("pod/<uuid:uuid>/", views.PODDetailView.as_view(), name="pod-detail"),
+    path(
+        "pod/<uuid:uuid>/signature.<str:fmt>",
+        views.PODSignatureView.as_view(),
+        name="pod-signature",
+    ),
     path(
         "pod/<uuid:pod_uuid>/photos/",
         views.PODPhotoUploadView.as_view(),
         name="pod-photo-upload",
     ),
+    path(
+        "pod/<uuid:pod_uuid>/uploads/",
+        views.PODUploadView.as_view(),
+        name="pod-upload",
+    ),
+    path(
+        "pod/<uuid:pod_uuid>/uploads/confirm/",
+        views.PODUploadConfirmView.as_view(),
+        name="pod-upload-confirm",
+    ),
+    path(
+        "pod/<uuid:pod_uuid>/chunked-uploads/",
+        views.PODChunkedUploadCreateView.as_view(),
+        name="pod-chunked-upload-create",
+    ),
+    path(
+        "pod/chunked-uploads/<uuid:uuid>/",
+        views.PODChunkedUploadView.as_view(),
+        name="pod-chunked-upload",
+    ),
+    path(
+        "pod/chunked-uploads/<uuid:uuid>/complete/",
+        views.PODChunkedUploadCompleteView.as_view(),
+        name="pod-chunked-upload-complete",
+    ),
+    path("pod/uploads/<str:token>/", views.PODLocalUploadView.as_view(), name="pod-local-upload"),
     path("pod/sync/", views.PODSyncView.as_view(), name="pod-sync"),
+    path("pod/sync/photos/", views.PODPhotoSyncView.as_view(), name="pod-photo-sync"),
 ]
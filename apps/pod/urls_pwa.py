@@ -6,4 +6,5 @@ urlpatterns = [
     path("", views.PWAView.as_view(), name="pwa-home"),
     path("pod/<uuid:shipment_uuid>/", views.PWAView.as_view(), name="pwa-pod"),
     path("offline/", views.PWAOfflineView.as_view(), name="pwa-offline"),
+    path("sw.js", views.PWAServiceWorkerView.as_view(), name="pwa-service-worker"),
 ]
@@ -1,21 +1,63 @@
+from django.conf import settings
 from django.db import IntegrityError
+from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404, redirect
+from django.urls import reverse
+from django.utils.decorators import method_decorator
 from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework import generics, permissions, status
 from rest_framework.parsers import FormParser, MultiPartParser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from apps.accounts.permissions import IsDriver
+from apps.common.parsers import GzipJSONParser
 from apps.shipments.models import Shipment
 from apps.shipments.state_machine import InvalidTransitionError, transition_shipment
-
-from .models import PODPhoto, PODRecord
+from apps.tracking.cache import invalidate_tracking
+
+from .chunked import (
+    CHUNK_CONTENT_TYPE,
+    TUS_VERSION,
+    OffsetMismatch,
+    UploadGone,
+    append_chunk,
+    create_upload,
+    delete_upload,
+    finish_upload,
+)
+from .content import SIGNATURE_PREFIX, create_photo, store_content
+from .models import PODChunkedUpload, PODPhoto, PODRecord
 from .serializers import (
     PODCreateSerializer,
+    PODImageMetadataSerializer,
     PODPhotoSerializer,
+    PODPhotoSyncSerializer,
+    PODPhotoUploadSerializer,
     PODRecordSerializer,
     PODSyncSerializer,
+    PODUploadConfirmSerializer,
+    PODUploadRequestSerializer,
+)
+from .signature import signature_png, signature_svg
+from .sync import (
+    SYNC_MAX_PHOTOS,
+    SYNC_MAX_RECORDS,
+    status_for_delivery_result,
+    sync_offline_photos,
+    sync_offline_pods,
+)
+from .tasks import schedule_media_processing
+from .uploads import (
+    KIND_SIGNATURE,
+    UPLOAD_URL_EXPIRY,
+    InvalidUpload,
+    confirm_upload,
+    duplicate_photo,
+    issue_upload,
+    read_upload_token,
+    save_local_upload,
 )
 
 
@@ -35,13 +77,9 @@ class PODCreateView(APIView):
 
         # Determina lo stato di transizione in base al risultato
         delivery_result = data["delivery_result"]
-        if delivery_result == "delivered":
-            new_status = "delivered"
-        elif delivery_result == "partial":
-            new_status = "delivered"
-        else:
-            new_status = "not_delivered"
+        new_status = status_for_delivery_result(delivery_result)
 
+        signature = data.get("signature_image")
         try:
             pod_record = PODRecord.objects.create(
                 shipment=shipment,
@@ -52,7 +90,8 @@ class PODCreateView(APIView):
                 recorded_at=data["recorded_at"],
                 latitude=data.get("latitude"),
                 longitude=data.get("longitude"),
-                signature_image=data.get("signature_image"),
+                signature_image=store_content(signature, SIGNATURE_PREFIX) if signature else "",
+                signature_strokes=data.get("signature_strokes"),
                 synced_from_offline=data.get("synced_from_offline", False),
                 device_uuid=data.get("device_uuid", ""),
                 local_record_id=data.get("local_record_id", ""),
@@ -68,6 +107,10 @@ class PODCreateView(APIView):
                 status=status.HTTP_200_OK,
             )
 
+        invalidate_tracking(shipment.public_tracking_token)
+        if pod_record.signature_image:
+            schedule_media_processing(pod_record_ids=[pod_record.id])
+
         # Transizione di stato della spedizione
         try:
             transition_shipment(
@@ -93,6 +136,29 @@ class PODDetailView(generics.RetrieveAPIView):
     lookup_field = "uuid"
 
 
+class PODSignatureView(APIView):
+    """Firma vettoriale del POD resa in SVG o PNG, generata al bisogno e in cache."""
+
+    def get(self, request, uuid, fmt):
+        if fmt not in ("svg", "png"):
+            raise Http404("Formato non supportato")
+        pod_record = get_object_or_404(PODRecord, uuid=uuid)
+        if not pod_record.signature_strokes:
+            if fmt == "png" and pod_record.signature_image:
+                return redirect(pod_record.signature_url)
+            raise Http404("Firma vettoriale non presente")
+
+        if fmt == "svg":
+            response = HttpResponse(signature_svg(pod_record.signature_strokes),
+                                    content_type="image/svg+xml")
+        else:
+            response = HttpResponse(signature_png(pod_record.signature_strokes),
+                                    content_type="image/png")
+        # I tratti di un POD non cambiano
+        response["Cache-Control"] = "private, max-age=86400"
+        return response
+
+
 class PODPhotoUploadView(APIView):
     """Upload foto aggiuntive per un POD."""
 
@@ -100,83 +166,365 @@ class PODPhotoUploadView(APIView):
     parser_classes = [MultiPartParser, FormParser]
 
     def post(self, request, pod_uuid):
-        pod_record = get_object_or_404(PODRecord, uuid=pod_uuid)
-        image = request.FILES.get("image")
-        if not image:
+        pod_record = get_object_or_404(
+            PODRecord.objects.select_related("shipment"), uuid=pod_uuid,
+        )
+        if not request.FILES.get("image"):
             return Response(
                 {"error": "Nessuna immagine fornita"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
+        serializer = PODPhotoUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
 
-        photo = PODPhoto.objects.create(
-            pod_record=pod_record,
-            image=image,
-            caption=request.data.get("caption", ""),
-            taken_at=request.data.get("taken_at"),
-        )
+        # Un reinvio della stessa foto ritorna quella già registrata
+        photo, created = create_photo(pod_record, **serializer.validated_data)
+        if not created:
+            return Response(PODPhotoSerializer(photo).data, status=status.HTTP_200_OK)
+        invalidate_tracking(pod_record.shipment.public_tracking_token)
+        schedule_media_processing(photo_ids=[photo.id])
         return Response(PODPhotoSerializer(photo).data, status=status.HTTP_201_CREATED)
 
 
-class PODSyncView(APIView):
-    """Sincronizzazione batch di record POD offline."""
+class PODUploadView(APIView):
+    """
+    Autorizza l'upload diretto di una foto o della firma del POD: il client
+    carica i byte sull'URL firmato (S3 o fallback locale), poi conferma.
+    """
 
     permission_classes = [IsDriver]
 
-    def post(self, request):
-        serializer = PODSyncSerializer(data=request.data, many=True)
+    def post(self, request, pod_uuid):
+        pod_record = get_object_or_404(
+            PODRecord, uuid=pod_uuid, driver=request.user.driver_profile,
+        )
+        serializer = PODUploadRequestSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
 
-        results = []
-        driver = request.user.driver_profile
+        # Immagine già registrata: niente da caricare
+        duplicate = duplicate_upload_response(pod_record, data)
+        if duplicate:
+            return duplicate
+
+        return Response(
+            issue_upload(pod_record, **serializer.validated_data),
+            status=status.HTTP_201_CREATED,
+        )
+
+
+def duplicate_upload_response(pod_record, data):
+    """Risposta per un'immagine già registrata sul POD, o None."""
+    if data["kind"] == KIND_SIGNATURE:
+        if pod_record.signature_image:
+            return Response({"duplicate": True, "pod": PODRecordSerializer(pod_record).data})
+        return None
+    photo = duplicate_photo(pod_record, data["sha256"])
+    if photo:
+        return Response({"duplicate": True, "photo": PODPhotoSerializer(photo).data})
+    return None
+
+
+class PODUploadConfirmView(APIView):
+    """Registra sul POD l'immagine caricata con un upload diretto."""
+
+    permission_classes = [IsDriver]
+
+    def post(self, request, pod_uuid):
+        pod_record = get_object_or_404(
+            PODRecord.objects.select_related("shipment"),
+            uuid=pod_uuid, driver=request.user.driver_profile,
+        )
+        serializer = PODUploadConfirmSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            instance, created = confirm_upload(pod_record, **serializer.validated_data)
+        except InvalidUpload as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if created:
+            invalidate_tracking(pod_record.shipment.public_tracking_token)
+        if isinstance(instance, PODPhoto):
+            data = PODPhotoSerializer(instance).data
+        else:
+            data = PODRecordSerializer(instance).data
+        return Response(data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class PODLocalUploadView(View):
+    """
+    Destinazione degli upload diretti senza S3: PUT del corpo grezzo,
+    autorizzato dal solo token firmato nell'URL (come un URL presigned).
+    """
+
+    def put(self, request, token):
+        from django.http import JsonResponse
+
+        try:
+            grant = read_upload_token(token, max_age=UPLOAD_URL_EXPIRY)
+        except InvalidUpload as e:
+            return JsonResponse({"error": str(e)}, status=403)
+        if request.content_type != grant["type"]:
+            return JsonResponse(
+                {"error": f"Content-Type atteso: {grant['type']}"}, status=415,
+            )
+        try:
+            length = int(request.META.get("CONTENT_LENGTH") or "")
+        except ValueError:
+            return JsonResponse({"error": "Content-Length obbligatorio"}, status=411)
+
+        try:
+            save_local_upload(grant, request, length)
+        except InvalidUpload as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        return JsonResponse({"key": grant["key"]}, status=201)
+
+
+class PODChunkedUploadCreateView(APIView):
+    """
+    Crea un upload riprendibile a blocchi di una foto o della firma del POD
+    (vedi apps.pod.chunked), per le reti su cui un upload intero non arriva.
+    """
+
+    permission_classes = [IsDriver]
+
+    def post(self, request, pod_uuid):
+        pod_record = get_object_or_404(
+            PODRecord, uuid=pod_uuid, driver=request.user.driver_profile,
+        )
+        serializer = PODUploadRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        # Immagine già registrata: niente da caricare
+        duplicate = duplicate_upload_response(pod_record, data)
+        if duplicate:
+            return duplicate
+
+        upload = create_upload(pod_record, **data)
+        url = reverse("pod:pod-chunked-upload", kwargs={"uuid": upload.uuid})
+        response = chunked_upload_response(
+            upload, {"uuid": str(upload.uuid), "url": url}, status.HTTP_201_CREATED,
+        )
+        response["Location"] = url
+        return response
+
+
+class PODChunkedUploadView(APIView):
+    """
+    Stato e blocchi di un upload riprendibile: HEAD ritorna l'offset
+    raggiunto, PATCH aggiunge un blocco da Upload-Offset, DELETE annulla.
+    """
+
+    permission_classes = [IsDriver]
+
+    def get_upload(self, request, uuid):
+        return get_object_or_404(
+            PODChunkedUpload.objects.select_related("pod_record"),
+            uuid=uuid, pod_record__driver=request.user.driver_profile,
+        )
+
+    def head(self, request, uuid):
+        return chunked_upload_response(self.get_upload(request, uuid))
 
-        for record_data in serializer.validated_data:
-            shipment = get_object_or_404(
-                Shipment, uuid=record_data["shipment_uuid"],
+    def patch(self, request, uuid):
+        upload = self.get_upload(request, uuid)
+        if request.content_type != CHUNK_CONTENT_TYPE:
+            return Response(
+                {"error": f"Content-Type atteso: {CHUNK_CONTENT_TYPE}"},
+                status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            )
+        try:
+            offset = int(request.headers["Upload-Offset"])
+        except (KeyError, ValueError):
+            return Response(
+                {"error": "Header Upload-Offset obbligatorio"}, status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            length = int(request.META.get("CONTENT_LENGTH") or "")
+        except ValueError:
+            return Response(
+                {"error": "Content-Length obbligatorio"}, status=status.HTTP_411_LENGTH_REQUIRED,
+            )
+
+        if offset + length > upload.length:
+            return chunked_upload_response(
+                upload, {"error": f"Blocco oltre i {upload.length} byte dichiarati"},
+                status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            )
+
+        # Corpo letto direttamente dallo stream: request.data non va toccato
+        try:
+            append_chunk(upload, offset, request.stream, length)
+        except OffsetMismatch as e:
+            upload.offset = e.offset
+            return chunked_upload_response(upload, {"error": str(e)}, status.HTTP_409_CONFLICT)
+        except InvalidUpload as e:
+            return Response({"error": str(e)}, status=status.HTTP_410_GONE)
+        return chunked_upload_response(upload, status_code=status.HTTP_204_NO_CONTENT)
+
+    def delete(self, request, uuid):
+        upload = self.get_upload(request, uuid)
+        if upload.status == PODChunkedUpload.Status.UPLOADING:
+            delete_upload(upload)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class PODChunkedUploadCompleteView(APIView):
+    """Registra sul POD l'immagine di un upload a blocchi completato."""
+
+    permission_classes = [IsDriver]
+
+    def post(self, request, uuid):
+        upload = get_object_or_404(
+            PODChunkedUpload.objects.select_related("pod_record__shipment", "photo"),
+            uuid=uuid, pod_record__driver=request.user.driver_profile,
+        )
+        serializer = PODImageMetadataSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            instance, created = finish_upload(upload, **serializer.validated_data)
+        except UploadGone as e:
+            return chunked_upload_response(upload, {"error": str(e)}, status.HTTP_410_GONE)
+        except InvalidUpload as e:
+            return chunked_upload_response(upload, {"error": str(e)}, status.HTTP_400_BAD_REQUEST)
+
+        if created:
+            invalidate_tracking(upload.pod_record.shipment.public_tracking_token)
+        if isinstance(instance, PODPhoto):
+            data = PODPhotoSerializer(instance).data
+        else:
+            data = PODRecordSerializer(instance).data
+        return Response(data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+
+def chunked_upload_response(upload, data=None, status_code=status.HTTP_200_OK):
+    """Risposta con gli header di stato di un upload a blocchi."""
+    response = Response(data, status=status_code)
+    response["Upload-Offset"] = str(upload.offset)
+    response["Upload-Length"] = str(upload.length)
+    response["Tus-Resumable"] = TUS_VERSION
+    response["Cache-Control"] = "no-store"
+    return response
+
+
+class PODUploadConfigView(APIView):
+    """Limiti di ridimensionamento e compressione delle immagini per la PWA."""
+
+    permission_classes = [IsDriver]
+
+    def get(self, request):
+        response = Response({
+            "photo_max_dimension": settings.POD_PHOTO_MAX_DIMENSION,
+            "photo_quality": settings.POD_PHOTO_QUALITY,
+            "signature_max_dimension": settings.POD_SIGNATURE_MAX_DIMENSION,
+            "max_upload_bytes": settings.POD_UPLOAD_MAX_BYTES,
+            "formats": ["image/webp", "image/jpeg"],
+        })
+        response["Cache-Control"] = "private, max-age=3600"
+        return response
+
+
+class PODSyncView(APIView):
+    """Sincronizzazione batch di record POD offline (JSON, anche gzip)."""
+
+    permission_classes = [IsDriver]
+    parser_classes = [GzipJSONParser]
+
+    def post(self, request):
+        if not isinstance(request.data, list):
+            return Response(
+                {"error": "È attesa una lista di record"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(request.data) > SYNC_MAX_RECORDS:
+            return Response(
+                {"error": f"Massimo {SYNC_MAX_RECORDS} record per richiesta"},
+                status=status.HTTP_400_BAD_REQUEST,
             )
 
-            delivery_result = record_data["delivery_result"]
-            if delivery_result in ("delivered", "partial"):
-                new_status = "delivered"
-            else:
-                new_status = "not_delivered"
-
-            try:
-                pod_record = PODRecord.objects.create(
-                    shipment=shipment,
-                    driver=driver,
-                    delivery_result=delivery_result,
-                    recipient_signer_name=record_data.get("recipient_signer_name", ""),
-                    notes=record_data.get("notes", ""),
-                    recorded_at=record_data["recorded_at"],
-                    latitude=record_data.get("latitude"),
-                    longitude=record_data.get("longitude"),
-                    synced_from_offline=True,
-                    device_uuid=record_data["device_uuid"],
-                    local_record_id=record_data["local_record_id"],
+        # Validazione per record: un record non valido non blocca il batch
+        results = [None] * len(request.data)
+        records = []
+        positions = []
+        for index, record_data in enumerate(request.data):
+            serializer = PODSyncSerializer(data=record_data)
+            if not serializer.is_valid():
+                local_record_id = (
+                    record_data.get("local_record_id", "")
+                    if isinstance(record_data, dict) else ""
                 )
+                results[index] = {
+                    "local_record_id": local_record_id,
+                    "status": "invalid",
+                    "errors": serializer.errors,
+                }
+                continue
+            positions.append(index)
+            records.append(serializer.validated_data)
+
+        if records:
+            synced = sync_offline_pods(
+                records, driver=request.user.driver_profile, user=request.user,
+            )
+            for index, result in zip(positions, synced):
+                results[index] = result
+
+        return Response({"results": results})
+
+
+class PODPhotoSyncView(APIView):
+    """
+    Sincronizzazione batch di foto e firme dei POD offline (multipart).
+
+    Il campo "items" è la lista JSON dei metadati; ogni file è nella parte
+    multipart che ha come nome il suo local_photo_id.
+    """
 
-                try:
-                    transition_shipment(
-                        shipment=shipment,
-                        new_status=new_status,
-                        user=request.user,
-                        description=f"POD offline sincronizzato: {pod_record.get_delivery_result_display()}",
-                        latitude=record_data.get("latitude"),
-                        longitude=record_data.get("longitude"),
-                    )
-                except InvalidTransitionError:
-                    pass
-
-                results.append({
-                    "local_record_id": record_data["local_record_id"],
-                    "status": "created",
-                    "uuid": str(pod_record.uuid),
-                })
-            except IntegrityError:
-                results.append({
-                    "local_record_id": record_data["local_record_id"],
-                    "status": "duplicate",
-                })
+    permission_classes = [IsDriver]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request):
+        import json
+
+        try:
+            items = json.loads(request.data.get("items", ""))
+        except ValueError:
+            items = None
+        if not isinstance(items, list):
+            return Response(
+                {"error": "Il campo items deve essere una lista JSON"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(items) > SYNC_MAX_PHOTOS:
+            return Response(
+                {"error": f"Massimo {SYNC_MAX_PHOTOS} foto per richiesta"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        results = [None] * len(items)
+        photos = []
+        positions = []
+        for index, item in enumerate(items):
+            item = item if isinstance(item, dict) else {}
+            serializer = PODPhotoSyncSerializer(data={
+                **item, "image": request.FILES.get(str(item.get("local_photo_id", ""))),
+            })
+            if not serializer.is_valid():
+                results[index] = {
+                    "local_photo_id": item.get("local_photo_id", ""),
+                    "status": "invalid",
+                    "errors": serializer.errors,
+                }
+                continue
+            positions.append(index)
+            photos.append(serializer.validated_data)
+
+        if photos:
+            synced = sync_offline_photos(photos, driver=request.user.driver_profile)
+            for index, result in zip(positions, synced):
+                results[index] = result
 
         return Response({"results": results})
 
@@ -199,6 +547,24 @@ class PWAView(View):
         return render(request, "pod/pwa.html")
 
 
+class PWAServiceWorkerView(View):
+    """
+    Service worker della PWA servito sotto /pwa/: da /static/pwa/ il suo
+    scope non coprirebbe la pagina e le chiamate API che deve intercettare.
+    """
+
+    def get(self, request):
+        from django.contrib.staticfiles import finders
+        from django.http import FileResponse, Http404
+
+        path = finders.find("pwa/sw.js")
+        if not path:
+            raise Http404
+        response = FileResponse(open(path, "rb"), content_type="application/javascript")
+        response["Cache-Control"] = "no-cache"
+        return response
+
+
 class PWAOfflineView(View):
     """Pagina offline della PWA."""
 
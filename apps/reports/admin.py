@@ -0,0 +1,13 @@
+from django.contrib import admin
+
+from .models import ExportJob
+
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ("uuid", "format", "status", "rows_written", "rows_total", "created_by", "created_at")
+    list_filter = ("format", "status")
+    readonly_fields = (
+        "uuid", "status", "rows_total", "rows_written", "file", "error_message",
+        "created_by", "created_at", "updated_at", "started_at", "finished_at",
+    )
@@ -0,0 +1,183 @@
+"""Export tabellare delle spedizioni, in streaming e senza istanziare modelli."""
+import csv
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from apps.pod.models import PODRecord
+from apps.shipments.models import Shipment
+
+EXPORT_CHUNK_SIZE = 2000
+# Righe di un foglio Excel (1.048.576) meno l'intestazione
+XLSX_MAX_ROWS = 1_048_575
+
+EXPORT_HEADER = [
+    "Tracking", "Riferimento", "Mittente", "Destinatario",
+    "Indirizzo consegna", "Stato", "Tipo consegna",
+    "Corriere", "Colli", "Peso (kg)",
+    "Data creazione", "Data consegna prevista", "Data consegna effettiva",
+]
+
+# Proiezione letta dal cursore: nessuna istanza di modello per riga
+EXPORT_FIELDS = (
+    "tracking_code", "reference", "sender__company_name", "recipient_name",
+    "delivery_address_id", "delivery_address__street", "delivery_address__postal_code",
+    "delivery_address__city", "delivery_address__province",
+    "delivery_street", "delivery_postal_code", "delivery_city", "delivery_province",
+    "status", "delivery_type",
+    "driver_id", "driver__user__first_name", "driver__user__last_name",
+    "external_carrier__name",
+    "packages_count", "weight_kg",
+    "created_at", "estimated_delivery_date", "actual_delivery_date",
+)
+
+# Colonne aggiuntive del POD (export asincroni)
+EXPORT_POD_HEADER = ["Esito POD", "Firmatario", "Data POD"]
+EXPORT_POD_FIELDS = ("pod__delivery_result", "pod__recipient_signer_name", "pod__recorded_at")
+
+STATUS_LABELS = dict(Shipment.Status.choices)
+DELIVERY_TYPE_LABELS = dict(Shipment.DeliveryType.choices)
+DELIVERY_RESULT_LABELS = dict(PODRecord.DeliveryResult.choices)
+
+
+class InvalidExportRange(ValueError):
+    pass
+
+
+def _day_start(value: str):
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is None:
+        raise InvalidExportRange(f"Data non valida: {value}")
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def export_queryset(date_from: str = "", date_to: str = ""):
+    """
+    Spedizioni da esportare, filtrate per data di creazione (estremi inclusi).
+
+    I limiti sono convertiti in istanti (>= inizio di date_from, < inizio del
+    giorno dopo date_to) così il filtro usa l'indice su created_at.
+    """
+    qs = Shipment.objects.order_by("-created_at")
+    if date_from:
+        qs = qs.filter(created_at__gte=_day_start(date_from))
+    if date_to:
+        qs = qs.filter(created_at__lt=_day_start(date_to) + timedelta(days=1))
+    return qs
+
+
+def check_export_size(export_format: str, rows: int) -> None:
+    """Un export XLSX deve stare in un solo foglio: oltre si usa CSV o Parquet."""
+    if export_format == "xlsx" and rows > XLSX_MAX_ROWS:
+        raise InvalidExportRange(
+            f"{rows} spedizioni superano le {XLSX_MAX_ROWS} righe di un foglio Excel: "
+            "restringere le date o usare CSV o Parquet"
+        )
+
+
+def _format_datetime(value):
+    # Come l'export storico: istante in UTC, senza conversione all'ora locale
+    return value.strftime("%d/%m/%Y %H:%M") if value else ""
+
+
+def _format_date(value):
+    return value.strftime("%d/%m/%Y") if value else ""
+
+
+def _local_datetime(value):
+    return timezone.localtime(value) if value else None
+
+
+def export_rows(
+    queryset, include_pod: bool = False, formatted: bool = True,
+    chunk_size: int = EXPORT_CHUNK_SIZE,
+):
+    """
+    Righe dell'export lette a blocchi da un cursore lato server.
+
+    Con formatted=True i valori sono testo pronto per il CSV, nel formato
+    dell'export storico (istanti in UTC, peso nullo o zero come cella vuota);
+    altrimenti date, istanti (ora locale) e pesi restano tipizzati per
+    XLSX/Parquet. Con include_pod si aggiungono le colonne di EXPORT_POD_HEADER.
+    """
+    fields = EXPORT_FIELDS + EXPORT_POD_FIELDS if include_pod else EXPORT_FIELDS
+    as_datetime = _format_datetime if formatted else _local_datetime
+    as_date = _format_date if formatted else (lambda value: value)
+    empty = "" if formatted else None
+    as_weight = (lambda value: value or "") if formatted else (lambda value: value)
+
+    for values in queryset.values_list(*fields).iterator(chunk_size=chunk_size):
+        (
+            tracking_code, reference, sender_name, recipient_name,
+            address_id, address_street, address_postal_code, address_city, address_province,
+            street, postal_code, city, province,
+            status, delivery_type,
+            driver_id, driver_first_name, driver_last_name, carrier_name,
+            packages_count, weight_kg,
+            created_at, estimated_delivery_date, actual_delivery_date,
+        ) = values[:len(EXPORT_FIELDS)]
+
+        # Stessa logica di Shipment.get_effective_delivery_address()
+        if address_id:
+            delivery_address = (
+                f"{address_street}, {address_postal_code} {address_city} ({address_province})"
+            )
+        else:
+            delivery_address = ", ".join(filter(None, [
+                street,
+                f"{postal_code} {city}".strip(),
+                f"({province})" if province else "",
+            ]))
+
+        if driver_id:
+            carrier = f"{driver_first_name} {driver_last_name}".strip()
+        else:
+            carrier = carrier_name or ""
+
+        row = [
+            tracking_code,
+            reference,
+            sender_name,
+            recipient_name,
+            delivery_address,
+            STATUS_LABELS.get(status, status),
+            DELIVERY_TYPE_LABELS.get(delivery_type, delivery_type),
+            carrier,
+            packages_count,
+            as_weight(weight_kg),
+            as_datetime(created_at),
+            as_date(estimated_delivery_date) if estimated_delivery_date else empty,
+            as_datetime(actual_delivery_date),
+        ]
+
+        if include_pod:
+            pod_result, pod_signer, pod_recorded_at = values[len(EXPORT_FIELDS):]
+            row += [
+                DELIVERY_RESULT_LABELS.get(pod_result, pod_result or empty),
+                pod_signer or empty,
+                as_datetime(pod_recorded_at),
+            ]
+
+        yield row
+
+
+class Echo:
+    """Pseudo-buffer per csv.writer: ritorna la riga invece di scriverla."""
+
+    def write(self, value):
+        return value
+
+
+def export_header(include_pod: bool = False) -> list:
+    return EXPORT_HEADER + EXPORT_POD_HEADER if include_pod else list(EXPORT_HEADER)
+
+
+def iter_csv(queryset, include_pod: bool = False):
+    writer = csv.writer(Echo())
+    yield writer.writerow(export_header(include_pod))
+    for row in export_rows(queryset, include_pod=include_pod):
+        yield writer.writerow(row)
@@ -0,0 +1,244 @@
+"""
+Analisi dei tempi di consegna per fase, su ShipmentLeadTime.
+
+La tabella dei fatti ha una riga per spedizione con gli istanti di primo
+ingresso negli stati principali e le durate delle fasi già calcolate: i
+percentili e gli istogrammi leggono solo questa tabella, filtrata per data
+di creazione, corriere, vettore e zona.
+"""
+import math
+from datetime import datetime, time, timedelta
+
+from django.db import connection
+from django.db.models import Aggregate, Avg, Count, F, FloatField, IntegerField, Min, Q
+from django.db.models.functions import Cast, Floor, TruncWeek
+from django.utils import timezone
+
+from .models import ShipmentLeadTime
+
+# Fase -> (stato di partenza, stato di arrivo)
+STAGES = {
+    "assign": ("created", "assigned"),
+    "pickup": ("assigned", "picked_up"),
+    "transit": ("picked_up", "out_for_delivery"),
+    "last_mile": ("out_for_delivery", "delivered"),
+    "delivery": ("picked_up", "delivered"),
+    "total": ("created", "delivered"),
+}
+
+STAGE_STATUSES = ("created", "assigned", "picked_up", "out_for_delivery", "delivered")
+
+GROUP_BY_FIELDS = {
+    "driver": "driver_id",
+    "carrier": "external_carrier_id",
+    "zone": "zone",
+    "week": "week",
+}
+
+HISTOGRAM_MAX_BUCKETS = 200
+
+
+class PercentileCont(Aggregate):
+    """percentile_cont(p) WITHIN GROUP (ORDER BY expr) di PostgreSQL."""
+
+    function = "PERCENTILE_CONT"
+    template = "%(function)s(%(percentile)s) WITHIN GROUP (ORDER BY %(expressions)s)"
+    output_field = FloatField()
+
+    def __init__(self, expression, percentile: float, **extra):
+        if not 0 <= percentile <= 1:
+            raise ValueError("Il percentile deve essere tra 0 e 1")
+        super().__init__(expression, percentile=float(percentile), **extra)
+
+
+def _percentile(values: list, percentile: float):
+    """Interpolazione lineare come percentile_cont, su valori ordinati."""
+    if not values:
+        return None
+    position = (len(values) - 1) * percentile
+    lower, upper = math.floor(position), math.ceil(position)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def refresh_lead_times(shipment_ids) -> int:
+    """
+    Ricalcola dagli eventi le righe delle spedizioni indicate, con una sola
+    aggregazione sull'indice (shipment, created_at) degli eventi e un upsert.
+    """
+    from apps.shipments.models import Shipment
+
+    first_entries = {
+        f"{status}_entered": Min("events__created_at", filter=Q(events__status=status))
+        for status in STAGE_STATUSES
+    }
+    rows = (
+        Shipment.objects.filter(pk__in=shipment_ids)
+        .values(
+            "pk", "created_at", "delivery_type", "driver_id",
+            "external_carrier_id", "driver__zone",
+        )
+        .annotate(**first_entries)
+        .order_by()
+    )
+
+    facts = []
+    for row in rows:
+        entered = {status: row[f"{status}_entered"] for status in STAGE_STATUSES}
+        # Le spedizioni create prima degli eventi di creazione partono da created_at
+        entered["created"] = entered["created"] or row["created_at"]
+
+        durations = {}
+        for stage, (start, end) in STAGES.items():
+            if entered[start] and entered[end] and entered[end] >= entered[start]:
+                durations[f"{stage}_s"] = int((entered[end] - entered[start]).total_seconds())
+            else:
+                durations[f"{stage}_s"] = None
+
+        facts.append(ShipmentLeadTime(
+            shipment_id=row["pk"],
+            delivery_type=row["delivery_type"],
+            driver_id=row["driver_id"],
+            external_carrier_id=row["external_carrier_id"],
+            zone=row["driver__zone"] or "",
+            created_at=row["created_at"],
+            assigned_at=entered["assigned"],
+            picked_up_at=entered["picked_up"],
+            out_for_delivery_at=entered["out_for_delivery"],
+            delivered_at=entered["delivered"],
+            **durations,
+        ))
+
+    ShipmentLeadTime.objects.bulk_create(
+        facts,
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=["shipment"],
+        update_fields=[
+            field.name for field in ShipmentLeadTime._meta.concrete_fields
+            if not field.primary_key
+        ],
+    )
+    return len(facts)
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def filter_lead_times(
+    date_from=None, date_to=None, zone: str = "", driver=None, carrier=None,
+    delivery_type: str = "",
+):
+    """Righe dei fatti per spedizioni create tra date_from e date_to (inclusi)."""
+    qs = ShipmentLeadTime.objects.all()
+    if date_from:
+        qs = qs.filter(created_at__gte=_day_start(date_from))
+    if date_to:
+        qs = qs.filter(created_at__lt=_day_start(date_to + timedelta(days=1)))
+    if zone:
+        qs = qs.filter(zone=zone)
+    if driver:
+        qs = qs.filter(driver__uuid=driver)
+    if carrier:
+        qs = qs.filter(external_carrier__uuid=carrier)
+    if delivery_type:
+        qs = qs.filter(delivery_type=delivery_type)
+    return qs
+
+
+def stage_percentiles(queryset, stage: str, percentiles=(0.5, 0.9), group_by: str = "") -> list:
+    """
+    Percentili (in secondi) della durata di una fase, eventualmente per gruppo.
+
+    Su PostgreSQL il calcolo è un'unica aggregazione percentile_cont; sugli
+    altri database i valori sono ordinati in Python.
+    """
+    column = f"{stage}_s"
+    qs = queryset.filter(**{f"{column}__isnull": False})
+    group_field = GROUP_BY_FIELDS.get(group_by)
+    if group_by == "week":
+        qs = qs.annotate(week=TruncWeek("created_at", tzinfo=timezone.get_current_timezone()))
+    group_fields = [group_field] if group_field else []
+
+    if connection.vendor == "postgresql":
+        aggregates = {
+            f"p{round(p * 100):g}": PercentileCont(column, p) for p in percentiles
+        }
+        rows = (
+            qs.order_by().values(*group_fields)
+            .annotate(count=Count("pk"), avg=Avg(column), **aggregates)
+            .order_by(*group_fields)
+        )
+        return _label_groups([_group_row(row, group_field) for row in rows], group_by)
+
+    groups = {}
+    for key, value in qs.order_by(column).values_list(
+        group_field or "pk", column,
+    ).iterator():
+        groups.setdefault(key if group_field else None, []).append(value)
+    result = []
+    for key, values in sorted(groups.items(), key=lambda item: str(item[0])):
+        row = {"count": len(values), "avg": sum(values) / len(values)}
+        row.update({f"p{round(p * 100):g}": _percentile(values, p) for p in percentiles})
+        if group_field:
+            row[group_field] = key
+        result.append(_group_row(row, group_field))
+    return _label_groups(result, group_by)
+
+
+def _group_row(row: dict, group_field) -> dict:
+    result = {
+        key: value for key, value in row.items() if key != group_field
+    }
+    if group_field:
+        value = row[group_field]
+        result["group"] = value.date().isoformat() if group_field == "week" and value else value
+    return result
+
+
+def _label_groups(rows: list, group_by: str) -> list:
+    """Sostituisce gli id di corriere e vettore con uuid e nome."""
+    from apps.drivers.models import Driver, ExternalCarrier
+
+    if group_by == "driver":
+        labels = {
+            driver.pk: {"uuid": str(driver.uuid), "name": driver.user.get_full_name()}
+            for driver in Driver.objects.select_related("user").filter(
+                pk__in=[row["group"] for row in rows if row["group"]],
+            )
+        }
+    elif group_by == "carrier":
+        labels = {
+            carrier.pk: {"uuid": str(carrier.uuid), "name": carrier.name}
+            for carrier in ExternalCarrier.objects.filter(
+                pk__in=[row["group"] for row in rows if row["group"]],
+            )
+        }
+    else:
+        return rows
+    for row in rows:
+        row["group"] = labels.get(row["group"])
+    return rows
+
+
+def stage_histogram(queryset, stage: str, bucket_seconds: int) -> list:
+    """Distribuzione della durata di una fase in intervalli di bucket_seconds."""
+    column = f"{stage}_s"
+    rows = (
+        queryset.filter(**{f"{column}__isnull": False})
+        .annotate(bucket=Cast(Floor(F(column) / float(bucket_seconds)), IntegerField()))
+        .order_by()
+        .values("bucket")
+        .annotate(count=Count("pk"))
+        .order_by("bucket")
+    )
+    buckets = []
+    for row in rows:
+        if len(buckets) == HISTOGRAM_MAX_BUCKETS:
+            # Coda della distribuzione accorpata nell'ultimo intervallo
+            buckets[-1]["count"] += row["count"]
+            buckets[-1]["to_s"] = None
+            continue
+        start = row["bucket"] * bucket_seconds
+        buckets.append({"from_s": start, "to_s": start + bucket_seconds, "count": row["count"]})
+    return buckets
@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.reports.stats import rebuild_daily_stats
+
+
+class Command(BaseCommand):
+    help = "Ricalcola dagli eventi il rollup giornaliero delle spedizioni"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, default=None,
+            help="Solo gli ultimi N giorni (default: tutta la storia)",
+        )
+
+    def handle(self, *args, **options):
+        since = None
+        if options["days"]:
+            since = timezone.localdate() - timedelta(days=options["days"] - 1)
+        rows = rebuild_daily_stats(since)
+        self.stdout.write(self.style.SUCCESS(f"Completato: {rows} righe"))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from apps.reports.leadtimes import refresh_lead_times
+from apps.shipments.models import Shipment
+
+
+class Command(BaseCommand):
+    help = "Ricalcola dagli eventi i tempi di consegna di tutte le spedizioni"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        last_pk = 0
+        updated = 0
+        while True:
+            ids = list(
+                Shipment.objects.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            updated += refresh_lead_times(ids)
+            last_pk = ids[-1]
+            self.stdout.write(f"{updated} spedizioni aggiornate")
+
+        self.stdout.write(self.style.SUCCESS(f"Completato: {updated} spedizioni"))
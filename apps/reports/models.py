@@ -0,0 +1,175 @@
+from django.db import models
+
+from apps.common.models import TimeStampedModel, UUIDModel
+
+
+class ExportJob(UUIDModel, TimeStampedModel):
+    """Export delle spedizioni (con esito POD) generato in background."""
+
+    class Format(models.TextChoices):
+        CSV = "csv", "CSV"
+        XLSX = "xlsx", "Excel (XLSX)"
+        PARQUET = "parquet", "Parquet"
+
+    class Status(models.TextChoices):
+        PENDING = "pending", "In coda"
+        RUNNING = "running", "In elaborazione"
+        DONE = "done", "Completato"
+        FAILED = "failed", "Fallito"
+
+    format = models.CharField(max_length=10, choices=Format.choices, default=Format.CSV)
+    status = models.CharField(
+        max_length=10, choices=Status.choices, default=Status.PENDING,
+    )
+    date_from = models.DateField(null=True, blank=True)
+    date_to = models.DateField(null=True, blank=True)
+
+    # Avanzamento
+    rows_total = models.PositiveIntegerField(default=0)
+    rows_written = models.PositiveIntegerField(default=0)
+
+    file = models.FileField(upload_to="exports/%Y/%m/%d/", blank=True)
+    error_message = models.TextField(blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    created_by = models.ForeignKey(
+        "accounts.User", null=True, on_delete=models.SET_NULL,
+        related_name="export_jobs",
+    )
+
+    class Meta:
+        db_table = "reports_export_job"
+        ordering = ["-created_at"]
+        verbose_name = "Export"
+        verbose_name_plural = "Export"
+
+    def __str__(self):
+        return f"Export {self.get_format_display()} ({self.get_status_display()})"
+
+    @property
+    def progress(self) -> int:
+        """Percentuale di righe scritte."""
+        if self.status == self.Status.DONE:
+            return 100
+        if not self.rows_total:
+            return 0
+        return min(99, self.rows_written * 100 // self.rows_total)
+
+    @property
+    def filename(self) -> str:
+        return f"spedizioni_{self.created_at:%Y%m%d_%H%M}.{self.format}"
+
+
+class DailyShipmentStat(models.Model):
+    """
+    Contatori giornalieri delle spedizioni entrate e uscite da ogni stato.
+
+    Aggiornati in modo incrementale dalle transizioni (vedi stats.py) e
+    ricalcolati ogni notte dagli eventi per gli ultimi giorni.
+    """
+
+    day = models.DateField()
+    status = models.CharField(max_length=20)
+    delivery_type = models.CharField(max_length=10)
+    driver = models.ForeignKey(
+        "drivers.Driver", null=True, on_delete=models.DO_NOTHING,
+        db_constraint=False, related_name="+",
+    )
+    external_carrier = models.ForeignKey(
+        "drivers.ExternalCarrier", null=True, on_delete=models.DO_NOTHING,
+        db_constraint=False, related_name="+",
+    )
+    entered = models.PositiveIntegerField(default=0)
+    exited = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = "reports_daily_shipment_stat"
+        verbose_name = "Statistica giornaliera spedizioni"
+        verbose_name_plural = "Statistiche giornaliere spedizioni"
+        constraints = [
+            # Chiave dell'upsert: i NULL (nessun corriere) devono collidere
+            models.UniqueConstraint(
+                fields=["day", "status", "delivery_type", "driver", "external_carrier"],
+                name="reports_daily_stat_key",
+                nulls_distinct=False,
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["status", "day"]),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.status}: +{self.entered} -{self.exited}"
+
+
+class ShipmentStatusSnapshot(models.Model):
+    """
+    Spedizioni in ciascuno stato secondo le righe del rollup precedenti a
+    `day` (stesso giorno per tutte le righe). Riscritta dalla riconciliazione
+    notturna: i totali correnti sommano solo le righe da `day` in poi.
+    """
+
+    day = models.DateField()
+    status = models.CharField(max_length=20, unique=True)
+    total = models.IntegerField()
+
+    class Meta:
+        db_table = "reports_shipment_status_snapshot"
+        verbose_name = "Fotografia stati spedizioni"
+        verbose_name_plural = "Fotografie stati spedizioni"
+
+    def __str__(self):
+        return f"{self.status} prima del {self.day}: {self.total}"
+
+
+class ShipmentLeadTime(models.Model):
+    """
+    Tempi di attraversamento di una spedizione (una riga per spedizione).
+
+    Istanti di primo ingresso negli stati principali e durate delle fasi in
+    secondi, calcolati dagli ShipmentEvent (vedi leadtimes.py). Corriere e
+    zona sono copiati dalla spedizione per filtrare senza join.
+    """
+
+    shipment = models.OneToOneField(
+        "shipments.Shipment", primary_key=True, on_delete=models.CASCADE,
+        related_name="lead_time",
+    )
+    delivery_type = models.CharField(max_length=10)
+    driver = models.ForeignKey(
+        "drivers.Driver", null=True, on_delete=models.DO_NOTHING,
+        db_constraint=False, related_name="+",
+    )
+    external_carrier = models.ForeignKey(
+        "drivers.ExternalCarrier", null=True, on_delete=models.DO_NOTHING,
+        db_constraint=False, related_name="+",
+    )
+    zone = models.CharField(max_length=100, blank=True)
+
+    created_at = models.DateTimeField()
+    assigned_at = models.DateTimeField(null=True)
+    picked_up_at = models.DateTimeField(null=True)
+    out_for_delivery_at = models.DateTimeField(null=True)
+    delivered_at = models.DateTimeField(null=True)
+
+    # Durate delle fasi in secondi (vedi leadtimes.STAGES)
+    assign_s = models.PositiveIntegerField(null=True)
+    pickup_s = models.PositiveIntegerField(null=True)
+    transit_s = models.PositiveIntegerField(null=True)
+    last_mile_s = models.PositiveIntegerField(null=True)
+    delivery_s = models.PositiveIntegerField(null=True)
+    total_s = models.PositiveIntegerField(null=True)
+
+    class Meta:
+        db_table = "reports_shipment_lead_time"
+        verbose_name = "Tempi spedizione"
+        verbose_name_plural = "Tempi spedizioni"
+        indexes = [
+            models.Index(fields=["created_at"]),
+            models.Index(fields=["zone", "created_at"]),
+            models.Index(fields=["driver", "created_at"]),
+            models.Index(fields=["external_carrier", "created_at"]),
+        ]
+
+    def __str__(self):
+        return f"Tempi {self.shipment_id}"
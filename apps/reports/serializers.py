@@ -0,0 +1,96 @@
+from rest_framework import serializers
+
+from .exports import InvalidExportRange, check_export_size, export_queryset
+from .leadtimes import GROUP_BY_FIELDS, STAGES
+from .models import ExportJob
+
+
+class ExportJobSerializer(serializers.ModelSerializer):
+    progress = serializers.IntegerField(read_only=True)
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ExportJob
+        fields = [
+            "uuid", "format", "status", "date_from", "date_to",
+            "rows_total", "rows_written", "progress", "error_message",
+            "created_at", "started_at", "finished_at", "download_url",
+        ]
+        read_only_fields = [
+            "uuid", "status", "rows_total", "rows_written", "error_message",
+            "created_at", "started_at", "finished_at",
+        ]
+
+    def validate(self, attrs):
+        date_from, date_to = attrs.get("date_from"), attrs.get("date_to")
+        if date_from and date_to and date_from > date_to:
+            raise serializers.ValidationError("date_from successiva a date_to")
+        if attrs.get("format") == ExportJob.Format.XLSX:
+            rows = export_queryset(str(date_from or ""), str(date_to or "")).count()
+            try:
+                check_export_size(ExportJob.Format.XLSX, rows)
+            except InvalidExportRange as e:
+                raise serializers.ValidationError({"format": str(e)})
+        return attrs
+
+    def get_download_url(self, obj):
+        if obj.status != ExportJob.Status.DONE:
+            return None
+        url = f"/api/v1/reports/exports/{obj.uuid}/download/"
+        request = self.context.get("request")
+        return request.build_absolute_uri(url) if request else url
+
+
+class LeadTimeQuerySerializer(serializers.Serializer):
+    """Parametri delle analisi sui tempi di consegna."""
+
+    stage = serializers.ChoiceField(choices=list(STAGES), default="delivery")
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    zone = serializers.CharField(required=False, default="")
+    driver = serializers.UUIDField(required=False)
+    carrier = serializers.UUIDField(required=False)
+    delivery_type = serializers.CharField(required=False, default="")
+
+    def validate(self, attrs):
+        date_from, date_to = attrs.get("date_from"), attrs.get("date_to")
+        if date_from and date_to and date_from > date_to:
+            raise serializers.ValidationError("date_from successiva a date_to")
+        return attrs
+
+    def filters(self) -> dict:
+        data = dict(self.validated_data)
+        data.pop("stage")
+        return data
+
+
+class LeadTimePercentilesQuerySerializer(LeadTimeQuerySerializer):
+    group_by = serializers.ChoiceField(choices=list(GROUP_BY_FIELDS), required=False)
+    percentiles = serializers.CharField(required=False, default="50,90")
+
+    def validate_percentiles(self, value):
+        try:
+            percentiles = sorted({float(p) for p in value.split(",") if p.strip()})
+        except ValueError:
+            raise serializers.ValidationError("Percentili non validi")
+        if not percentiles or len(percentiles) > 10 or not all(0 < p < 100 for p in percentiles):
+            raise serializers.ValidationError("Da 1 a 10 percentili tra 0 e 100")
+        return [p / 100 for p in percentiles]
+
+    def filters(self) -> dict:
+        data = super().filters()
+        data.pop("group_by", None)
+        data.pop("percentiles")
+        return data
+
+
+class LeadTimeHistogramQuerySerializer(LeadTimeQuerySerializer):
+    bucket = serializers.IntegerField(
+        required=False, default=3600, min_value=60,
+        help_text="Ampiezza degli intervalli in secondi",
+    )
+
+    def filters(self) -> dict:
+        data = super().filters()
+        data.pop("bucket")
+        return data
@@ -0,0 +1,12 @@
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+
+from apps.shipments.models import Shipment
+
+from .stats import record_removals
+
+
+@receiver(pre_delete, sender=Shipment, dispatch_uid="reports_shipment_removed")
+def shipment_removed(sender, instance, **kwargs):
+    """Una spedizione eliminata (API, admin o cascata) esce dal rollup."""
+    record_removals([instance])
@@ -0,0 +1,321 @@
+"""
+Rollup giornaliero delle spedizioni per stato, tipo di consegna e corriere.
+
+Ogni transizione incrementa "exited" sullo stato di partenza ed "entered" su
+quello di arrivo nel giorno corrente: le spedizioni attualmente in uno stato
+sono la somma di entered - exited, le consegne di un giorno sono gli ingressi
+in "delivered" di quel giorno. Le dashboard leggono solo questa tabella.
+
+Una spedizione eliminata esce dal suo stato corrente (signals.py). La
+riconciliazione ricalcola gli ultimi giorni dagli eventi e riallinea i totali
+correnti alle spedizioni esistenti con righe di correzione in CORRECTION_DAY,
+fuori da qualsiasi serie giornaliera. Scrive poi la fotografia dei totali per
+stato fino al primo giorno ricalcolato (ShipmentStatusSnapshot): i totali
+correnti sommano solo le righe successive, non tutto lo storico.
+"""
+from collections import Counter
+from datetime import date, datetime, time, timedelta
+
+from django.db import connection, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import DailyShipmentStat, ShipmentStatusSnapshot
+
+KEY_FIELDS = ("day", "status", "delivery_type", "driver_id", "external_carrier_id")
+
+# Giorni ricalcolati dalla riconciliazione notturna
+RECONCILE_DAYS = 2
+
+# Giorno fittizio delle righe di correzione dei totali correnti
+CORRECTION_DAY = date(1970, 1, 1)
+
+# Gli eventi più recenti di così al momento della fotografia sono ricontrollati
+# sotto lock: possono essere stati confermati dopo
+LATE_EVENTS_MARGIN = timedelta(minutes=5)
+
+
+def _key(day, status, delivery_type, driver_id, carrier_id):
+    return (day, status, delivery_type, driver_id, carrier_id)
+
+
+def _sort_key(key):
+    # Ordine stabile delle righe: upsert concorrenti non vanno in deadlock
+    return tuple("" if value is None else str(value) for value in key)
+
+
+def _upsert(entered: Counter, exited: Counter):
+    keys = sorted(set(entered) | set(exited), key=_sort_key)
+    if not keys:
+        return
+
+    table = connection.ops.quote_name(DailyShipmentStat._meta.db_table)
+    columns = ", ".join(KEY_FIELDS + ("entered", "exited"))
+    values = ", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * len(keys))
+    params = []
+    for key in keys:
+        params += [*key, entered[key], exited[key]]
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} ({columns}) VALUES {values} "
+            f"ON CONFLICT ({', '.join(KEY_FIELDS)}) DO UPDATE SET "
+            f"entered = {table}.entered + EXCLUDED.entered, "
+            f"exited = {table}.exited + EXCLUDED.exited",
+            params,
+        )
+
+
+def record_status_changes(changes, when=None):
+    """
+    Registra nel rollup una serie di cambi di stato, con un solo statement.
+
+    `changes` è un iterabile di (shipment, old_status, new_status), con
+    old_status vuoto per le spedizioni appena create. Va chiamata nella stessa
+    transazione della transizione.
+    """
+    day = timezone.localdate(when)
+    entered, exited = Counter(), Counter()
+    for shipment, old_status, new_status in changes:
+        dims = (shipment.delivery_type, shipment.driver_id, shipment.external_carrier_id)
+        if old_status:
+            exited[_key(day, old_status, *dims)] += 1
+        entered[_key(day, new_status, *dims)] += 1
+    _upsert(entered, exited)
+
+
+def record_removals(shipments, when=None):
+    """Registra l'uscita dal rollup di spedizioni eliminate, dal loro stato corrente."""
+    day = timezone.localdate(when)
+    exited = Counter(
+        _key(day, shipment.status, shipment.delivery_type,
+             shipment.driver_id, shipment.external_carrier_id)
+        for shipment in shipments
+    )
+    _upsert(Counter(), exited)
+
+
+def _running_totals(queryset, value) -> Counter:
+    totals = Counter()
+    for *dims, total in (
+        queryset.order_by()
+        .values("status", "delivery_type", "driver_id", "external_carrier_id")
+        .annotate(total=value)
+        .values_list("status", "delivery_type", "driver_id", "external_carrier_id", "total")
+    ):
+        totals[tuple(dims)] += total or 0
+    return totals
+
+
+def _corrections(kept: Counter, rebuilt_entered: Counter, rebuilt_exited: Counter):
+    """
+    Righe di correzione: differenza tra le spedizioni esistenti e i totali del
+    rollup (righe mantenute più quelle ricalcolate), per stato e dimensioni.
+    """
+    from apps.shipments.models import Shipment
+
+    expected = _running_totals(Shipment.objects.all(), Count("id"))
+    actual = Counter(kept)
+    for (_, *dims), n in rebuilt_entered.items():
+        actual[tuple(dims)] += n
+    for (_, *dims), n in rebuilt_exited.items():
+        actual[tuple(dims)] -= n
+
+    rows = []
+    for dims in sorted(set(expected) | set(actual), key=_sort_key):
+        diff = expected[dims] - actual[dims]
+        if diff:
+            rows.append(DailyShipmentStat(
+                **dict(zip(KEY_FIELDS, (CORRECTION_DAY, *dims))),
+                entered=max(diff, 0), exited=max(-diff, 0),
+            ))
+    return rows
+
+
+def _count_events(events):
+    entered, exited = Counter(), Counter()
+    for created_at, status, previous_status, *dims in events.values_list(
+        "created_at", "status", "previous_status",
+        "shipment__delivery_type", "shipment__driver_id", "shipment__external_carrier_id",
+    ).iterator(chunk_size=5000):
+        day = timezone.localdate(created_at)
+        if previous_status:
+            exited[_key(day, previous_status, *dims)] += 1
+        entered[_key(day, status, *dims)] += 1
+    return entered, exited
+
+
+def rebuild_daily_stats(since=None):
+    """
+    Ricalcola dagli eventi le righe del rollup a partire dal giorno `since`
+    (tutte se None). Ritorna il numero di righe scritte.
+
+    Gli eventi sono attribuiti al tipo di consegna e al corriere attuali della
+    spedizione: la riconciliazione corregge anche le derive per corriere dovute
+    a riassegnazioni. Le righe di correzione riallineano poi i totali correnti
+    alle spedizioni esistenti (eliminazioni, derive nei giorni non ricalcolati)
+    e la fotografia per stato si sposta al giorno `since` (a oggi se None).
+
+    I conteggi si calcolano su una fotografia del database, senza lock; la
+    tabella resta bloccata solo per aggiungere gli eventi arrivati nel
+    frattempo e sostituire le righe.
+    """
+    from apps.shipments.models import ShipmentEvent
+
+    previous = ShipmentEvent.objects.filter(
+        Q(created_at__lt=OuterRef("created_at"))
+        | Q(created_at=OuterRef("created_at"), id__lt=OuterRef("id")),
+        shipment_id=OuterRef("shipment_id"),
+    ).order_by("-created_at", "-id")
+    events = ShipmentEvent.objects.annotate(
+        previous_status=Subquery(previous.values("status")[:1]),
+    )
+    if since is not None:
+        events = events.filter(
+            created_at__gte=timezone.make_aware(datetime.combine(since, time.min)),
+        )
+
+    # Eventi, totali mantenuti e spedizioni esistenti letti dalla stessa
+    # fotografia: le transizioni proseguono durante la scansione
+    late_since = timezone.now() - LATE_EVENTS_MARGIN
+    with transaction.atomic():
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+        entered, exited = _count_events(events)
+        seen = set(
+            ShipmentEvent.objects.filter(created_at__gte=late_since).values_list("id", flat=True)
+        )
+        if since is not None:
+            kept = DailyShipmentStat.objects.filter(day__lt=since).exclude(day=CORRECTION_DAY)
+        else:
+            kept = DailyShipmentStat.objects.none()
+        kept = _running_totals(kept, Sum(F("entered") - F("exited")))
+        corrections = _corrections(kept, entered, exited)
+
+    with transaction.atomic():
+        if connection.vendor == "postgresql":
+            # Gli upsert concorrenti attendono solo la sostituzione delle righe
+            table = connection.ops.quote_name(DailyShipmentStat._meta.db_table)
+            with connection.cursor() as cursor:
+                cursor.execute(f"LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE")
+
+        # Eventi confermati dopo la fotografia: i loro upsert stanno nelle
+        # righe che si eliminano
+        late_entered, late_exited = _count_events(
+            events.filter(created_at__gte=late_since).exclude(id__in=seen),
+        )
+        entered.update(late_entered)
+        exited.update(late_exited)
+
+        stale = DailyShipmentStat.objects.exclude(day=CORRECTION_DAY)
+        if since is not None:
+            stale = stale.filter(day__gte=since)
+        stale.delete()
+        DailyShipmentStat.objects.filter(day=CORRECTION_DAY).delete()
+
+        keys = sorted(set(entered) | set(exited), key=_sort_key)
+        DailyShipmentStat.objects.bulk_create(
+            [
+                DailyShipmentStat(
+                    **dict(zip(KEY_FIELDS, key)), entered=entered[key], exited=exited[key],
+                )
+                for key in keys
+            ] + corrections,
+            batch_size=1000,
+        )
+
+        snapshot_day = since or timezone.localdate()
+        ShipmentStatusSnapshot.objects.all().delete()
+        ShipmentStatusSnapshot.objects.bulk_create(
+            ShipmentStatusSnapshot(day=snapshot_day, status=status, total=total)
+            for status, total in sorted(
+                _snapshot_totals(snapshot_day, kept, corrections, entered, exited).items()
+            )
+        )
+    return len(keys) + len(corrections)
+
+
+def _snapshot_totals(day, kept: Counter, corrections, entered: Counter, exited: Counter) -> Counter:
+    """Totali per stato delle righe del rollup precedenti a `day`, appena riscritte."""
+    totals = Counter()
+    for (status, *_), n in kept.items():
+        totals[status] += n
+    for row in corrections:
+        totals[row.status] += row.entered - row.exited
+    for (row_day, status, *_), n in entered.items():
+        if row_day < day:
+            totals[status] += n
+    for (row_day, status, *_), n in exited.items():
+        if row_day < day:
+            totals[status] -= n
+    return totals
+
+
+def status_counts() -> dict:
+    """
+    Spedizioni attualmente in ciascuno stato: la fotografia della
+    riconciliazione più le righe dal suo giorno in poi, in una sola query.
+    Senza fotografia (prima riconciliazione) si somma tutto il rollup.
+    """
+    since = Coalesce(
+        Subquery(ShipmentStatusSnapshot.objects.values("day")[:1]), Value(CORRECTION_DAY),
+    )
+    recent = (
+        DailyShipmentStat.objects.filter(day__gte=since)
+        .order_by()
+        .values("status")
+        .annotate(total=Sum(F("entered") - F("exited")))
+        .values_list("status", "total")
+    )
+    snapshot = ShipmentStatusSnapshot.objects.order_by().values_list("status", "total")
+    counts = Counter()
+    for status, total in snapshot.union(recent, all=True):
+        counts[status] += total or 0
+    return dict(counts)
+
+
+def dashboard_stats(today=None) -> dict:
+    """Contatori delle dashboard (stesse chiavi dell'aggregato su Shipment)."""
+    today = today or timezone.localdate()
+    counts = status_counts()
+    delivered_today = DailyShipmentStat.objects.filter(
+        day=today, status="delivered",
+    ).aggregate(total=Sum("entered"))["total"]
+
+    return {
+        "total": sum(counts.values()),
+        "created": counts.get("created", 0),
+        "assigned": counts.get("assigned", 0),
+        "in_transit": counts.get("picked_up", 0) + counts.get("in_transit", 0),
+        "out_for_delivery": counts.get("out_for_delivery", 0),
+        "delivered_today": delivered_today or 0,
+        "not_delivered": counts.get("not_delivered", 0),
+    }
+
+
+def daily_series(days: int, today=None) -> list:
+    """Consegne riuscite e fallite per giorno (ultimi `days` giorni)."""
+    today = today or timezone.localdate()
+    start = today - timedelta(days=days - 1)
+    totals = {
+        (day, status): total
+        for day, status, total in DailyShipmentStat.objects.filter(
+            day__gte=start, day__lte=today,
+            status__in=["delivered", "not_delivered"],
+        )
+        .order_by()
+        .values("day", "status")
+        .annotate(total=Sum("entered"))
+        .values_list("day", "status", "total")
+    }
+    series = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        series.append({
+            "day": day.isoformat(),
+            "delivered": totals.get((day, "delivered"), 0),
+            "not_delivered": totals.get((day, "not_delivered"), 0),
+        })
+    return series
@@ -0,0 +1,153 @@
+import csv
+import io
+import logging
+import tempfile
+
+from celery import shared_task
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Ogni quante righe aggiornare l'avanzamento del job
+EXPORT_PROGRESS_EVERY = 5000
+PARQUET_ROW_GROUP_SIZE = 50000
+
+
+def _tracked(job, rows):
+    """Inoltra le righe aggiornando rows_written ogni EXPORT_PROGRESS_EVERY."""
+    from .models import ExportJob
+
+    written = 0
+    for written, row in enumerate(rows, start=1):
+        yield row
+        if written % EXPORT_PROGRESS_EVERY == 0:
+            ExportJob.objects.filter(pk=job.pk).update(rows_written=written)
+    job.rows_written = written
+
+
+def _write_csv(out, header, rows):
+    text = io.TextIOWrapper(out, encoding="utf-8", newline="")
+    writer = csv.writer(text)
+    writer.writerow(header)
+    writer.writerows(rows)
+    text.flush()
+    text.detach()
+
+
+def _write_xlsx(out, header, rows):
+    from openpyxl import Workbook
+
+    # write_only: le righe vanno su file man mano, memoria costante
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Spedizioni")
+    sheet.append(header)
+    for row in rows:
+        # Excel non gestisce i fusi orari: istanti in ora locale senza tzinfo
+        sheet.append([
+            value.replace(tzinfo=None) if hasattr(value, "tzinfo") else value
+            for value in row
+        ])
+    workbook.save(out)
+
+
+def _write_parquet(out, header, rows):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    timestamp = pa.timestamp("s", tz=settings.TIME_ZONE)
+    types = {
+        "Colli": pa.int32(),
+        "Peso (kg)": pa.decimal128(8, 2),
+        "Data creazione": timestamp,
+        "Data consegna prevista": pa.date32(),
+        "Data consegna effettiva": timestamp,
+        "Data POD": timestamp,
+    }
+    schema = pa.schema([(name, types.get(name, pa.string())) for name in header])
+
+    def flush(writer, chunk):
+        columns = list(zip(*chunk))
+        writer.write_table(pa.Table.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+            schema=schema,
+        ))
+
+    with pq.ParquetWriter(out, schema, compression="zstd") as writer:
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == PARQUET_ROW_GROUP_SIZE:
+                flush(writer, chunk)
+                chunk = []
+        if chunk:
+            flush(writer, chunk)
+
+
+WRITERS = {
+    "csv": _write_csv,
+    "xlsx": _write_xlsx,
+    "parquet": _write_parquet,
+}
+
+
+@shared_task
+def run_export_job(job_id: int):
+    """Scrive l'export su un file temporaneo e lo salva nello storage di default."""
+    from .exports import check_export_size, export_header, export_queryset, export_rows
+    from .models import ExportJob
+
+    job = ExportJob.objects.get(id=job_id)
+    queryset = export_queryset(
+        str(job.date_from or ""), str(job.date_to or ""),
+    ).filter(created_at__lt=job.created_at)  # fotografia al momento della richiesta
+
+    job.status = ExportJob.Status.RUNNING
+    job.started_at = timezone.now()
+    job.rows_total = queryset.count()
+    job.save(update_fields=["status", "started_at", "rows_total", "updated_at"])
+
+    try:
+        check_export_size(job.format, job.rows_total)
+        rows = export_rows(
+            queryset, include_pod=True, formatted=job.format == ExportJob.Format.CSV,
+        )
+        with tempfile.TemporaryFile() as out:
+            WRITERS[job.format](out, export_header(include_pod=True), _tracked(job, rows))
+            out.seek(0)
+            job.file.save(job.filename, File(out), save=False)
+    except Exception as e:
+        logger.exception(f"Errore export {job.uuid}")
+        job.status = ExportJob.Status.FAILED
+        job.error_message = str(e)
+    else:
+        job.status = ExportJob.Status.DONE
+    job.finished_at = timezone.now()
+    job.save()
+
+
+def start_export_job(job):
+    """Accoda l'esecuzione di un export appena creato."""
+    transaction.on_commit(lambda: run_export_job.delay(job.id))
+
+
+@shared_task
+def reconcile_daily_stats(days: int = 0):
+    """Ricalcola dagli eventi il rollup giornaliero degli ultimi giorni."""
+    from datetime import timedelta
+
+    from .stats import RECONCILE_DAYS, rebuild_daily_stats
+
+    since = timezone.localdate() - timedelta(days=(days or RECONCILE_DAYS) - 1)
+    rows = rebuild_daily_stats(since)
+    logger.info(f"Rollup giornaliero ricalcolato dal {since}: {rows} righe")
+
+
+@shared_task
+def refresh_shipment_lead_times(shipment_ids: list):
+    """Aggiorna i tempi di consegna delle spedizioni con nuovi eventi."""
+    from .leadtimes import refresh_lead_times
+
+    return refresh_lead_times(shipment_ids)
@@ -1,10 +1,25 @@
-from django.urls import path
+from django.urls import include, path
+from rest_framework.routers import DefaultRouter
 
 from . import views
 
+router = DefaultRouter()
+router.register("reports/exports", views.ExportJobViewSet, basename="export-job")
+
 app_name = "reports"
 
 urlpatterns = [
+    path("", include(router.urls)),
     path("dashboard/stats/", views.DashboardStatsView.as_view(), name="dashboard-stats"),
+    path(
+        "reports/lead-times/percentiles/",
+        views.LeadTimePercentilesView.as_view(),
+        name="lead-time-percentiles",
+    ),
+    path(
+        "reports/lead-times/histogram/",
+        views.LeadTimeHistogramView.as_view(),
+        name="lead-time-histogram",
+    ),
     path("reports/export/csv/", views.DeliveriesExportCSVView.as_view(), name="export-csv"),
 ]
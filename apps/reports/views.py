@@ -1,36 +1,37 @@
-import csv
-
-from django.http import HttpResponse
-from rest_framework import permissions
+from django.http import FileResponse, Http404, StreamingHttpResponse
+from rest_framework import mixins, status, viewsets
+from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from apps.accounts.permissions import IsOperatorOrAdmin
-from apps.shipments.models import Shipment
+
+from .exports import InvalidExportRange, export_queryset, iter_csv
+from .leadtimes import filter_lead_times, stage_histogram, stage_percentiles
+from .models import ExportJob
+from .serializers import (
+    ExportJobSerializer,
+    LeadTimeHistogramQuerySerializer,
+    LeadTimePercentilesQuerySerializer,
+)
+from .stats import daily_series, dashboard_stats
+from .tasks import start_export_job
 
 
 class DashboardStatsView(APIView):
     permission_classes = [IsOperatorOrAdmin]
 
-    def get(self, request):
-        from django.db.models import Count, Q
-        from django.utils import timezone
-
-        today = timezone.localdate()
-
-        stats = Shipment.objects.aggregate(
-            total=Count("id"),
-            created=Count("id", filter=Q(status="created")),
-            assigned=Count("id", filter=Q(status="assigned")),
-            in_transit=Count("id", filter=Q(status__in=["picked_up", "in_transit"])),
-            out_for_delivery=Count("id", filter=Q(status="out_for_delivery")),
-            delivered_today=Count(
-                "id",
-                filter=Q(status="delivered", actual_delivery_date__date=today),
-            ),
-            not_delivered=Count("id", filter=Q(status="not_delivered")),
-        )
+    # Giorni massimi della serie giornaliera (?days=)
+    max_days = 90
 
+    def get(self, request):
+        # Letti dal rollup giornaliero, non dalla tabella delle spedizioni
+        stats = dashboard_stats()
+        try:
+            days = min(max(int(request.query_params.get("days", 7)), 1), self.max_days)
+        except ValueError:
+            days = 7
+        stats["daily"] = daily_series(days)
         return Response(stats)
 
 
@@ -38,50 +39,76 @@ class DeliveriesExportCSVView(APIView):
     permission_classes = [IsOperatorOrAdmin]
 
     def get(self, request):
-        date_from = request.query_params.get("date_from")
-        date_to = request.query_params.get("date_to")
+        try:
+            qs = export_queryset(
+                request.query_params.get("date_from", ""),
+                request.query_params.get("date_to", ""),
+            )
+        except InvalidExportRange as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Streaming: memoria costante qualunque sia la dimensione dell'export
+        response = StreamingHttpResponse(iter_csv(qs), content_type="text/csv")
+        response["Content-Disposition"] = 'attachment; filename="spedizioni.csv"'
+        return response
 
-        qs = Shipment.objects.select_related(
-            "sender", "driver", "driver__user", "external_carrier",
-        ).order_by("-created_at")
 
-        if date_from:
-            qs = qs.filter(created_at__date__gte=date_from)
-        if date_to:
-            qs = qs.filter(created_at__date__lte=date_to)
+class ExportJobViewSet(
+    mixins.CreateModelMixin,
+    mixins.ListModelMixin,
+    mixins.RetrieveModelMixin,
+    viewsets.GenericViewSet,
+):
+    """Export asincroni (CSV/XLSX/Parquet) con avanzamento e download."""
 
-        response = HttpResponse(content_type="text/csv")
-        response["Content-Disposition"] = 'attachment; filename="spedizioni.csv"'
+    permission_classes = [IsOperatorOrAdmin]
+    serializer_class = ExportJobSerializer
+    lookup_field = "uuid"
+    queryset = ExportJob.objects.select_related("created_by")
 
-        writer = csv.writer(response)
-        writer.writerow([
-            "Tracking", "Riferimento", "Mittente", "Destinatario",
-            "Indirizzo consegna", "Stato", "Tipo consegna",
-            "Corriere", "Colli", "Peso (kg)",
-            "Data creazione", "Data consegna prevista", "Data consegna effettiva",
-        ])
-
-        for s in qs:
-            driver_name = ""
-            if s.driver:
-                driver_name = s.driver.user.get_full_name()
-            elif s.external_carrier:
-                driver_name = s.external_carrier.name
-
-            writer.writerow([
-                s.tracking_code,
-                s.reference,
-                s.sender.company_name,
-                s.recipient_name,
-                s.get_effective_delivery_address(),
-                s.get_status_display(),
-                s.get_delivery_type_display(),
-                driver_name,
-                s.packages_count,
-                s.weight_kg or "",
-                s.created_at.strftime("%d/%m/%Y %H:%M"),
-                s.estimated_delivery_date.strftime("%d/%m/%Y") if s.estimated_delivery_date else "",
-                s.actual_delivery_date.strftime("%d/%m/%Y %H:%M") if s.actual_delivery_date else "",
-            ])
+    def perform_create(self, serializer):
+        start_export_job(serializer.save(created_by=self.request.user))
 
-        return response
+    @action(detail=True, methods=["get"])
+    def download(self, request, uuid=None):
+        job = self.get_object()
+        if job.status != ExportJob.Status.DONE or not job.file:
+            raise Http404("Export non ancora disponibile")
+        return FileResponse(job.file.open("rb"), as_attachment=True, filename=job.filename)
+
+
+class LeadTimePercentilesView(APIView):
+    """Percentili della durata di una fase, per corriere, vettore, zona o settimana."""
+
+    permission_classes = [IsOperatorOrAdmin]
+
+    def get(self, request):
+        params = LeadTimePercentilesQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+
+        stage = params.validated_data["stage"]
+        results = stage_percentiles(
+            filter_lead_times(**params.filters()),
+            stage,
+            percentiles=params.validated_data["percentiles"],
+            group_by=params.validated_data.get("group_by", ""),
+        )
+        return Response({"stage": stage, "unit": "seconds", "results": results})
+
+
+class LeadTimeHistogramView(APIView):
+    """Distribuzione della durata di una fase in intervalli di ampiezza fissa."""
+
+    permission_classes = [IsOperatorOrAdmin]
+
+    def get(self, request):
+        params = LeadTimeHistogramQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+
+        stage = params.validated_data["stage"]
+        buckets = stage_histogram(
+            filter_lead_times(**params.filters()),
+            stage,
+            bucket_seconds=params.validated_data["bucket"],
+        )
+        return Response({"stage": stage, "unit": "seconds", "buckets": buckets})
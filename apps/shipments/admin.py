@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Shipment, ShipmentEvent
+from .models import Shipment, ShipmentEvent, WaybillBatch
 
 
 class ShipmentEventInline(admin.TabularInline):
@@ -16,9 +16,32 @@ class ShipmentAdmin(admin.ModelAdmin):
         "tracking_code", "recipient_name", "sender", "status",
         "delivery_type", "priority", "created_at",
     )
-    list_filter = ("status", "delivery_type", "priority")
+    list_filter = ("status", "delivery_type", "priority", "sla_status")
     search_fields = ("tracking_code", "reference", "recipient_name", "sender__company_name")
-    readonly_fields = ("uuid", "tracking_code", "public_tracking_token", "created_at", "updated_at")
+    readonly_fields = (
+        "uuid", "tracking_code", "public_tracking_token", "created_at", "updated_at",
+        "last_event_status", "last_event_description", "last_event_location",
+        "last_event_at", "events_count", "sla_status", "sla_changed_at",
+    )
     inlines = [ShipmentEventInline]
     raw_id_fields = ("sender", "driver", "external_carrier", "created_by")
     date_hierarchy = "created_at"
+
+    def save_model(self, request, obj, form, change):
+        from .manifest import record_manifest_removals
+
+        super().save_model(request, obj, form, change)
+        # Riassegnazione: la spedizione esce dal manifest del corriere precedente
+        previous_driver = form.initial.get("driver")
+        if change and "driver" in form.changed_data and previous_driver:
+            record_manifest_removals([(previous_driver, obj.uuid)])
+
+
+@admin.register(WaybillBatch)
+class WaybillBatchAdmin(admin.ModelAdmin):
+    list_display = ("uuid", "status", "shipments_count", "created_by", "created_at", "finished_at")
+    list_filter = ("status",)
+    readonly_fields = (
+        "uuid", "status", "shipment_ids", "shipments_count", "file",
+        "error_message", "created_by", "created_at", "updated_at", "finished_at",
+    )
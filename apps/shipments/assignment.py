@@ -0,0 +1,293 @@
+"""
+Assegnazione automatica delle spedizioni "created" ai corrieri interni.
+
+La zona del corriere (Driver.zone) è una lista separata da virgole di sigle
+di provincia ("MI"), prefissi di CAP ("201", "20121") o nomi di città
+("Sesto San Giovanni"). Ogni spedizione va al corriere compatibile più
+scarico rispetto alla propria capacità giornaliera, a parità di carico a
+quello con meno colli e meno peso. Il carico attuale dei corrieri si legge
+con una sola query aggregata; il piano si calcola in memoria e si scrive con
+un UPDATE per corriere più gli eventi in blocco.
+"""
+import re
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from apps.drivers.models import Driver
+
+from .models import Shipment
+
+# Stati in cui una spedizione occupa il corriere a cui è assegnata
+LOAD_STATUSES = ("assigned", "picked_up", "in_transit", "out_for_delivery", "not_delivered")
+
+PRIORITY_RANK = {
+    Shipment.Priority.URGENT: 0,
+    Shipment.Priority.HIGH: 1,
+    Shipment.Priority.NORMAL: 2,
+    Shipment.Priority.LOW: 3,
+}
+
+UNASSIGNED_NO_ZONE = "no_zone"
+UNASSIGNED_NO_CAPACITY = "no_capacity"
+
+_ZONE_SEPARATORS = re.compile(r"[,;/\n]+")
+
+
+@dataclass
+class DriverLoad:
+    id: int
+    uuid: str
+    name: str
+    zone: str
+    capacity: int
+    load: int = 0
+    packages: int = 0
+    weight: Decimal = Decimal("0")
+    assigned: list = field(default_factory=list)
+
+    @property
+    def available(self) -> int:
+        return self.capacity - self.load
+
+    def sort_key(self):
+        return (self.load / self.capacity, self.packages, self.weight, self.id)
+
+
+@dataclass
+class AssignmentPlan:
+    drivers: list
+    assignments: list = field(default_factory=list)   # (shipment, DriverLoad)
+    unassigned: list = field(default_factory=list)    # (shipment, motivo)
+
+    def as_dict(self) -> dict:
+        return {
+            "assigned": len(self.assignments),
+            "unassigned": len(self.unassigned),
+            "drivers": [
+                {
+                    "uuid": driver.uuid,
+                    "name": driver.name,
+                    "zone": driver.zone,
+                    "capacity": driver.capacity,
+                    "load": driver.load,
+                    "assigned": len(driver.assigned),
+                    "packages": driver.packages,
+                    "weight_kg": str(driver.weight),
+                }
+                for driver in self.drivers
+            ],
+            "assignments": [
+                {
+                    "uuid": str(shipment.uuid),
+                    "tracking_code": shipment.tracking_code,
+                    "driver_uuid": driver.uuid,
+                }
+                for shipment, driver in self.assignments
+            ],
+            "unassigned_shipments": [
+                {
+                    "uuid": str(shipment.uuid),
+                    "tracking_code": shipment.tracking_code,
+                    "reason": reason,
+                }
+                for shipment, reason in self.unassigned
+            ],
+        }
+
+
+def parse_zone(zone: str) -> tuple[set, set, set]:
+    """Scompone Driver.zone in (province, prefissi CAP, città), normalizzati."""
+    provinces, prefixes, cities = set(), set(), set()
+    for token in _ZONE_SEPARATORS.split(zone or ""):
+        token = " ".join(token.split()).upper()
+        if not token:
+            continue
+        if token.isdigit():
+            prefixes.add(token)
+        elif len(token) == 2 and token.isalpha():
+            provinces.add(token)
+        else:
+            cities.add(token)
+    return provinces, prefixes, cities
+
+
+def assignment_pool(uuids=None, delivery_date=None):
+    """Spedizioni assegnabili: create, senza corriere, con consegna interna."""
+    queryset = Shipment.objects.filter(
+        status=Shipment.Status.CREATED,
+        delivery_type=Shipment.DeliveryType.INTERNAL,
+        driver__isnull=True,
+        external_carrier__isnull=True,
+    )
+    if uuids:
+        queryset = queryset.filter(uuid__in=uuids)
+    if delivery_date:
+        queryset = queryset.filter(
+            Q(estimated_delivery_date__lte=delivery_date)
+            | Q(estimated_delivery_date__isnull=True),
+        )
+    # L'indirizzo in rubrica prevale su quello inline, come nel foglio di vettura
+    return queryset.annotate(
+        zone_province=Coalesce("delivery_address__province", "delivery_province"),
+        zone_postal_code=Coalesce("delivery_address__postal_code", "delivery_postal_code"),
+        zone_city=Coalesce("delivery_address__city", "delivery_city"),
+    )
+
+
+def driver_loads(driver_uuids=None, now=None) -> list[DriverLoad]:
+    """Corrieri attivi con il carico del giorno, in una sola query aggregata."""
+    now = now or timezone.now()
+    day_start = timezone.localtime(now).replace(hour=0, minute=0, second=0, microsecond=0)
+    in_load = Q(shipments__status__in=LOAD_STATUSES) | Q(
+        shipments__status=Shipment.Status.DELIVERED,
+        shipments__actual_delivery_date__gte=day_start,
+    )
+
+    queryset = (
+        Driver.objects.filter(is_active=True, max_daily_shipments__gt=0)
+        .exclude(status=Driver.Status.OFF_DUTY)
+        .exclude(zone="")
+    )
+    if driver_uuids:
+        queryset = queryset.filter(uuid__in=driver_uuids)
+
+    rows = queryset.annotate(
+        load=Count("shipments", filter=in_load),
+        load_packages=Coalesce(Sum("shipments__packages_count", filter=in_load), 0),
+        load_weight=Sum("shipments__weight_kg", filter=in_load),
+        first_name=F("user__first_name"),
+        last_name=F("user__last_name"),
+    ).values_list(
+        "id", "uuid", "first_name", "last_name", "zone", "max_daily_shipments",
+        "load", "load_packages", "load_weight",
+    ).order_by("id")
+
+    return [
+        DriverLoad(
+            id=pk, uuid=str(uuid), name=f"{first_name} {last_name}".strip(), zone=zone,
+            capacity=capacity, load=load, packages=packages, weight=weight or Decimal("0"),
+        )
+        for pk, uuid, first_name, last_name, zone, capacity, load, packages, weight in rows
+    ]
+
+
+def plan_assignment(shipments, drivers: list[DriverLoad]) -> AssignmentPlan:
+    """
+    Distribuisce le spedizioni sui corrieri compatibili per zona.
+
+    Urgenti e con data prevista più vicina per prime, poi le più pesanti
+    (greedy per il bilanciamento). Le spedizioni devono avere le annotazioni
+    zone_* di assignment_pool.
+    """
+    by_province, by_prefix, by_city = {}, {}, {}
+    for driver in drivers:
+        provinces, prefixes, cities = parse_zone(driver.zone)
+        for key, index in ((provinces, by_province), (prefixes, by_prefix), (cities, by_city)):
+            for token in key:
+                index.setdefault(token, []).append(driver)
+
+    def order(shipment):
+        return (
+            PRIORITY_RANK.get(shipment.priority, len(PRIORITY_RANK)),
+            shipment.estimated_delivery_date is None,
+            shipment.estimated_delivery_date,
+            -shipment.packages_count,
+            -(shipment.weight_kg or 0),
+            shipment.pk,
+        )
+
+    plan = AssignmentPlan(drivers=drivers)
+    candidates_cache = {}
+    for shipment in sorted(shipments, key=order):
+        province = (shipment.zone_province or "").upper()
+        postal_code = (shipment.zone_postal_code or "").replace(" ", "")
+        city = " ".join((shipment.zone_city or "").split()).upper()
+
+        cache_key = (province, postal_code, city)
+        candidates = candidates_cache.get(cache_key)
+        if candidates is None:
+            found = {}
+            for driver in by_province.get(province, ()):
+                found[driver.id] = driver
+            for length in range(1, len(postal_code) + 1):
+                for driver in by_prefix.get(postal_code[:length], ()):
+                    found[driver.id] = driver
+            for driver in by_city.get(city, ()):
+                found[driver.id] = driver
+            candidates = candidates_cache[cache_key] = list(found.values())
+
+        if not candidates:
+            plan.unassigned.append((shipment, UNASSIGNED_NO_ZONE))
+            continue
+
+        available = [driver for driver in candidates if driver.available > 0]
+        if not available:
+            plan.unassigned.append((shipment, UNASSIGNED_NO_CAPACITY))
+            continue
+
+        driver = min(available, key=DriverLoad.sort_key)
+        driver.load += 1
+        driver.packages += shipment.packages_count
+        driver.weight += shipment.weight_kg or 0
+        driver.assigned.append(shipment)
+        plan.assignments.append((shipment, driver))
+
+    return plan
+
+
+def auto_assign(user=None, uuids=None, driver_uuids=None, delivery_date=None,
+                dry_run: bool = False) -> AssignmentPlan:
+    """
+    Assegna automaticamente le spedizioni create ai corrieri per zona e capacità.
+
+    Con dry_run calcola solo il piano, senza scrivere nulla. Altrimenti blocca
+    i corrieri coinvolti (due assegnazioni automatiche concorrenti non
+    superano la capacità) e le spedizioni del pool, saltando quelle già
+    bloccate da altre transazioni, poi scrive driver, stato ed eventi.
+    """
+    from .state_machine import apply_transitions_bulk
+    from .tasks import schedule_route_sequencing
+
+    pool = assignment_pool(uuids=uuids, delivery_date=delivery_date)
+
+    if dry_run:
+        return plan_assignment(pool, driver_loads(driver_uuids))
+
+    with transaction.atomic():
+        drivers = Driver.objects.filter(is_active=True)
+        if driver_uuids:
+            drivers = drivers.filter(uuid__in=driver_uuids)
+        list(drivers.select_for_update().order_by("pk").values_list("pk", flat=True))
+
+        shipments = list(
+            pool.select_for_update(skip_locked=True, of=("self",)).order_by("pk")
+        )
+        plan = plan_assignment(shipments, driver_loads(driver_uuids))
+
+        for driver in plan.drivers:
+            if driver.assigned:
+                Shipment.objects.filter(pk__in=[s.pk for s in driver.assigned]).update(
+                    driver_id=driver.id,
+                    delivery_type=Shipment.DeliveryType.INTERNAL,
+                )
+        for shipment, driver in plan.assignments:
+            shipment.driver_id = driver.id
+
+        apply_transitions_bulk(
+            [
+                (shipment, Shipment.Status.ASSIGNED, {
+                    "description": f"Spedizione assegnata automaticamente a {driver.name}",
+                    "metadata": {"auto_assignment": True, "driver": driver.uuid},
+                })
+                for shipment, driver in plan.assignments
+            ],
+            user=user,
+        )
+        schedule_route_sequencing(driver.id for driver in plan.drivers if driver.assigned)
+
+    return plan
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from apps.shipments.models import Shipment, ShipmentEvent
+
+
+class Command(BaseCommand):
+    help = "Ricalcola dagli eventi il riepilogo dell'ultimo evento e il numero di eventi"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        latest = ShipmentEvent.objects.filter(
+            shipment=OuterRef("pk"),
+        ).order_by("-created_at", "-id")
+        count = (
+            ShipmentEvent.objects.filter(shipment=OuterRef("pk"))
+            .order_by()
+            .values("shipment")
+            .annotate(total=Count("id"))
+            .values("total")
+        )
+
+        last_pk = 0
+        updated = 0
+        while True:
+            ids = list(
+                Shipment.objects.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            updated += Shipment.objects.filter(pk__in=ids).update(
+                last_event_status=Coalesce(Subquery(latest.values("status")[:1]), Value("")),
+                last_event_description=Coalesce(
+                    Subquery(latest.values("description")[:1]), Value(""),
+                ),
+                last_event_location=Coalesce(
+                    Subquery(latest.values("location")[:1]), Value(""),
+                ),
+                last_event_at=Subquery(latest.values("created_at")[:1]),
+                events_count=Coalesce(Subquery(count), Value(0)),
+            )
+            last_pk = ids[-1]
+            self.stdout.write(f"{updated} spedizioni aggiornate")
+
+        self.stdout.write(self.style.SUCCESS(f"Completato: {updated} spedizioni"))
@@ -0,0 +1,116 @@
+"""
+Manifest delta delle spedizioni del giorno per la PWA corriere.
+
+Il cursore è la versione dei dati del corriere: il massimo updated_at delle
+sue spedizioni e dei tombstone, insieme alla versione del formato e al
+giorno. Con un cursore valido la risposta contiene solo le spedizioni
+modificate da allora e gli UUID di quelle uscite dal manifest (per stato,
+riassegnazione o cancellazione); con un cursore di un altro giorno o di un
+altro formato il client riceve il manifest completo.
+"""
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+
+from django.db.models import F, Max, Q
+from django.utils import timezone
+
+from .models import ManifestTombstone, Shipment
+
+# Da incrementare quando cambia il contenuto del manifest: forza il completo
+MANIFEST_VERSION = 1
+
+# Le righe con updated_at assegnato poco prima del cursore ma confermate dopo
+# la lettura vengono ripescate rileggendo questo intervallo a ogni delta
+MANIFEST_OVERLAP = timedelta(seconds=60)
+
+# I cursori valgono solo per il giorno corrente
+TOMBSTONE_RETENTION = timedelta(days=2)
+
+MANIFEST_ACTIVE_STATUSES = ("assigned", "picked_up", "in_transit", "out_for_delivery")
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def manifest_q(today) -> Q:
+    """Condizione di appartenenza al manifest del giorno (oltre al corriere)."""
+    return (
+        Q(estimated_delivery_date=today) | Q(status__in=MANIFEST_ACTIVE_STATUSES)
+    ) & ~Q(status__in=["cancelled", "returned"])
+
+
+def driver_manifest(driver_id: int, today=None):
+    """Spedizioni del giorno del corriere, nell'ordine del giro di consegna."""
+    today = today or timezone.localdate()
+    return (
+        Shipment.objects.filter(manifest_q(today), driver_id=driver_id)
+        .select_related("sender", "driver__user", "delivery_address")
+        .order_by(F("route_position").asc(nulls_last=True), "created_at")
+    )
+
+
+def manifest_cursor(driver_id: int, today=None) -> str:
+    today = today or timezone.localdate()
+    versions = [
+        Shipment.objects.filter(driver_id=driver_id).aggregate(v=Max("updated_at"))["v"],
+        ManifestTombstone.objects.filter(driver_id=driver_id).aggregate(v=Max("removed_at"))["v"],
+    ]
+    version = max((v for v in versions if v is not None), default=_EPOCH)
+    micros = (version - _EPOCH) // timedelta(microseconds=1)
+    return f"{MANIFEST_VERSION}.{today.isoformat()}.{micros}"
+
+
+def parse_cursor(cursor, today=None):
+    """Istante del cursore, o None se assente, malformato o non più valido."""
+    today = today or timezone.localdate()
+    try:
+        version, day, micros = (cursor or "").split(".")
+        if int(version) != MANIFEST_VERSION or day != today.isoformat():
+            return None
+        return _EPOCH + timedelta(microseconds=int(micros))
+    except (ValueError, OverflowError):
+        return None
+
+
+def manifest_delta(driver_id: int, since=None, today=None) -> tuple[list, list]:
+    """
+    Ritorna (spedizioni da inserire o aggiornare, UUID rimossi).
+
+    Senza `since` il manifest è completo e non ci sono rimozioni.
+    """
+    today = today or timezone.localdate()
+    shipments = driver_manifest(driver_id, today)
+    if since is None:
+        return list(shipments), []
+
+    window = since - MANIFEST_OVERLAP
+    changed = list(shipments.filter(updated_at__gt=window))
+    current = {shipment.uuid for shipment in changed}
+
+    removed = set(
+        Shipment.objects.filter(driver_id=driver_id, updated_at__gt=window)
+        .exclude(manifest_q(today))
+        .values_list("uuid", flat=True)
+    )
+    removed.update(
+        ManifestTombstone.objects.filter(driver_id=driver_id, removed_at__gt=window)
+        .values_list("shipment_uuid", flat=True)
+    )
+    return changed, sorted(str(uuid) for uuid in removed - current)
+
+
+def record_manifest_removals(removals, when=None):
+    """Registra le spedizioni (driver_id, shipment_uuid) uscite da un manifest."""
+    when = when or timezone.now()
+    ManifestTombstone.objects.bulk_create([
+        ManifestTombstone(driver_id=driver_id, shipment_uuid=uuid, removed_at=when)
+        for driver_id, uuid in removals
+        if driver_id
+    ])
+
+
+def purge_tombstones(now=None) -> int:
+    now = now or timezone.now()
+    deleted, _ = ManifestTombstone.objects.filter(
+        removed_at__lt=now - TOMBSTONE_RETENTION,
+    ).delete()
+    return deleted
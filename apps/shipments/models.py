@@ -1,6 +1,8 @@
 import secrets
 
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.db import models
+from django.db.models.functions import Upper
 from django.utils import timezone
 
 from apps.common.models import TimeStampedModel, UUIDModel
@@ -10,6 +12,14 @@ def generate_tracking_code():
     return f"POD-{secrets.token_hex(4).upper()}"
 
 
+EVENT_SNAPSHOT_FIELDS = (
+    "last_event_status", "last_event_description", "last_event_location", "last_event_at",
+)
+
+# Stati finali: le spedizioni in questi stati non sono più valutate per lo SLA
+CLOSED_STATUSES = ("delivered", "returned", "cancelled")
+
+
 class Shipment(UUIDModel, TimeStampedModel):
     class Status(models.TextChoices):
         CREATED = "created", "Creata"
@@ -28,6 +38,11 @@ class Shipment(UUIDModel, TimeStampedModel):
         HIGH = "high", "Alta"
         URGENT = "urgent", "Urgente"
 
+    class SlaStatus(models.TextChoices):
+        ON_TIME = "", "Nei tempi"
+        AT_RISK = "at_risk", "A rischio"
+        BREACHED = "breached", "In ritardo"
+
     class DeliveryType(models.TextChoices):
         INTERNAL = "internal", "Corriere interno"
         EXTERNAL = "external", "Corriere esterno"
@@ -86,6 +101,8 @@ class Shipment(UUIDModel, TimeStampedModel):
         on_delete=models.SET_NULL, related_name="shipments",
     )
     external_tracking_number = models.CharField(max_length=100, blank=True, db_index=True)
+    # Ordine di consegna nel giro del corriere (apps.shipments.routing)
+    route_position = models.PositiveIntegerField("Posizione nel giro", null=True, blank=True)
 
     # Dettagli
     description = models.TextField("Descrizione merce", blank=True)
@@ -114,15 +131,52 @@ class Shipment(UUIDModel, TimeStampedModel):
         related_name="created_shipments",
     )
 
+    # Riepilogo dell'ultimo evento (mantenuto da state_machine)
+    last_event_status = models.CharField(
+        max_length=20, choices=Status.choices, blank=True,
+    )
+    last_event_description = models.CharField(max_length=500, blank=True)
+    last_event_location = models.CharField(max_length=255, blank=True)
+    last_event_at = models.DateTimeField(null=True, blank=True)
+    events_count = models.PositiveIntegerField(default=0)
+
+    # SLA sulla data di consegna prevista (mantenuto da sla.scan_sla)
+    sla_status = models.CharField(
+        max_length=10, choices=SlaStatus.choices, default=SlaStatus.ON_TIME, blank=True,
+    )
+    sla_changed_at = models.DateTimeField(null=True, blank=True)
+
     class Meta:
         db_table = "shipments_shipment"
         ordering = ["-created_at"]
         indexes = [
             models.Index(fields=["status", "created_at"]),
+            models.Index(fields=["created_at", "id"]),
             models.Index(fields=["delivery_type", "status"]),
             models.Index(fields=["sender", "status"]),
             models.Index(fields=["driver", "status"]),
+            # Manifest delta della PWA corriere (apps/shipments/manifest.py)
+            models.Index(fields=["driver", "updated_at"], name="shipment_driver_updated"),
             models.Index(fields=["estimated_delivery_date"]),
+            # Scanner SLA: solo le spedizioni aperte
+            models.Index(
+                fields=["sla_status", "estimated_delivery_date", "priority"],
+                name="shipment_open_sla",
+                condition=~models.Q(status__in=CLOSED_STATUSES),
+            ),
+            # Ricerca per sottostringa (pg_trgm), vedi apps/shipments/search.py
+            GinIndex(
+                OpClass(Upper("tracking_code"), name="gin_trgm_ops"),
+                name="shipment_tracking_code_trgm",
+            ),
+            GinIndex(
+                OpClass(Upper("reference"), name="gin_trgm_ops"),
+                name="shipment_reference_trgm",
+            ),
+            GinIndex(
+                OpClass(Upper("recipient_name"), name="gin_trgm_ops"),
+                name="shipment_recipient_name_trgm",
+            ),
         ]
 
     def save(self, *args, **kwargs):
@@ -143,6 +197,14 @@ class Shipment(UUIDModel, TimeStampedModel):
         ])
         return ", ".join(parts)
 
+    def apply_event_snapshot(self, event) -> list:
+        """Aggiorna in memoria il riepilogo dell'ultimo evento e ritorna i campi modificati."""
+        self.last_event_status = event.status
+        self.last_event_description = event.description
+        self.last_event_location = event.location
+        self.last_event_at = event.created_at
+        return list(EVENT_SNAPSHOT_FIELDS)
+
     def get_external_tracking_url(self) -> str:
         if self.external_carrier and self.external_tracking_number:
             return self.external_carrier.get_tracking_url(self.external_tracking_number)
@@ -172,3 +234,61 @@ class ShipmentEvent(UUIDModel, TimeStampedModel):
 
     def __str__(self):
         return f"{self.shipment.tracking_code} - {self.get_status_display()}"
+
+
+class ManifestTombstone(models.Model):
+    """
+    Spedizione uscita dal manifest di un corriere perché riassegnata o
+    cancellata: il manifest delta la comunica come rimossa.
+    """
+
+    driver = models.ForeignKey(
+        "drivers.Driver", on_delete=models.CASCADE, related_name="+",
+    )
+    shipment_uuid = models.UUIDField()
+    removed_at = models.DateTimeField()
+
+    class Meta:
+        db_table = "shipments_manifest_tombstone"
+        indexes = [
+            models.Index(fields=["driver", "removed_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.shipment_uuid} ({self.removed_at:%d/%m %H:%M})"
+
+
+class WaybillBatch(UUIDModel, TimeStampedModel):
+    """Stampa multipla di fogli di vettura generata in background."""
+
+    # Oltre questa soglia la stampa multipla diventa un job asincrono
+    SYNC_LIMIT = 50
+    MAX_SHIPMENTS = 2000
+
+    class Status(models.TextChoices):
+        PENDING = "pending", "In coda"
+        RUNNING = "running", "In elaborazione"
+        DONE = "done", "Completata"
+        FAILED = "failed", "Fallita"
+
+    status = models.CharField(
+        max_length=10, choices=Status.choices, default=Status.PENDING,
+    )
+    shipment_ids = models.JSONField(default=list)
+    shipments_count = models.PositiveIntegerField(default=0)
+    file = models.FileField(upload_to="waybill_batches/%Y/%m/%d/", blank=True)
+    error_message = models.TextField(blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    created_by = models.ForeignKey(
+        "accounts.User", null=True, on_delete=models.SET_NULL,
+        related_name="waybill_batches",
+    )
+
+    class Meta:
+        db_table = "shipments_waybill_batch"
+        ordering = ["-created_at"]
+        verbose_name = "Stampa multipla fogli di vettura"
+        verbose_name_plural = "Stampe multiple fogli di vettura"
+
+    def __str__(self):
+        return f"Stampa {self.shipments_count} fogli ({self.get_status_display()})"
@@ -0,0 +1,17 @@
+from rest_framework.renderers import BaseRenderer
+
+
+class ZPLRenderer(BaseRenderer):
+    """Etichette termiche ZPL (?format=zpl)."""
+
+    media_type = "application/zpl"
+    format = "zpl"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, str):
+            return data.encode(self.charset)
+        # Risposte di errore: solo il messaggio, come testo
+        if isinstance(data, dict) and "detail" in data:
+            data = data["detail"]
+        return str(data).encode(self.charset)
@@ -0,0 +1,182 @@
+"""
+Sequenza di consegna delle fermate giornaliere di un corriere.
+
+Costruzione nearest-neighbour e miglioramento 2-opt / Or-opt su una matrice
+delle distanze haversine calcolata una volta sola con NumPy. Il percorso è
+aperto: parte dal deposito (ROUTE_DEPOT), dalla posizione del corriere o da
+un punto libero e termina sull'ultima fermata. Le urgenti vengono prima di
+tutte le altre; le fermate senza coordinate chiudono il giro nell'ordine di
+creazione.
+"""
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Shipment
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Stati delle fermate ancora da consegnare
+ROUTE_STATUSES = ("assigned", "picked_up", "in_transit", "out_for_delivery")
+
+# Budget di ottimizzazione per gruppo di fermate (urgenti / altre)
+ROUTE_TIME_LIMIT = 0.08
+
+_EPSILON = 1e-9
+
+
+def haversine_matrix(latitudes, longitudes) -> np.ndarray:
+    """Matrice delle distanze in km tra tutte le coppie di punti."""
+    lat = np.radians(np.asarray(latitudes, dtype=float))
+    lng = np.radians(np.asarray(longitudes, dtype=float))
+    dlat = lat[:, None] - lat[None, :]
+    dlng = lng[:, None] - lng[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def _nearest_neighbour(dist, start: int, nodes, end: int) -> np.ndarray:
+    route = [start]
+    remaining = np.asarray(nodes, dtype=int)
+    current = start
+    while remaining.size:
+        k = int(np.argmin(dist[current, remaining]))
+        current = int(remaining[k])
+        route.append(current)
+        remaining = np.delete(remaining, k)
+    route.append(end)
+    return np.asarray(route, dtype=int)
+
+
+def _two_opt(dist, route: np.ndarray) -> bool:
+    """2-opt best-improvement sul percorso (estremi fissi), modificato sul posto."""
+    improved = False
+    while True:
+        a, b = route[:-1], route[1:]
+        edges = dist[a, b]
+        # Scambio degli archi (a_k, b_k) e (a_m, b_m) con (a_k, a_m) e (b_k, b_m)
+        delta = dist[np.ix_(a, a)] + dist[np.ix_(b, b)] - edges[:, None] - edges[None, :]
+        delta = np.triu(delta, k=2)
+        k, m = np.unravel_index(int(np.argmin(delta)), delta.shape)
+        if delta[k, m] >= -_EPSILON:
+            return improved
+        route[k + 1:m + 1] = route[k + 1:m + 1][::-1]
+        improved = True
+
+
+def _or_opt(dist, route: np.ndarray) -> tuple[np.ndarray, bool]:
+    """Sposta segmenti di 1-3 fermate (anche invertiti) nella posizione migliore."""
+    improved = False
+    for length in (1, 2, 3):
+        i = 1
+        while i + length < len(route):
+            segment = route[i:i + length]
+            first, last = segment[0], segment[-1]
+            prev, nxt = route[i - 1], route[i + length]
+            gain = dist[prev, first] + dist[last, nxt] - dist[prev, nxt]
+
+            rest = np.concatenate((route[:i], route[i + length:]))
+            a, b = rest[:-1], rest[1:]
+            base = dist[a, b]
+            forward = dist[a, first] + dist[last, b] - base
+            backward = dist[a, last] + dist[first, b] - base
+            j_forward = int(np.argmin(forward))
+            j_backward = int(np.argmin(backward))
+
+            if min(forward[j_forward], backward[j_backward]) < gain - _EPSILON:
+                if forward[j_forward] <= backward[j_backward]:
+                    j, moved = j_forward, segment
+                else:
+                    j, moved = j_backward, segment[::-1]
+                route = np.concatenate((rest[:j + 1], moved, rest[j + 1:]))
+                improved = True
+                continue
+            i += 1
+    return route, improved
+
+
+def _solve(dist, start: int, nodes, end: int, time_limit: float) -> list[int]:
+    if len(nodes) == 0:
+        return []
+    route = _nearest_neighbour(dist, start, nodes, end)
+    if len(nodes) > 2:
+        deadline = time.perf_counter() + time_limit
+        while time.perf_counter() < deadline:
+            improved = _two_opt(dist, route)
+            route, moved = _or_opt(dist, route)
+            if not (improved or moved):
+                break
+    return [int(node) for node in route[1:-1]]
+
+
+def sequence_stops(stops, start=None, time_limit: float = ROUTE_TIME_LIMIT) -> list:
+    """
+    Ordina le fermate e ritorna le loro chiavi nell'ordine di consegna.
+
+    `stops` è una lista di (chiave, latitudine, longitudine, urgente); le
+    coordinate possono essere None. `start` è una coppia (lat, lng) opzionale.
+    """
+    located = [stop for stop in stops if stop[1] is not None and stop[2] is not None]
+    unlocated = [stop[0] for stop in stops if stop[1] is None or stop[2] is None]
+    if not located:
+        return unlocated
+
+    # Nodo 0: partenza, 1..n: fermate, n+1: arrivo fittizio a distanza zero
+    n = len(located)
+    latitudes = [start[0] if start else 0.0, *(float(s[1]) for s in located), 0.0]
+    longitudes = [start[1] if start else 0.0, *(float(s[2]) for s in located), 0.0]
+    dist = haversine_matrix(latitudes, longitudes)
+    dist[n + 1, :] = dist[:, n + 1] = 0.0
+    if not start:
+        dist[0, :] = dist[:, 0] = 0.0
+
+    urgent = [i + 1 for i, stop in enumerate(located) if stop[3]]
+    others = [i + 1 for i, stop in enumerate(located) if not stop[3]]
+    order = _solve(dist, 0, urgent, n + 1, time_limit)
+    order += _solve(dist, order[-1] if order else 0, others, n + 1, time_limit)
+    return [located[i - 1][0] for i in order] + unlocated
+
+
+def depot_location():
+    depot = getattr(settings, "ROUTE_DEPOT", None)
+    return tuple(depot) if depot and len(depot) == 2 else None
+
+
+def route_stops(driver_id: int):
+    return Shipment.objects.filter(driver_id=driver_id, status__in=ROUTE_STATUSES)
+
+
+def sequence_driver_route(driver_id: int, start=None) -> int:
+    """
+    Calcola e salva route_position per le fermate aperte del corriere.
+
+    Senza `start` il giro parte dal deposito. Ritorna il numero di fermate.
+    """
+    rows = list(
+        route_stops(driver_id)
+        .order_by("created_at", "id")
+        .values_list(
+            "id", "delivery_address__latitude", "delivery_address__longitude",
+            "priority", "route_position",
+        )
+    )
+    order = sequence_stops(
+        [(pk, lat, lng, priority == Shipment.Priority.URGENT) for pk, lat, lng, priority, _ in rows],
+        start=start or depot_location(),
+    )
+
+    # Solo le fermate che cambiano posizione: updated_at le fa rientrare nel
+    # manifest delta della PWA
+    now = timezone.now()
+    current = {row[0]: row[4] for row in rows}
+    shipments = [
+        Shipment(id=pk, route_position=position, updated_at=now)
+        for position, pk in enumerate(order, start=1)
+        if current[pk] != position
+    ]
+    with transaction.atomic():
+        Shipment.objects.bulk_update(shipments, ["route_position", "updated_at"], batch_size=500)
+    return len(order)
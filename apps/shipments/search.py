@@ -0,0 +1,53 @@
+"""
+Ricerca spedizioni.
+
+Le ricerche per sottostringa (icontains) sono servite dagli indici GIN
+pg_trgm su UPPER(colonna) definiti in Shipment.Meta e Customer.Meta; i codici
+tracking e i numeri di tracking esterni hanno un percorso esatto sugli indici
+B-tree.
+"""
+import re
+
+from django.db.models import Q
+
+from apps.common.filters import QuerySearchFilter
+from apps.customers.models import Customer
+from apps.customers.search import customer_search_q
+
+TRACKING_CODE_RE = re.compile(r"^POD-[0-9A-F]{8}$", re.IGNORECASE)
+EXTERNAL_TRACKING_RE = re.compile(r"^(?=.*\d)[A-Z0-9-]{8,}$", re.IGNORECASE)
+
+
+def search_shipments(queryset, query: str):
+    query = query.strip()
+    if not query:
+        return queryset
+
+    if TRACKING_CODE_RE.match(query):
+        return queryset.filter(tracking_code=query.upper())
+
+    if EXTERNAL_TRACKING_RE.match(query):
+        exact = queryset.filter(
+            Q(external_tracking_number=query) | Q(reference=query),
+        )
+        if exact.exists():
+            return exact
+
+    return queryset.filter(shipment_search_q(query))
+
+
+def shipment_search_q(query: str) -> Q:
+    # Il mittente è cercato con una subquery sull'indice trigram dei clienti,
+    # evitando l'OR su una colonna in JOIN che impedisce l'uso degli indici.
+    senders = Customer.objects.filter(customer_search_q(query)).values("pk")
+    return (
+        Q(tracking_code__icontains=query)
+        | Q(reference__icontains=query)
+        | Q(recipient_name__icontains=query)
+        | Q(sender__in=senders)
+    )
+
+
+class ShipmentSearchFilter(QuerySearchFilter):
+    search = staticmethod(search_shipments)
+    search_q = staticmethod(shipment_search_q)
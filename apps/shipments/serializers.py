@@ -3,8 +3,13 @@ from rest_framework import serializers
 from apps.customers.serializers import CustomerListSerializer
 from apps.drivers.serializers import DriverSerializer, ExternalCarrierSerializer
 
-from .models import Shipment, ShipmentEvent
-from .state_machine import VALID_TRANSITIONS
+from .models import Shipment, ShipmentEvent, WaybillBatch
+from .state_machine import (
+    BULK_TRANSITION_MAX_ITEMS,
+    VALID_TRANSITIONS,
+    record_creation_event,
+)
+from .tasks import schedule_waybill_prerender
 
 
 class ShipmentEventSerializer(serializers.ModelSerializer):
@@ -29,7 +34,9 @@ class ShipmentListSerializer(serializers.ModelSerializer):
             "uuid", "tracking_code", "reference", "recipient_name",
             "sender_name", "status", "priority", "delivery_type",
             "driver_name", "packages_count", "estimated_delivery_date",
-            "delivery_address_display", "created_at",
+            "delivery_address_display",
+            "last_event_status", "last_event_description", "last_event_at", "events_count",
+            "sla_status", "route_position", "created_at",
         )
 
     def get_driver_name(self, obj):
@@ -66,13 +73,14 @@ class ShipmentDetailSerializer(serializers.ModelSerializer):
             "external_tracking_url",
             "description", "packages_count", "weight_kg", "notes_internal",
             "estimated_delivery_date", "actual_delivery_date", "picked_up_at",
-            "waybill_printed_at",
+            "waybill_printed_at", "sla_status", "sla_changed_at",
             "events", "allowed_transitions",
             "created_at", "updated_at",
         )
         read_only_fields = (
             "uuid", "tracking_code", "public_tracking_token",
             "actual_delivery_date", "picked_up_at", "waybill_printed_at",
+            "sla_status", "sla_changed_at",
         )
 
     def get_delivery_address_display(self, obj):
@@ -103,12 +111,8 @@ class ShipmentCreateSerializer(serializers.ModelSerializer):
         validated_data["created_by"] = self.context["request"].user
         shipment = super().create(validated_data)
         # Crea evento iniziale
-        ShipmentEvent.objects.create(
-            shipment=shipment,
-            status="created",
-            description="Spedizione creata",
-            recorded_by=self.context["request"].user,
-        )
+        record_creation_event(shipment, user=self.context["request"].user)
+        schedule_waybill_prerender(shipment)
         return shipment
 
 
@@ -124,7 +128,61 @@ class ShipmentTransitionSerializer(serializers.Serializer):
     )
 
 
+class ShipmentBulkTransitionItemSerializer(ShipmentTransitionSerializer):
+    uuid = serializers.UUIDField()
+
+
+class ShipmentBulkTransitionSerializer(serializers.Serializer):
+    items = ShipmentBulkTransitionItemSerializer(
+        many=True, allow_empty=False, max_length=BULK_TRANSITION_MAX_ITEMS,
+    )
+
+
 class ShipmentAssignSerializer(serializers.Serializer):
     driver_uuid = serializers.UUIDField(required=False, allow_null=True)
     external_carrier_uuid = serializers.UUIDField(required=False, allow_null=True)
     external_tracking_number = serializers.CharField(required=False, default="")
+
+
+class ShipmentAutoAssignSerializer(serializers.Serializer):
+    # Senza uuids il pool sono tutte le spedizioni create e non assegnate
+    uuids = serializers.ListField(child=serializers.UUIDField(), required=False)
+    driver_uuids = serializers.ListField(child=serializers.UUIDField(), required=False)
+    delivery_date = serializers.DateField(required=False, allow_null=True)
+    dry_run = serializers.BooleanField(default=False)
+
+
+class RouteStartSerializer(serializers.Serializer):
+    latitude = serializers.DecimalField(
+        max_digits=9, decimal_places=6, required=False, allow_null=True,
+    )
+    longitude = serializers.DecimalField(
+        max_digits=9, decimal_places=6, required=False, allow_null=True,
+    )
+
+
+class ShipmentWaybillBatchSerializer(serializers.Serializer):
+    # Senza uuids si stampano le spedizioni selezionate dai filtri della lista
+    uuids = serializers.ListField(
+        child=serializers.UUIDField(), required=False,
+        max_length=WaybillBatch.MAX_SHIPMENTS,
+    )
+
+
+class WaybillBatchSerializer(serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = WaybillBatch
+        fields = [
+            "uuid", "status", "shipments_count", "error_message",
+            "created_at", "finished_at", "download_url",
+        ]
+        read_only_fields = fields
+
+    def get_download_url(self, obj):
+        if obj.status != WaybillBatch.Status.DONE:
+            return None
+        url = f"/api/v1/waybill-batches/{obj.uuid}/download/"
+        request = self.context.get("request")
+        return request.build_absolute_uri(url) if request else url
@@ -0,0 +1,86 @@
+"""
+Valutazione dello SLA delle spedizioni aperte rispetto alla data prevista.
+
+Una spedizione è "in ritardo" se la data di consegna prevista è passata,
+"a rischio" se mancano meno di SLA_AT_RISK_HOURS (per priorità) alla fine
+della giornata prevista. Lo scanner aggiorna solo le righe il cui stato SLA
+cambia, con UPDATE a blocchi sull'indice parziale delle spedizioni aperte.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import CLOSED_STATUSES, Shipment
+
+# Ore prima della fine della giornata prevista in cui la spedizione è a rischio
+SLA_AT_RISK_HOURS = {
+    Shipment.Priority.LOW: 4,
+    Shipment.Priority.NORMAL: 8,
+    Shipment.Priority.HIGH: 24,
+    Shipment.Priority.URGENT: 48,
+}
+
+SLA_SCAN_BATCH_SIZE = 5000
+
+
+def open_shipments():
+    # Stessa condizione dell'indice parziale shipment_open_sla
+    return Shipment.objects.exclude(status__in=CLOSED_STATUSES)
+
+
+def _update_in_batches(queryset, sla_status: str, now, batch_size: int) -> int:
+    updated = 0
+    while True:
+        with transaction.atomic():
+            ids = list(queryset.order_by().values_list("pk", flat=True)[:batch_size])
+            if not ids:
+                return updated
+            updated += Shipment.objects.filter(pk__in=ids).update(
+                sla_status=sla_status, sla_changed_at=now, updated_at=now,
+            )
+
+
+def scan_sla(now=None, batch_size: int = SLA_SCAN_BATCH_SIZE) -> dict:
+    """
+    Aggiorna i flag SLA delle spedizioni aperte e ritorna i cambi per stato.
+
+    Ogni query legge solo le righe che devono cambiare stato: gli intervalli
+    di date e lo stato SLA attuale sono entrambi nell'indice parziale.
+    """
+    now = now or timezone.now()
+    today = timezone.localdate(now)
+    Status = Shipment.SlaStatus
+    changes = {"breached": 0, "at_risk": 0, "on_time": 0}
+
+    # Data prevista passata
+    changes["breached"] += _update_in_batches(
+        open_shipments().filter(
+            sla_status__in=[Status.ON_TIME, Status.AT_RISK],
+            estimated_delivery_date__lt=today,
+        ),
+        Status.BREACHED, now, batch_size,
+    )
+
+    for priority, hours in SLA_AT_RISK_HOURS.items():
+        # Fine della giornata prevista entro la soglia: data < giorno di now + soglia
+        horizon = timezone.localdate(now + timedelta(hours=hours))
+        changes["at_risk"] += _update_in_batches(
+            open_shipments().filter(
+                sla_status__in=[Status.ON_TIME, Status.BREACHED],
+                priority=priority,
+                estimated_delivery_date__gte=today,
+                estimated_delivery_date__lt=horizon,
+            ),
+            Status.AT_RISK, now, batch_size,
+        )
+        # Data prevista spostata in avanti (o rimossa): di nuovo nei tempi
+        changes["on_time"] += _update_in_batches(
+            open_shipments().filter(
+                sla_status__in=[Status.AT_RISK, Status.BREACHED],
+                priority=priority,
+            ).exclude(estimated_delivery_date__lt=horizon),
+            Status.ON_TIME, now, batch_size,
+        )
+
+    return changes
@@ -1,5 +1,8 @@
+from collections import Counter, defaultdict
 from typing import Optional
 
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
 from django.utils import timezone
 
 VALID_TRANSITIONS = {
@@ -14,6 +17,14 @@ VALID_TRANSITIONS = {
     "cancelled": [],
 }
 
+# Campi data valorizzati all'ingresso in uno stato
+STATUS_TIMESTAMP_FIELDS = {
+    "delivered": "actual_delivery_date",
+    "picked_up": "picked_up_at",
+}
+
+BULK_TRANSITION_MAX_ITEMS = 5000
+
 
 class InvalidTransitionError(Exception):
     pass
@@ -34,41 +45,247 @@ def transition_shipment(
     longitude=None,
     metadata: Optional[dict] = None,
 ):
-    from apps.shipments.models import ShipmentEvent
+    from apps.notifications.models import OutboxMessage
+    from apps.reports.stats import record_status_changes
+    from apps.shipments.models import Shipment, ShipmentEvent
+    from apps.tracking.cache import invalidate_tracking
 
     if not validate_transition(shipment.status, new_status):
         raise InvalidTransitionError(
             f"Transizione non valida: {shipment.status} -> {new_status}"
         )
 
+    now = timezone.now()
     old_status = shipment.status
     shipment.status = new_status
+    shipment.updated_at = now
 
     update_fields = ["status", "updated_at"]
 
-    if new_status == "delivered":
-        shipment.actual_delivery_date = timezone.now()
-        update_fields.append("actual_delivery_date")
-    elif new_status == "picked_up":
-        shipment.picked_up_at = timezone.now()
-        update_fields.append("picked_up_at")
+    timestamp_field = STATUS_TIMESTAMP_FIELDS.get(new_status)
+    if timestamp_field:
+        setattr(shipment, timestamp_field, now)
+        update_fields.append(timestamp_field)
+
+    with transaction.atomic():
+        event = ShipmentEvent.objects.create(
+            shipment=shipment,
+            status=new_status,
+            description=description or f"Stato cambiato: {old_status} → {new_status}",
+            location=location,
+            latitude=latitude,
+            longitude=longitude,
+            recorded_by=user,
+            metadata=metadata or {},
+        )
+
+        update_fields += shipment.apply_event_snapshot(event)
+        Shipment.objects.filter(pk=shipment.pk).update(
+            events_count=F("events_count") + 1,
+            **{field: getattr(shipment, field) for field in update_fields},
+        )
+        shipment.events_count += 1
+        record_status_changes([(shipment, old_status, new_status)], when=now)
+
+        # Notifica asincrona tramite outbox (vedi dispatch_outbox)
+        OutboxMessage.status_changed(shipment.id, new_status).save()
+        invalidate_tracking(shipment.public_tracking_token)
+
+    return event
 
-    shipment.save(update_fields=update_fields)
+
+def record_creation_event(shipment, user=None):
+    """Evento iniziale di una spedizione appena creata."""
+    from apps.reports.stats import record_status_changes
+    from apps.shipments.models import Shipment, ShipmentEvent
 
     event = ShipmentEvent.objects.create(
         shipment=shipment,
-        status=new_status,
-        description=description or f"Stato cambiato: {old_status} → {new_status}",
-        location=location,
-        latitude=latitude,
-        longitude=longitude,
+        status="created",
+        description="Spedizione creata",
         recorded_by=user,
-        metadata=metadata or {},
     )
+    update_fields = shipment.apply_event_snapshot(event)
+    Shipment.objects.filter(pk=shipment.pk).update(
+        events_count=F("events_count") + 1,
+        **{field: getattr(shipment, field) for field in update_fields},
+    )
+    shipment.events_count += 1
+    record_status_changes([(shipment, "", "created")], when=event.created_at)
+    return event
 
-    # Trigger notifica asincrona
-    from apps.notifications.tasks import send_status_notification
 
-    send_status_notification.delay(shipment.id, new_status)
+def apply_transitions_bulk(transitions, user=None):
+    """
+    Applica in blocco transizioni su spedizioni già caricate (e bloccate).
 
-    return event
+    `transitions` è una lista di tuple (shipment, new_status, dati evento) dove
+    i dati evento sono description/location/latitude/longitude/metadata.
+    Le transizioni sono validate in memoria nell'ordine dato, quindi più
+    transizioni sulla stessa spedizione vengono concatenate.
+
+    Ritorna una lista allineata all'input con lo ShipmentEvent creato oppure
+    un InvalidTransitionError. Va chiamata dentro una transaction.atomic():
+    eventi e messaggi outbox sono scritti nella stessa transazione, la cache
+    del tracking è invalidata alla conferma.
+    """
+    from apps.notifications.models import OutboxMessage
+    from apps.reports.stats import record_status_changes
+    from apps.shipments.models import Shipment, ShipmentEvent
+    from apps.tracking.cache import invalidate_tracking
+
+    now = timezone.now()
+    outcomes = []
+    events = []
+    touched = {}
+    notifications = []
+    status_changes = []
+
+    for shipment, new_status, data in transitions:
+        if not validate_transition(shipment.status, new_status):
+            outcomes.append(InvalidTransitionError(
+                f"Transizione non valida: {shipment.status} -> {new_status}"
+            ))
+            continue
+
+        old_status = shipment.status
+        shipment.status = new_status
+        timestamp_field = STATUS_TIMESTAMP_FIELDS.get(new_status)
+        if timestamp_field:
+            setattr(shipment, timestamp_field, now)
+        touched[shipment.pk] = shipment
+
+        event = ShipmentEvent(
+            shipment=shipment,
+            status=new_status,
+            description=(
+                data.get("description")
+                or f"Stato cambiato: {old_status} → {new_status}"
+            ),
+            location=data.get("location", ""),
+            latitude=data.get("latitude"),
+            longitude=data.get("longitude"),
+            recorded_by=user,
+            metadata=data.get("metadata") or {},
+        )
+        events.append(event)
+        outcomes.append(event)
+        notifications.append((shipment.pk, new_status))
+        status_changes.append((shipment, old_status, new_status))
+
+    ShipmentEvent.objects.bulk_create(events, batch_size=1000)
+
+    # Le spedizioni sono bloccate dal chiamante: stato e riepilogo dell'ultimo
+    # evento si calcolano in memoria e le righe che ricevono gli stessi valori
+    # si aggiornano con un solo UPDATE. Scansioni di hub e assegnazioni in
+    # blocco producono pochi gruppi; l'UPDATE ... CASE di bulk_update costa
+    # invece secondi di compilazione lato Django oltre qualche migliaio di righe.
+    increments = Counter()
+    stamped = defaultdict(set)
+    for event in events:
+        shipment = event.shipment
+        shipment.apply_event_snapshot(event)
+        shipment.events_count += 1
+        shipment.updated_at = now
+        increments[shipment.pk] += 1
+        timestamp_field = STATUS_TIMESTAMP_FIELDS.get(event.status)
+        if timestamp_field:
+            stamped[shipment.pk].add(timestamp_field)
+
+    groups = defaultdict(list)
+    for shipment in touched.values():
+        key = (
+            shipment.status,
+            shipment.last_event_status,
+            shipment.last_event_description,
+            shipment.last_event_location,
+            frozenset(stamped[shipment.pk]),
+            increments[shipment.pk],
+        )
+        groups[key].append(shipment.pk)
+
+    # last_event_at è il created_at dell'evento, diverso per ogni riga: lo
+    # legge il database dall'indice (shipment, -created_at)
+    last_event_at = Subquery(
+        ShipmentEvent.objects.filter(shipment=OuterRef("pk"))
+        .order_by("-created_at").values("created_at")[:1]
+    )
+    for (new_status, event_status, description, location, timestamps, increment), ids in (
+        groups.items()
+    ):
+        for start in range(0, len(ids), 1000):
+            Shipment.objects.filter(pk__in=ids[start:start + 1000]).update(
+                status=new_status,
+                last_event_status=event_status,
+                last_event_description=description,
+                last_event_location=location,
+                last_event_at=last_event_at,
+                events_count=F("events_count") + increment,
+                updated_at=now,
+                **dict.fromkeys(timestamps, now),
+            )
+    OutboxMessage.objects.bulk_create(
+        [
+            OutboxMessage.status_changed(shipment_id, new_status)
+            for shipment_id, new_status in notifications
+        ],
+        batch_size=1000,
+    )
+    record_status_changes(status_changes, when=now)
+    invalidate_tracking(*(shipment.public_tracking_token for shipment in touched.values()))
+
+    return outcomes
+
+
+def transition_shipments_bulk(items, user=None):
+    """
+    Transizione di stato in blocco per UUID spedizione (es. scansioni di hub).
+
+    `items` è una lista di dict con uuid, new_status e i campi opzionali
+    dell'evento. Ritorna un risultato per elemento, nello stesso ordine:
+    "ok", "invalid_transition" o "not_found".
+    """
+    from apps.shipments.models import Shipment
+
+    results = []
+    transitions = []
+    positions = []
+
+    with transaction.atomic():
+        shipments = (
+            Shipment.objects.select_for_update()
+            .order_by("pk")
+            .in_bulk({item["uuid"] for item in items}, field_name="uuid")
+        )
+
+        for item in items:
+            shipment = shipments.get(item["uuid"])
+            if shipment is None:
+                results.append({
+                    "uuid": str(item["uuid"]),
+                    "status": "not_found",
+                    "error": "Spedizione non trovata",
+                })
+                continue
+            positions.append(len(results))
+            results.append(None)
+            transitions.append((shipment, item["new_status"], item))
+
+        outcomes = apply_transitions_bulk(transitions, user=user)
+
+    for position, (shipment, new_status, _), outcome in zip(positions, transitions, outcomes):
+        if isinstance(outcome, InvalidTransitionError):
+            results[position] = {
+                "uuid": str(shipment.uuid),
+                "status": "invalid_transition",
+                "error": str(outcome),
+            }
+        else:
+            results[position] = {
+                "uuid": str(shipment.uuid),
+                "status": "ok",
+                "new_status": new_status,
+                "event_uuid": str(outcome.uuid),
+            }
+
+    return results
@@ -0,0 +1,133 @@
+import logging
+
+from celery import shared_task
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def prerender_waybill(shipment_id: int):
+    """Genera in anticipo il PDF del foglio di vettura nella cache su storage."""
+    from apps.shipments.models import Shipment
+
+    from .waybill import get_waybill_pdf
+
+    try:
+        shipment = Shipment.objects.select_related(
+            "sender", "sender_address", "delivery_address",
+        ).get(id=shipment_id)
+    except Shipment.DoesNotExist:
+        logger.error(f"Shipment {shipment_id} non trovata")
+        return
+
+    get_waybill_pdf(shipment)
+
+
+def schedule_waybill_prerender(shipment):
+    """Accoda la pre-generazione del foglio di vettura a transazione confermata."""
+    transaction.on_commit(lambda: prerender_waybill.delay(shipment.id))
+
+
+@shared_task
+def render_waybill_batch(batch_id: int):
+    """Genera il PDF unico di una stampa multipla di fogli di vettura."""
+    from apps.shipments.models import WaybillBatch
+
+    from .waybill import print_waybills
+
+    batch = WaybillBatch.objects.get(id=batch_id)
+    batch.status = WaybillBatch.Status.RUNNING
+    batch.save(update_fields=["status", "updated_at"])
+
+    try:
+        pdf_bytes = print_waybills(batch.shipment_ids)
+    except Exception as e:
+        logger.exception(f"Errore stampa multipla {batch.uuid}")
+        batch.status = WaybillBatch.Status.FAILED
+        batch.error_message = str(e)
+    else:
+        batch.file.save(f"fogli_vettura_{batch.uuid}.pdf", ContentFile(pdf_bytes), save=False)
+        batch.status = WaybillBatch.Status.DONE
+    batch.finished_at = timezone.now()
+    batch.save()
+
+
+def start_waybill_batch(shipment_ids, user=None):
+    """Crea una stampa multipla e ne accoda la generazione."""
+    from apps.shipments.models import WaybillBatch
+
+    batch = WaybillBatch.objects.create(
+        shipment_ids=list(shipment_ids),
+        shipments_count=len(shipment_ids),
+        created_by=user,
+    )
+    transaction.on_commit(lambda: render_waybill_batch.delay(batch.id))
+    return batch
+
+
+@shared_task
+def scan_shipments_sla():
+    """Aggiorna i flag SLA delle spedizioni aperte (django-celery-beat)."""
+    from .sla import scan_sla
+
+    changes = scan_sla()
+    logger.info(f"Scansione SLA: {changes}")
+    return changes
+
+
+@shared_task
+def sequence_driver_route_task(driver_id: int):
+    """Ricalcola la sequenza di consegna delle fermate aperte di un corriere."""
+    from .routing import sequence_driver_route
+
+    return sequence_driver_route(driver_id)
+
+
+def schedule_route_sequencing(driver_ids):
+    """Accoda il ricalcolo dei giri dei corrieri indicati a transazione confermata."""
+    from celery import group
+
+    driver_ids = sorted(set(filter(None, driver_ids)))
+    if driver_ids:
+        transaction.on_commit(
+            lambda: group(sequence_driver_route_task.s(pk) for pk in driver_ids).apply_async()
+        )
+
+
+@shared_task
+def resequence_routes(zone: str = ""):
+    """
+    Ricalcola in parallelo i giri di tutti i corrieri attivi con fermate aperte.
+
+    Un task per corriere in un group Celery; con `zone` solo i corrieri di
+    quella zona operativa.
+    """
+    from celery import group
+
+    from apps.drivers.models import Driver
+
+    from .routing import ROUTE_STATUSES
+
+    drivers = Driver.objects.filter(
+        is_active=True, shipments__status__in=ROUTE_STATUSES,
+    )
+    if zone:
+        drivers = drivers.filter(zone__iexact=zone)
+    driver_ids = list(drivers.values_list("id", flat=True).distinct())
+
+    group(sequence_driver_route_task.s(pk) for pk in driver_ids).apply_async()
+    logger.info(f"Ricalcolo giri avviato per {len(driver_ids)} corrieri")
+    return len(driver_ids)
+
+
+@shared_task
+def purge_manifest_tombstones():
+    """Elimina i tombstone del manifest che nessun cursore valido può più chiedere."""
+    from .manifest import purge_tombstones
+
+    deleted = purge_tombstones()
+    logger.info(f"Tombstone manifest eliminati: {deleted}")
+    return deleted
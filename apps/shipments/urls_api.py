@@ -5,6 +5,7 @@ from . import views
 
 router = DefaultRouter()
 router.register("shipments", views.ShipmentViewSet, basename="shipment")
+router.register("waybill-batches", views.WaybillBatchViewSet, basename="waybill-batch")
 
 driver_router = DefaultRouter()
 driver_router.register("driver/shipments", views.DriverShipmentViewSet, basename="driver-shipment")
@@ -1,22 +1,42 @@
+from django.db import transaction
+from django.db.models import Prefetch
+from django.http import FileResponse, Http404
 from django.http import HttpResponse as DjangoHttpResponse
 from django_filters import rest_framework as filters
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.filters import OrderingFilter
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
 from rest_framework.response import Response
 
 from apps.accounts.permissions import IsDriver, IsOperatorOrAdmin
+from apps.common.pagination import KeysetPagination
 from apps.drivers.models import Driver, ExternalCarrier
+from apps.tracking.cache import invalidate_tracking
 
-from .models import Shipment, ShipmentEvent
+from .manifest import record_manifest_removals
+from .models import CLOSED_STATUSES, Shipment, ShipmentEvent, WaybillBatch
+from .renderers import ZPLRenderer
+from .search import ShipmentSearchFilter
 from .serializers import (
+    RouteStartSerializer,
     ShipmentAssignSerializer,
+    ShipmentAutoAssignSerializer,
+    ShipmentBulkTransitionSerializer,
     ShipmentCreateSerializer,
     ShipmentDetailSerializer,
     ShipmentEventSerializer,
     ShipmentListSerializer,
     ShipmentTransitionSerializer,
+    ShipmentWaybillBatchSerializer,
+    WaybillBatchSerializer,
 )
-from .state_machine import InvalidTransitionError, transition_shipment
+from .state_machine import (
+    InvalidTransitionError,
+    transition_shipment,
+    transition_shipments_bulk,
+)
+from .tasks import schedule_route_sequencing, schedule_waybill_prerender, start_waybill_batch
 
 
 class ShipmentFilter(filters.FilterSet):
@@ -28,27 +48,61 @@ class ShipmentFilter(filters.FilterSet):
     date_from = filters.DateFilter(field_name="created_at", lookup_expr="date__gte")
     date_to = filters.DateFilter(field_name="created_at", lookup_expr="date__lte")
     estimated_date = filters.DateFilter(field_name="estimated_delivery_date")
+    sla = filters.ChoiceFilter(
+        choices=[
+            (Shipment.SlaStatus.AT_RISK, Shipment.SlaStatus.AT_RISK.label),
+            (Shipment.SlaStatus.BREACHED, Shipment.SlaStatus.BREACHED.label),
+        ],
+        method="filter_sla",
+    )
 
     class Meta:
         model = Shipment
         fields = ["status", "delivery_type", "priority", "sender", "driver"]
 
+    def filter_sla(self, queryset, name, value):
+        # Solo spedizioni aperte: la query usa l'indice parziale shipment_open_sla
+        return queryset.exclude(status__in=CLOSED_STATUSES).filter(sla_status=value)
+
 
 class ShipmentViewSet(viewsets.ModelViewSet):
     permission_classes = [IsOperatorOrAdmin]
     lookup_field = "uuid"
+    filter_backends = [filters.DjangoFilterBackend, ShipmentSearchFilter, OrderingFilter]
     filterset_class = ShipmentFilter
-    search_fields = ["tracking_code", "reference", "recipient_name", "sender__company_name"]
     ordering_fields = ["created_at", "estimated_delivery_date", "status", "priority"]
 
+    # Azioni che serializzano la storia completa degli eventi
+    event_history_actions = ("retrieve", "update", "partial_update", "assign")
+
     def get_queryset(self):
-        return (
-            Shipment.objects.select_related(
-                "sender", "driver", "driver__user", "external_carrier", "created_by",
+        if self.action == "list":
+            # ShipmentListSerializer usa solo il riepilogo dell'ultimo evento
+            return Shipment.objects.select_related(
+                "sender", "driver__user", "external_carrier",
             )
-            .prefetch_related("events")
-            .all()
+
+        qs = Shipment.objects.select_related(
+            "sender", "driver", "driver__user", "external_carrier", "created_by",
         )
+        if self.action == "waybill":
+            qs = qs.select_related("sender_address", "delivery_address")
+        if self.action in self.event_history_actions:
+            qs = qs.prefetch_related(
+                Prefetch("events", queryset=ShipmentEvent.objects.select_related("recorded_by")),
+            )
+        return qs
+
+    @property
+    def paginator(self):
+        # Paginazione a cursore su richiesta (?pagination=cursor / ?cursor=)
+        if (
+            not hasattr(self, "_paginator")
+            and self.request is not None
+            and KeysetPagination.is_requested(self.request)
+        ):
+            self._paginator = KeysetPagination()
+        return super().paginator
 
     def get_serializer_class(self):
         if self.action == "list":
@@ -78,6 +132,31 @@ class ShipmentViewSet(viewsets.ModelViewSet):
 
         return Response(ShipmentEventSerializer(event).data, status=status.HTTP_200_OK)
 
+    def perform_update(self, serializer):
+        shipment = serializer.save()
+        invalidate_tracking(shipment.public_tracking_token)
+        schedule_waybill_prerender(shipment)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            record_manifest_removals([(instance.driver_id, instance.uuid)])
+            instance.delete()
+
+    @action(detail=False, methods=["post"], url_path="bulk-transition")
+    def bulk_transition(self, request):
+        """Transizioni in blocco (scansioni di smistamento), con esito per elemento."""
+        serializer = ShipmentBulkTransitionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        results = transition_shipments_bulk(
+            serializer.validated_data["items"], user=request.user,
+        )
+        ok = sum(1 for result in results if result["status"] == "ok")
+        return Response(
+            {"ok": ok, "failed": len(results) - ok, "results": results},
+            status=status.HTTP_200_OK,
+        )
+
     @action(detail=True, methods=["post"])
     def assign(self, request, uuid=None):
         shipment = self.get_object()
@@ -87,6 +166,7 @@ class ShipmentViewSet(viewsets.ModelViewSet):
         driver_uuid = serializer.validated_data.get("driver_uuid")
         carrier_uuid = serializer.validated_data.get("external_carrier_uuid")
 
+        previous_driver_id = shipment.driver_id
         if driver_uuid:
             driver = Driver.objects.get(uuid=driver_uuid)
             shipment.driver = driver
@@ -100,6 +180,11 @@ class ShipmentViewSet(viewsets.ModelViewSet):
             shipment.delivery_type = "external"
 
         shipment.save()
+        invalidate_tracking(shipment.public_tracking_token)
+        schedule_waybill_prerender(shipment)
+        schedule_route_sequencing([shipment.driver_id])
+        if previous_driver_id and previous_driver_id != shipment.driver_id:
+            record_manifest_removals([(previous_driver_id, shipment.uuid)])
 
         # Transizione a "assigned"
         if shipment.status == "created":
@@ -117,35 +202,155 @@ class ShipmentViewSet(viewsets.ModelViewSet):
             ShipmentDetailSerializer(shipment).data, status=status.HTTP_200_OK,
         )
 
-    @action(detail=True, methods=["get"])
+    @action(detail=False, methods=["post"], url_path="auto-assign")
+    def auto_assign(self, request):
+        """
+        Assegnazione automatica ai corrieri interni per zona e capacità.
+
+        Con "dry_run" restituisce solo l'anteprima del piano.
+        """
+        from .assignment import auto_assign
+
+        serializer = ShipmentAutoAssignSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        plan = auto_assign(
+            user=request.user,
+            uuids=data.get("uuids"),
+            driver_uuids=data.get("driver_uuids"),
+            delivery_date=data.get("delivery_date"),
+            dry_run=data["dry_run"],
+        )
+        return Response(
+            {"dry_run": data["dry_run"], **plan.as_dict()}, status=status.HTTP_200_OK,
+        )
+
+    @action(
+        detail=True, methods=["get"],
+        renderer_classes=[JSONRenderer, BrowsableAPIRenderer, ZPLRenderer],
+    )
     def waybill(self, request, uuid=None):
-        """Genera e restituisce il PDF del foglio di vettura."""
+        """
+        Restituisce il PDF del foglio di vettura (dalla cache, se aggiornata),
+        oppure l'etichetta termica ZPL con ?format=zpl.
+        """
         from django.utils import timezone
+        from django.utils.cache import get_conditional_response
 
-        from .waybill import generate_waybill_pdf
+        from .waybill import generate_waybill_zpl, get_waybill_pdf, waybill_content_version
 
+        # Base URL canonica (SITE_URL) per QR e link: lo stesso PDF pre-generato
+        # dal task vale per tutte le richieste.
         shipment = self.get_object()
-        base_url = request.build_absolute_uri("/").rstrip("/")
-        pdf_bytes = generate_waybill_pdf(shipment, base_url=base_url)
+        is_zpl = request.accepted_renderer.format == ZPLRenderer.format
+        version = waybill_content_version(shipment)
+        etag = f'"{version}-zpl"' if is_zpl else f'"{version}"'
 
         # Segna la stampa
         shipment.waybill_printed_at = timezone.now()
         shipment.save(update_fields=["waybill_printed_at"])
 
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+
+        if is_zpl:
+            response = Response(generate_waybill_zpl(shipment))
+            response["Content-Disposition"] = (
+                f'inline; filename="etichetta_{shipment.tracking_code}.zpl"'
+            )
+            response["ETag"] = etag
+            return response
+
+        pdf_bytes = get_waybill_pdf(shipment, version=version)
+
         response = DjangoHttpResponse(pdf_bytes, content_type="application/pdf")
         response["Content-Disposition"] = (
             f'inline; filename="foglio_vettura_{shipment.tracking_code}.pdf"'
         )
+        response["ETag"] = etag
+        return response
+
+    @action(detail=False, methods=["post"], url_path="waybills")
+    def waybills(self, request):
+        """
+        Fogli di vettura di più spedizioni in un unico PDF (un solo rendering).
+
+        Con "uuids" stampa le spedizioni indicate, nell'ordine dato; altrimenti
+        quelle selezionate dai filtri in query string (ShipmentFilter e ricerca).
+        Oltre WaybillBatch.SYNC_LIMIT fogli la stampa diventa un job asincrono:
+        risposta 202 con lo stato del job e, a job concluso, il link di download.
+        """
+        serializer = ShipmentWaybillBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        uuids = serializer.validated_data.get("uuids")
+        if uuids:
+            ids_by_uuid = dict(
+                Shipment.objects.filter(uuid__in=uuids).values_list("uuid", "id"),
+            )
+            shipment_ids = [ids_by_uuid[u] for u in dict.fromkeys(uuids) if u in ids_by_uuid]
+        else:
+            queryset = self.filter_queryset(Shipment.objects.all())
+            shipment_ids = list(
+                queryset.values_list("id", flat=True)[:WaybillBatch.MAX_SHIPMENTS + 1],
+            )
+            if len(shipment_ids) > WaybillBatch.MAX_SHIPMENTS:
+                return Response(
+                    {"detail": f"Massimo {WaybillBatch.MAX_SHIPMENTS} spedizioni per stampa"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+        if not shipment_ids:
+            return Response(
+                {"detail": "Nessuna spedizione da stampare"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        if len(shipment_ids) > WaybillBatch.SYNC_LIMIT:
+            batch = start_waybill_batch(shipment_ids, user=request.user)
+            return Response(
+                WaybillBatchSerializer(batch, context={"request": request}).data,
+                status=status.HTTP_202_ACCEPTED,
+            )
+
+        from .waybill import print_waybills
+
+        response = DjangoHttpResponse(
+            print_waybills(shipment_ids), content_type="application/pdf",
+        )
+        response["Content-Disposition"] = 'inline; filename="fogli_vettura.pdf"'
         return response
 
     @action(detail=True, methods=["get"])
     def events(self, request, uuid=None):
         shipment = self.get_object()
-        events = shipment.events.all()
+        events = shipment.events.select_related("recorded_by")
         serializer = ShipmentEventSerializer(events, many=True)
         return Response(serializer.data)
 
 
+class WaybillBatchViewSet(viewsets.ReadOnlyModelViewSet):
+    """Stato e download delle stampe multiple di fogli di vettura."""
+
+    permission_classes = [IsOperatorOrAdmin]
+    serializer_class = WaybillBatchSerializer
+    lookup_field = "uuid"
+    queryset = WaybillBatch.objects.all()
+
+    @action(detail=True, methods=["get"])
+    def download(self, request, uuid=None):
+        batch = self.get_object()
+        if batch.status != WaybillBatch.Status.DONE or not batch.file:
+            raise Http404("Stampa non ancora disponibile")
+        return FileResponse(
+            batch.file.open("rb"),
+            content_type="application/pdf",
+            filename=f"fogli_vettura_{batch.uuid}.pdf",
+        )
+
+
 class DriverShipmentViewSet(viewsets.ReadOnlyModelViewSet):
     """Spedizioni assegnate al corriere loggato."""
 
@@ -160,17 +365,64 @@ class DriverShipmentViewSet(viewsets.ReadOnlyModelViewSet):
             .exclude(status__in=["cancelled", "returned"])
         )
 
+    def today_queryset(self):
+        from .manifest import driver_manifest
+
+        return driver_manifest(self.request.user.driver_profile.id)
+
     @action(detail=False, methods=["get"])
     def today(self, request):
-        from django.utils import timezone
+        serializer = self.get_serializer(self.today_queryset(), many=True)
+        return Response(serializer.data)
 
-        today = timezone.localdate()
-        qs = self.get_queryset().filter(
-            estimated_delivery_date=today,
-        ) | self.get_queryset().filter(
-            status__in=["assigned", "picked_up", "in_transit", "out_for_delivery"],
-        )
-        serializer = self.get_serializer(qs.distinct(), many=True)
+    @action(detail=False, methods=["get"])
+    def manifest(self, request):
+        """
+        Manifest del giorno in delta: con ?since=<cursor> solo le spedizioni
+        modificate e gli UUID rimossi da allora. ETag debole sulla versione
+        dei dati del corriere: 304 se il client è già aggiornato.
+        """
+        from django.utils.cache import get_conditional_response
+
+        from .manifest import manifest_cursor, manifest_delta, parse_cursor
+
+        driver_id = request.user.driver_profile.id
+        cursor = manifest_cursor(driver_id)
+        etag = f'W/"{cursor}"'
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+
+        since = parse_cursor(request.query_params.get("since"))
+        shipments, removed = manifest_delta(driver_id, since)
+        response = Response({
+            "cursor": cursor,
+            "full": since is None,
+            "shipments": self.get_serializer(shipments, many=True).data,
+            "removed": removed,
+        })
+        response["ETag"] = etag
+        response["Cache-Control"] = "private, no-cache"
+        return response
+
+    @action(detail=False, methods=["post"])
+    def route(self, request):
+        """
+        Ricalcola subito il giro del corriere e restituisce le fermate di oggi.
+
+        Con latitude/longitude il giro parte dalla posizione attuale del
+        corriere invece che dal deposito.
+        """
+        from .routing import sequence_driver_route
+
+        serializer = RouteStartSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        latitude = serializer.validated_data.get("latitude")
+        longitude = serializer.validated_data.get("longitude")
+        start = (float(latitude), float(longitude)) if latitude is not None and longitude is not None else None
+
+        sequence_driver_route(request.user.driver_profile.id, start=start)
+        serializer = self.get_serializer(self.today_queryset(), many=True)
         return Response(serializer.data)
 
     @action(detail=True, methods=["post"], url_path="pickup")
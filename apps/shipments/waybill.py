@@ -1,8 +1,12 @@
-"""Generazione foglio di vettura PDF con QR code."""
+"""Generazione foglio di vettura PDF con QR code ed etichetta termica ZPL."""
+import hashlib
 import io
+import json
 
 import qrcode
 from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.template.loader import render_to_string
 from django.utils import timezone
 from weasyprint import HTML
@@ -29,25 +33,184 @@ def generate_qr_code_data_uri(url: str) -> str:
     return f"data:image/png;base64,{encoded}"
 
 
-def generate_waybill_pdf(shipment, base_url: str = "") -> bytes:
-    """Genera il PDF del foglio di vettura per una spedizione."""
+def waybill_page_context(shipment, base_url: str = "") -> dict:
+    """Dati di una pagina del foglio di vettura."""
     if not base_url:
         base_url = getattr(settings, "SITE_URL", "http://localhost:8000")
 
     qr_url = f"{base_url}/qr/{shipment.uuid}/"
-    qr_data_uri = generate_qr_code_data_uri(qr_url)
-
-    context = {
+    return {
         "shipment": shipment,
-        "qr_data_uri": qr_data_uri,
+        "qr_data_uri": generate_qr_code_data_uri(qr_url),
         "qr_url": qr_url,
         "tracking_url": f"{base_url}/t/{shipment.public_tracking_token}/",
-        "generated_at": timezone.now(),
         "sender_address": shipment.sender_address,
         "delivery_address_display": shipment.get_effective_delivery_address(),
     }
 
+
+def generate_waybill_pdf(shipment, base_url: str = "") -> bytes:
+    """Genera il PDF del foglio di vettura per una spedizione."""
+    return generate_waybills_pdf([shipment], base_url=base_url)
+
+
+def generate_waybills_pdf(shipments, base_url: str = "") -> bytes:
+    """Genera un unico PDF con un foglio di vettura per pagina (un solo layout WeasyPrint)."""
+    context = {
+        "pages": [waybill_page_context(shipment, base_url) for shipment in shipments],
+        "generated_at": timezone.now(),
+    }
+
     html_string = render_to_string("pod/waybill.html", context)
     pdf_buffer = io.BytesIO()
     HTML(string=html_string).write_pdf(pdf_buffer)
     return pdf_buffer.getvalue()
+
+
+# Etichetta 4x6" a 203 dpi (stampanti termiche Zebra)
+ZPL_LABEL_WIDTH = 812
+ZPL_LABEL_HEIGHT = 1218
+
+
+def _zpl_text(value) -> str:
+    """Testo per ^FD con ^FH_: escape esadecimale dei caratteri di controllo ZPL."""
+    return (
+        str(value)
+        .replace("_", "_5F")
+        .replace("^", "_5E")
+        .replace("~", "_7E")
+        .replace("\n", " ")
+    )
+
+
+def _zpl_field(x: int, y: int, text, height: int = 30, width: int = 0, lines: int = 1) -> str:
+    """Campo di testo, su più righe (^FB) se lines > 1."""
+    block = f"^FB{width or ZPL_LABEL_WIDTH - x - 40},{lines},4,L,0" if lines > 1 else ""
+    return f"^FO{x},{y}^A0N,{height},{height}{block}^FH_^FD{_zpl_text(text)}^FS"
+
+
+def generate_waybill_zpl(shipment, base_url: str = "") -> str:
+    """
+    Etichetta termica ZPL del foglio di vettura, con gli stessi dati del PDF.
+
+    Il QR code è un barcode nativo ^BQ: la stampante lo genera da sé, senza
+    immagini né rendering lato server.
+    """
+    if not base_url:
+        base_url = getattr(settings, "SITE_URL", "http://localhost:8000")
+
+    sender = shipment.sender
+    weight = f"{shipment.weight_kg} kg" if shipment.weight_kg else "-"
+    fields = [
+        "^XA",
+        "^CI28",
+        f"^PW{ZPL_LABEL_WIDTH}",
+        f"^LL{ZPL_LABEL_HEIGHT}",
+        _zpl_field(40, 40, "FOGLIO DI VETTURA", height=40),
+        _zpl_field(40, 95, shipment.tracking_code, height=60),
+        "^FO30,160^GB752,3,3^FS",
+        "^FO40,185^A0N,24,24^FDMITTENTE^FS",
+        _zpl_field(40, 215, sender.company_name, height=34),
+        _zpl_field(40, 255, shipment.sender_address or "", height=26, lines=2),
+        "^FO30,320^GB752,3,3^FS",
+        "^FO40,345^A0N,24,24^FDDESTINATARIO^FS",
+        _zpl_field(40, 375, shipment.recipient_name, height=44),
+        _zpl_field(40, 430, shipment.get_effective_delivery_address(), height=32, lines=3),
+        _zpl_field(40, 545, shipment.recipient_phone, height=28),
+        "^FO30,590^GB752,3,3^FS",
+        _zpl_field(40, 615, f"Colli: {shipment.packages_count}", height=44),
+        _zpl_field(420, 615, f"Peso: {weight}", height=44),
+        _zpl_field(40, 675, f"Rif: {shipment.reference or '-'}", height=28),
+        _zpl_field(420, 675, f"Priorita: {shipment.get_priority_display()}", height=28),
+        "^FO30,725^GB752,3,3^FS",
+        # QR del POD: modello 2, correzione M, modalità automatica
+        f"^FO40,750^BQN,2,7^FH_^FDMA,{_zpl_text(f'{base_url}/qr/{shipment.uuid}/')}^FS",
+        _zpl_field(360, 790, "Inquadra per registrare", height=26),
+        _zpl_field(360, 825, "la consegna", height=26),
+        "^FO40,1080^BY3^BCN,80,N,N,N^FD" + _zpl_text(shipment.tracking_code) + "^FS",
+        "^XZ",
+    ]
+    return "\n".join(fields) + "\n"
+
+
+def print_waybills(shipment_ids) -> bytes:
+    """
+    PDF unico dei fogli di vettura delle spedizioni indicate, nell'ordine dato,
+    segnando la stampa di tutte con un solo UPDATE.
+    """
+    from apps.shipments.models import Shipment
+
+    shipments = Shipment.objects.select_related(
+        "sender", "sender_address", "delivery_address",
+    ).in_bulk(shipment_ids)
+    pdf_bytes = generate_waybills_pdf(
+        [shipments[pk] for pk in shipment_ids if pk in shipments],
+    )
+    Shipment.objects.filter(pk__in=shipments.keys()).update(
+        waybill_printed_at=timezone.now(),
+    )
+    return pdf_bytes
+
+
+# Da incrementare a ogni modifica di pod/waybill.html, per invalidare la cache
+WAYBILL_LAYOUT_VERSION = 2
+WAYBILL_CACHE_DIR = "waybills"
+
+
+def waybill_content_version(shipment, base_url: str = "") -> str:
+    """Hash dei dati stampati sul foglio di vettura: cambia solo se cambia il PDF."""
+    if not base_url:
+        base_url = getattr(settings, "SITE_URL", "http://localhost:8000")
+
+    content = [
+        WAYBILL_LAYOUT_VERSION,
+        base_url,
+        str(shipment.uuid),
+        shipment.public_tracking_token,
+        shipment.tracking_code,
+        shipment.sender.company_name,
+        shipment.sender.contact_name,
+        str(shipment.sender_address or ""),
+        shipment.recipient_name,
+        shipment.recipient_phone,
+        shipment.get_effective_delivery_address(),
+        shipment.reference,
+        shipment.packages_count,
+        str(shipment.weight_kg or ""),
+        shipment.priority,
+        str(shipment.estimated_delivery_date or ""),
+        shipment.description,
+    ]
+    return hashlib.sha256(json.dumps(content).encode("utf-8")).hexdigest()[:20]
+
+
+def waybill_cache_path(shipment, version: str) -> str:
+    return f"{WAYBILL_CACHE_DIR}/{shipment.uuid}/{version}.pdf"
+
+
+def get_waybill_pdf(shipment, base_url: str = "", version: str = "") -> bytes:
+    """
+    PDF del foglio di vettura dalla cache su storage, generandolo solo se la
+    versione del contenuto non è ancora stata renderizzata.
+    """
+    version = version or waybill_content_version(shipment, base_url)
+    path = waybill_cache_path(shipment, version)
+
+    if default_storage.exists(path):
+        with default_storage.open(path, "rb") as cached:
+            return cached.read()
+
+    pdf_bytes = generate_waybill_pdf(shipment, base_url=base_url)
+    _replace_cached_waybill(shipment, path, pdf_bytes)
+    return pdf_bytes
+
+
+def _replace_cached_waybill(shipment, path: str, pdf_bytes: bytes):
+    directory = f"{WAYBILL_CACHE_DIR}/{shipment.uuid}"
+    try:
+        _, stale = default_storage.listdir(directory)
+    except FileNotFoundError:
+        stale = []
+    for name in stale:
+        default_storage.delete(f"{directory}/{name}")
+    default_storage.save(path, ContentFile(pdf_bytes))
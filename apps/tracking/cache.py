@@ -0,0 +1,93 @@
+"""
+Cache del tracking pubblico per public_tracking_token.
+
+Ogni voce contiene il payload dell'API, la pagina renderizzata e i relativi
+ETag/Last-Modified: le richieste ripetute (anche condizionali, 304) non
+toccano il database. Le voci sono invalidate a transazione confermata da
+transizioni di stato, POD e foto; il timeout è solo una rete di sicurezza.
+"""
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Prefetch
+from django.template.loader import render_to_string
+
+TRACKING_CACHE_TIMEOUT = 10 * 60
+TRACKING_PAGE_TEMPLATE = "tracking/tracking_page.html"
+
+
+def tracking_cache_key(token: str) -> str:
+    return f"tracking:{token}"
+
+
+def _etag(content: str) -> str:
+    return '"%s"' % hashlib.sha256(content.encode("utf-8")).hexdigest()[:32]
+
+
+def build_tracking_snapshot(token: str):
+    """Payload API, pagina HTML, ETag e Last-Modified; None se il token non esiste."""
+    from apps.pod.models import PODPhoto
+    from apps.shipments.models import Shipment
+
+    from .serializers import TrackingAPISerializer
+
+    shipment = (
+        Shipment.objects.select_related("sender", "external_carrier", "pod")
+        .prefetch_related(
+            "events",
+            Prefetch("pod__photos", queryset=PODPhoto.objects.order_by("created_at")),
+        )
+        .filter(public_tracking_token=token)
+        .first()
+    )
+    if shipment is None:
+        return None
+
+    events = list(shipment.events.all())
+    try:
+        pod = shipment.pod
+    except Exception:
+        pod = None
+    pod_photos = list(pod.photos.all()) if pod else []
+
+    payload = TrackingAPISerializer(shipment).data
+    html = render_to_string(TRACKING_PAGE_TEMPLATE, {
+        "shipment": shipment,
+        "events": events,
+        "pod": pod,
+        "pod_photos": pod_photos,
+    })
+
+    last_modified = max(
+        [shipment.updated_at]
+        + [event.created_at for event in events]
+        + ([pod.updated_at] if pod else [])
+        + [photo.created_at for photo in pod_photos]
+    )
+    return {
+        "payload": payload,
+        "etag": _etag(json.dumps(payload, sort_keys=True, default=str)),
+        "html": html,
+        "page_etag": _etag(html),
+        "last_modified": int(last_modified.timestamp()),
+    }
+
+
+def get_tracking_snapshot(token: str):
+    """Snapshot dalla cache, costruito e salvato se assente."""
+    key = tracking_cache_key(token)
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = build_tracking_snapshot(token)
+        if snapshot is not None:
+            cache.set(key, snapshot, TRACKING_CACHE_TIMEOUT)
+    return snapshot
+
+
+def invalidate_tracking(*tokens):
+    """Elimina gli snapshot dei token indicati quando la transazione è confermata."""
+    keys = [tracking_cache_key(token) for token in tokens if token]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,51 @@
+from rest_framework import serializers
+
+
+class TrackingAPISerializer(serializers.Serializer):
+    tracking_code = serializers.CharField()
+    status = serializers.CharField()
+    status_display = serializers.SerializerMethodField()
+    recipient_name = serializers.CharField()
+    sender_name = serializers.SerializerMethodField()
+    delivery_address = serializers.SerializerMethodField()
+    estimated_delivery_date = serializers.DateField()
+    actual_delivery_date = serializers.DateTimeField()
+    external_tracking_url = serializers.SerializerMethodField()
+    events = serializers.SerializerMethodField()
+    pod = serializers.SerializerMethodField()
+
+    def get_status_display(self, obj):
+        return obj.get_status_display()
+
+    def get_sender_name(self, obj):
+        return obj.sender.company_name
+
+    def get_delivery_address(self, obj):
+        return obj.get_effective_delivery_address()
+
+    def get_external_tracking_url(self, obj):
+        return obj.get_external_tracking_url()
+
+    def get_events(self, obj):
+        return [
+            {
+                "status": e.get_status_display(),
+                "description": e.description,
+                "location": e.location,
+                "timestamp": e.created_at.isoformat(),
+            }
+            for e in obj.events.all()
+        ]
+
+    def get_pod(self, obj):
+        try:
+            pod = obj.pod
+        except Exception:
+            return None
+        return {
+            "delivery_result": pod.get_delivery_result_display(),
+            "recipient_signer_name": pod.recipient_signer_name,
+            "recorded_at": pod.recorded_at.isoformat(),
+            "has_signature": pod.has_signature,
+            "photos_count": pod.photos.count(),
+        }
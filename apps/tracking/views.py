@@ -1,96 +1,47 @@
-from django.shortcuts import get_object_or_404
-from django.views.generic import TemplateView
-from rest_framework import permissions, serializers
+from django.http import Http404, HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.views import View
+from rest_framework import permissions
 from rest_framework.generics import RetrieveAPIView
+from rest_framework.response import Response
 
-from apps.shipments.models import Shipment
+from .cache import get_tracking_snapshot
+from .serializers import TrackingAPISerializer
 
 
-class TrackingPageView(TemplateView):
-    template_name = "tracking/tracking_page.html"
+def _set_validators(response, etag, last_modified):
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    # I client rivalidano sempre: la risposta 304 arriva dalla cache
+    patch_cache_control(response, no_cache=True)
+    return response
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        token = kwargs["token"]
-        shipment = get_object_or_404(
-            Shipment.objects.select_related(
-                "sender", "external_carrier",
-            ).prefetch_related("events"),
-            public_tracking_token=token,
-        )
-        context["shipment"] = shipment
-        context["events"] = shipment.events.all()
 
-        # POD data se consegnata
-        pod = None
-        if hasattr(shipment, "pod"):
-            try:
-                pod = shipment.pod
-            except Exception:
-                pass
-        context["pod"] = pod
-        context["pod_photos"] = pod.photos.all() if pod else []
+class TrackingPageView(View):
+    def get(self, request, token):
+        snapshot = get_tracking_snapshot(token)
+        if snapshot is None:
+            raise Http404("Spedizione non trovata")
 
-        return context
-
-
-class TrackingAPISerializer(serializers.Serializer):
-    tracking_code = serializers.CharField()
-    status = serializers.CharField()
-    status_display = serializers.SerializerMethodField()
-    recipient_name = serializers.CharField()
-    sender_name = serializers.SerializerMethodField()
-    delivery_address = serializers.SerializerMethodField()
-    estimated_delivery_date = serializers.DateField()
-    actual_delivery_date = serializers.DateTimeField()
-    external_tracking_url = serializers.SerializerMethodField()
-    events = serializers.SerializerMethodField()
-    pod = serializers.SerializerMethodField()
-
-    def get_status_display(self, obj):
-        return obj.get_status_display()
-
-    def get_sender_name(self, obj):
-        return obj.sender.company_name
-
-    def get_delivery_address(self, obj):
-        return obj.get_effective_delivery_address()
-
-    def get_external_tracking_url(self, obj):
-        return obj.get_external_tracking_url()
-
-    def get_events(self, obj):
-        return [
-            {
-                "status": e.get_status_display(),
-                "description": e.description,
-                "location": e.location,
-                "timestamp": e.created_at.isoformat(),
-            }
-            for e in obj.events.all()
-        ]
-
-    def get_pod(self, obj):
-        try:
-            pod = obj.pod
-        except Exception:
-            return None
-        return {
-            "delivery_result": pod.get_delivery_result_display(),
-            "recipient_signer_name": pod.recipient_signer_name,
-            "recorded_at": pod.recorded_at.isoformat(),
-            "has_signature": bool(pod.signature_image),
-            "photos_count": pod.photos.count(),
-        }
+        etag, last_modified = snapshot["page_etag"], snapshot["last_modified"]
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified,
+        ) or HttpResponse(snapshot["html"])
+        return _set_validators(response, etag, last_modified)
 
 
 class TrackingAPIView(RetrieveAPIView):
     permission_classes = [permissions.AllowAny]
     serializer_class = TrackingAPISerializer
-    lookup_field = "public_tracking_token"
-    lookup_url_kwarg = "token"
 
-    def get_queryset(self):
-        return Shipment.objects.select_related(
-            "sender", "external_carrier",
-        ).prefetch_related("events")
+    def retrieve(self, request, token=None):
+        snapshot = get_tracking_snapshot(token)
+        if snapshot is None:
+            raise Http404("Spedizione non trovata")
+
+        etag, last_modified = snapshot["etag"], snapshot["last_modified"]
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified,
+        ) or Response(snapshot["payload"])
+        return _set_validators(response, etag, last_modified)
@@ -4,6 +4,7 @@ Base settings for POD project.
 import os
 from pathlib import Path
 
+from celery.schedules import crontab
 from decouple import Csv, config
 
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
@@ -22,6 +23,7 @@ DJANGO_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
 ]
 
 THIRD_PARTY_APPS = [
@@ -173,6 +175,40 @@ CELERY_TASK_SERIALIZER = "json"
 CELERY_RESULT_SERIALIZER = "json"
 CELERY_TIMEZONE = TIME_ZONE
 CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
+CELERY_BEAT_SCHEDULE = {
+    "dispatch-outbox": {
+        "task": "apps.notifications.tasks.dispatch_outbox",
+        "schedule": 5.0,
+    },
+    "purge-outbox": {
+        "task": "apps.notifications.tasks.purge_outbox",
+        "schedule": crontab(hour=3, minute=0),
+    },
+    "scan-shipments-sla": {
+        "task": "apps.shipments.tasks.scan_shipments_sla",
+        "schedule": 15 * 60.0,
+    },
+    "reconcile-daily-stats": {
+        "task": "apps.reports.tasks.reconcile_daily_stats",
+        "schedule": crontab(hour=2, minute=30),
+    },
+    "purge-manifest-tombstones": {
+        "task": "apps.shipments.tasks.purge_manifest_tombstones",
+        "schedule": crontab(hour=3, minute=15),
+    },
+    "resequence-routes": {
+        "task": "apps.shipments.tasks.resequence_routes",
+        "schedule": crontab(hour=6, minute=0),
+    },
+    "process-pending-pod-media": {
+        "task": "apps.pod.tasks.process_pending_media",
+        "schedule": 15 * 60.0,
+    },
+    "purge-chunked-uploads": {
+        "task": "apps.pod.tasks.purge_chunked_uploads",
+        "schedule": crontab(minute=40),
+    },
+}
 
 # Cache
 CACHES = {
@@ -215,6 +251,25 @@ SPECTACULAR_SETTINGS = {
 # Site URL (per generazione QR code e link nelle email)
 SITE_URL = config("SITE_URL", default="http://localhost:8000")
 
+# Deposito di partenza dei giri di consegna ("lat,lng", vuoto = partenza libera)
+ROUTE_DEPOT = config("ROUTE_DEPOT", default="", cast=Csv(float))
+
 # File upload limits
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
+FILE_UPLOAD_HANDLERS = [
+    # SHA-256 calcolato durante lo streaming (deduplica dei media POD)
+    "apps.common.uploadhandlers.SHA256UploadHandler",
+    "django.core.files.uploadhandler.MemoryFileUploadHandler",
+    "django.core.files.uploadhandler.TemporaryFileUploadHandler",
+]
+
+# Immagini POD: la PWA ridimensiona e ricomprime prima dell'invio
+# (limiti esposti da /api/v1/pod/upload-config/)
+POD_PHOTO_MAX_DIMENSION = config("POD_PHOTO_MAX_DIMENSION", default=1600, cast=int)
+POD_PHOTO_QUALITY = config("POD_PHOTO_QUALITY", default=0.75, cast=float)
+POD_SIGNATURE_MAX_DIMENSION = config("POD_SIGNATURE_MAX_DIMENSION", default=800, cast=int)
+POD_UPLOAD_MAX_BYTES = config("POD_UPLOAD_MAX_BYTES", default=2 * 1024 * 1024, cast=int)
+# Upload riprendibili: blocchi assemblati qui (fuori da MEDIA_ROOT, non
+# pubblica) e condivisi tra web e worker
+POD_CHUNKED_UPLOAD_DIR = config("POD_CHUNKED_UPLOAD_DIR", default=str(BASE_DIR / "var" / "uploads"))
@@ -65,6 +65,10 @@ docker compose up -d
 echo "=== Attesa avvio database (10s) ==="
 sleep 10
 
+echo "=== Estensioni PostgreSQL ==="
+# pg_trgm serve agli indici GIN di ricerca (gin_trgm_ops) di spedizioni e clienti
+docker compose exec -T db sh -c 'psql -v ON_ERROR_STOP=1 -U "$POSTGRES_USER" -d "$POSTGRES_DB" -c "CREATE EXTENSION IF NOT EXISTS pg_trgm;"'
+
 echo "=== Migrazione database ==="
 docker compose exec web python manage.py migrate
 
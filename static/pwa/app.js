@@ -8,9 +8,25 @@ let authToken = null;
 let currentShipment = null;
 let signatureCanvas = null;
 let signatureCtx = null;
+// Tratti della firma: punti { x, y, t } con t in ms dall'inizio della firma
+let signatureStrokes = [];
+let signatureStartedAt = 0;
 let isDrawing = false;
 let capturedPhotos = [];
 
+// Limiti delle immagini, aggiornati da /pod/upload-config/
+const DEFAULT_UPLOAD_CONFIG = {
+    photo_max_dimension: 1600,
+    photo_quality: 0.75,
+    signature_max_dimension: 800,
+    max_upload_bytes: 2 * 1024 * 1024,
+    formats: ['image/webp', 'image/jpeg'],
+};
+let uploadConfig = {
+    ...DEFAULT_UPLOAD_CONFIG,
+    ...JSON.parse(localStorage.getItem('pod_upload_config') || '{}'),
+};
+
 // ============================================================
 // Init
 // ============================================================
@@ -18,7 +34,7 @@ let capturedPhotos = [];
 document.addEventListener('DOMContentLoaded', () => {
     // Register service worker
     if ('serviceWorker' in navigator) {
-        navigator.serviceWorker.register('/static/pwa/sw.js')
+        navigator.serviceWorker.register('/pwa/sw.js', { scope: '/pwa/' })
             .then(reg => console.log('SW registered'))
             .catch(err => console.error('SW registration failed:', err));
     }
@@ -28,6 +44,7 @@ document.addEventListener('DOMContentLoaded', () => {
     if (authToken) {
         showScreen('shipments');
         loadShipments();
+        loadUploadConfig();
     } else {
         showScreen('login');
     }
@@ -47,9 +64,7 @@ function updateOnlineStatus() {
         el.textContent = 'Online';
         el.className = 'status online';
         // Try to sync offline records
-        if ('serviceWorker' in navigator && 'sync' in ServiceWorkerRegistration.prototype) {
-            navigator.serviceWorker.ready.then(reg => reg.sync.register('pod-sync'));
-        }
+        requestSync();
     } else {
         el.textContent = 'Offline';
         el.className = 'status offline';
@@ -102,15 +117,29 @@ async function handleLogin(e) {
 
         showScreen('shipments');
         loadShipments();
+        loadUploadConfig();
     } catch (err) {
         showToast('Errore di connessione');
     }
 }
 
+async function loadUploadConfig() {
+    try {
+        const res = await fetch(`${API_BASE}/pod/upload-config/`, { headers: apiHeaders() });
+        if (!res.ok) return;
+        uploadConfig = { ...DEFAULT_UPLOAD_CONFIG, ...(await res.json()) };
+        localStorage.setItem('pod_upload_config', JSON.stringify(uploadConfig));
+    } catch (err) {
+        // Offline: restano gli ultimi limiti noti
+    }
+}
+
 function logout() {
     localStorage.removeItem('pod_token');
     localStorage.removeItem('pod_refresh');
     authToken = null;
+    // Il manifest in cache è del corriere che esce
+    if ('caches' in window) caches.delete('pod-manifest');
     showScreen('login');
 }
 
@@ -127,7 +156,9 @@ function apiHeaders() {
 
 async function loadShipments() {
     try {
-        const res = await fetch(`${API_BASE}/driver/shipments/today/`, {
+        // Il service worker aggiunge il cursore, scarica solo il delta e
+        // risponde con il manifest completo (anche offline, dalla cache)
+        const res = await fetch(`${API_BASE}/driver/shipments/manifest/`, {
             headers: apiHeaders(),
         });
 
@@ -137,12 +168,40 @@ async function loadShipments() {
         }
 
         const data = await res.json();
-        renderShipments(data.results || data);
+        renderShipments(data.shipments);
+        if (data.offline) showToast('Offline: elenco dall\'ultima sincronizzazione');
     } catch (err) {
         showToast('Errore caricamento spedizioni');
     }
 }
 
+async function optimizeRoute() {
+    try {
+        // Il giro parte dalla posizione attuale, se disponibile
+        const gps = await getCurrentPosition();
+        const body = gps.latitude ? {
+            latitude: Number(gps.latitude.toFixed(6)),
+            longitude: Number(gps.longitude.toFixed(6)),
+        } : {};
+
+        const res = await fetch(`${API_BASE}/driver/shipments/route/`, {
+            method: 'POST',
+            headers: apiHeaders(),
+            body: JSON.stringify(body),
+        });
+
+        if (res.status === 401) {
+            logout();
+            return;
+        }
+
+        renderShipments(await res.json());
+        showToast('Giro aggiornato');
+    } catch (err) {
+        showToast('Errore ottimizzazione giro');
+    }
+}
+
 function renderShipments(shipments) {
     const container = document.getElementById('shipments-list');
     if (shipments.length === 0) {
@@ -153,7 +212,7 @@ function renderShipments(shipments) {
     container.innerHTML = shipments.map(s => `
         <div class="shipment-card" onclick="openShipment('${s.uuid}', ${JSON.stringify(s).replace(/'/g, "\\'").replace(/"/g, '&quot;')})">
             <div style="display:flex;justify-content:space-between;align-items:center;">
-                <span class="tracking">${s.tracking_code}</span>
+                <span>${s.route_position ? `<span class="stop">${s.route_position}</span>` : ''}<span class="tracking">${s.tracking_code}</span></span>
                 <span class="badge badge-${s.status}">${s.status}</span>
             </div>
             <div class="recipient">${s.recipient_name}</div>
@@ -220,19 +279,23 @@ function initSignatureCanvas() {
 
 function getPos(e) {
     const rect = signatureCanvas.getBoundingClientRect();
+    const t = Date.now() - signatureStartedAt;
     if (e.touches) {
         return {
             x: e.touches[0].clientX - rect.left,
             y: e.touches[0].clientY - rect.top,
+            t,
         };
     }
-    return { x: e.clientX - rect.left, y: e.clientY - rect.top };
+    return { x: e.clientX - rect.left, y: e.clientY - rect.top, t };
 }
 
 function startDrawing(e) {
     e.preventDefault();
     isDrawing = true;
+    if (!signatureStrokes.length) signatureStartedAt = Date.now();
     const pos = getPos(e);
+    signatureStrokes.push([pos]);
     signatureCtx.beginPath();
     signatureCtx.moveTo(pos.x, pos.y);
 }
@@ -241,6 +304,7 @@ function draw(e) {
     if (!isDrawing) return;
     e.preventDefault();
     const pos = getPos(e);
+    signatureStrokes[signatureStrokes.length - 1].push(pos);
     signatureCtx.lineWidth = 2.5;
     signatureCtx.lineCap = 'round';
     signatureCtx.strokeStyle = '#111';
@@ -253,16 +317,37 @@ function stopDrawing() {
 }
 
 function clearSignature() {
+    signatureStrokes = [];
     if (signatureCtx) {
         signatureCtx.fillStyle = '#fff';
         signatureCtx.fillRect(0, 0, signatureCanvas.width, signatureCanvas.height);
     }
 }
 
-function getSignatureBlob() {
-    return new Promise((resolve) => {
-        signatureCanvas.toBlob(resolve, 'image/png');
+// Firma vettoriale compatta (formato in apps/pod/signature.py): per tratto
+// [x0, y0, t0, dx, dy, dt, ...], primo punto assoluto e poi differenze.
+// Pochi KB, viaggia nel record del POD anche nella coda offline
+function encodeSignature() {
+    if (!signatureStrokes.length) return null;
+    const strokes = signatureStrokes.map((points) => {
+        const encoded = [];
+        let prev = null;
+        for (const point of points) {
+            const x = Math.round(point.x);
+            const y = Math.round(point.y);
+            const t = Math.round(point.t);
+            if (!prev) {
+                encoded.push(x, y, t);
+            } else if (x !== prev.x || y !== prev.y) {
+                encoded.push(x - prev.x, y - prev.y, t - prev.t);
+            } else {
+                continue;
+            }
+            prev = { x, y, t };
+        }
+        return encoded;
     });
+    return { v: 1, w: signatureCanvas.width, h: signatureCanvas.height, strokes };
 }
 
 // ============================================================
@@ -274,47 +359,156 @@ function capturePhoto() {
     input.click();
 }
 
-document.addEventListener('change', (e) => {
-    if (e.target.id === 'photo-input') {
-        const file = e.target.files[0];
-        if (file) {
-            // Resize image before storing
-            resizeImage(file, 1920, 0.8).then(blob => {
-                capturedPhotos.push(blob);
-                renderPhotos();
-            });
-        }
-        e.target.value = '';
+document.addEventListener('change', async (e) => {
+    if (e.target.id !== 'photo-input') return;
+    const file = e.target.files[0];
+    e.target.value = '';
+    if (!file) return;
+
+    try {
+        // Data e posizione di scatto vanno lette prima di ricomprimere:
+        // il canvas scarta tutto l'EXIF
+        const exif = await readExifMetadata(file);
+        const blob = await compressImage(
+            file, uploadConfig.photo_max_dimension, uploadConfig.photo_quality,
+        );
+        capturedPhotos.push({
+            blob,
+            taken_at: exif.taken_at || new Date().toISOString(),
+            latitude: exif.latitude,
+            longitude: exif.longitude,
+        });
+        renderPhotos();
+    } catch (err) {
+        console.error('Photo error:', err);
+        showToast('Impossibile elaborare la foto');
     }
 });
 
-function resizeImage(file, maxWidth, quality) {
-    return new Promise((resolve) => {
-        const reader = new FileReader();
-        reader.onload = (e) => {
-            const img = new Image();
-            img.onload = () => {
-                const canvas = document.createElement('canvas');
-                let w = img.width;
-                let h = img.height;
-                if (w > maxWidth) {
-                    h = (h * maxWidth) / w;
-                    w = maxWidth;
-                }
-                canvas.width = w;
-                canvas.height = h;
-                canvas.getContext('2d').drawImage(img, 0, 0, w, h);
-                canvas.toBlob(resolve, 'image/jpeg', quality);
-            };
-            img.src = e.target.result;
-        };
-        reader.readAsDataURL(file);
-    });
+// Ridimensiona al lato massimo e ricodifica nel primo formato supportato
+// (WebP, poi JPEG), abbassando la qualità finché non rientra nel limite
+async function compressImage(source, maxDimension, quality) {
+    const image = source instanceof Blob ? await decodeImage(source) : source;
+    const scale = Math.min(1, maxDimension / Math.max(image.width, image.height));
+    const canvas = document.createElement('canvas');
+    canvas.width = Math.max(1, Math.round(image.width * scale));
+    canvas.height = Math.max(1, Math.round(image.height * scale));
+    const ctx = canvas.getContext('2d');
+    // Sfondo bianco: le trasparenze in JPEG diventerebbero nere
+    ctx.fillStyle = '#fff';
+    ctx.fillRect(0, 0, canvas.width, canvas.height);
+    ctx.drawImage(image, 0, 0, canvas.width, canvas.height);
+    if (image.close) image.close();
+
+    const types = [...uploadConfig.formats, 'image/jpeg'];
+    let blob = null;
+    for (let q = quality; ; q -= 0.15) {
+        for (const type of types) {
+            blob = await canvasToBlob(canvas, type, Math.max(q, 0.3));
+            // toBlob ricade su PNG se il formato non è supportato
+            if (blob && blob.type === type) break;
+        }
+        if (blob.size <= uploadConfig.max_upload_bytes || q <= 0.3) return blob;
+    }
+}
+
+function canvasToBlob(canvas, type, quality) {
+    return new Promise((resolve) => canvas.toBlob(resolve, type, quality));
+}
+
+async function decodeImage(blob) {
+    if ('createImageBitmap' in window) {
+        try {
+            return await createImageBitmap(blob, { imageOrientation: 'from-image' });
+        } catch (err) {
+            // Formato non gestito da createImageBitmap: si passa da <img>
+        }
+    }
+    const url = URL.createObjectURL(blob);
+    try {
+        const img = new Image();
+        img.src = url;
+        await img.decode();
+        return img;
+    } finally {
+        URL.revokeObjectURL(url);
+    }
+}
+
+// Data di scatto e coordinate GPS dall'EXIF di un JPEG; gli altri tag
+// (modello, seriale, miniature...) non arrivano al server
+async function readExifMetadata(file) {
+    const meta = { taken_at: null, latitude: null, longitude: null };
+    try {
+        const view = new DataView(await file.slice(0, 256 * 1024).arrayBuffer());
+        if (view.getUint16(0) !== 0xFFD8) return meta;
+        let offset = 2;
+        while (offset + 10 <= view.byteLength) {
+            const marker = view.getUint16(offset);
+            if ((marker & 0xFF00) !== 0xFF00 || marker === 0xFFDA) break;
+            if (marker === 0xFFE1 && view.getUint32(offset + 4) === 0x45786966) {  // "Exif"
+                parseExif(view, offset + 10, meta);
+                break;
+            }
+            offset += 2 + view.getUint16(offset + 2);
+        }
+    } catch (err) {
+        // EXIF assente o troncato: restano i valori di default
+    }
+    return meta;
+}
+
+function parseExif(view, tiff, meta) {
+    const little = view.getUint16(tiff) === 0x4949;
+    const u16 = (at) => view.getUint16(at, little);
+    const u32 = (at) => view.getUint32(at, little);
+    const readIfd = (at) => {
+        const tags = {};
+        for (let i = 0, n = u16(at); i < n; i++) {
+            const entry = at + 2 + i * 12;
+            tags[u16(entry)] = { count: u32(entry + 4), value: entry + 8 };
+        }
+        return tags;
+    };
+    const ascii = (tag) => {
+        const at = tag.count > 4 ? tiff + u32(tag.value) : tag.value;
+        let text = '';
+        for (let i = 0; i < tag.count - 1; i++) text += String.fromCharCode(view.getUint8(at + i));
+        return text;
+    };
+    const degrees = (tag) => {
+        const at = tiff + u32(tag.value);
+        const [d, m, s] = [0, 1, 2].map((i) => u32(at + i * 8) / u32(at + i * 8 + 4));
+        return d + m / 60 + s / 3600;
+    };
+
+    const ifd0 = readIfd(tiff + u32(tiff + 4));
+    const exif = ifd0[0x8769] ? readIfd(tiff + u32(ifd0[0x8769].value)) : {};
+    const dateTag = exif[0x9003] || ifd0[0x0132];
+    const date = dateTag && /^(\d{4}):(\d{2}):(\d{2}) (\d{2}):(\d{2}):(\d{2})/.exec(ascii(dateTag));
+    if (date) {
+        // Ora locale del dispositivo, come la registra la fotocamera
+        const [, y, mo, d, h, mi, se] = date.map(Number);
+        const taken = new Date(y, mo - 1, d, h, mi, se);
+        if (!isNaN(taken)) meta.taken_at = taken.toISOString();
+    }
+
+    if (ifd0[0x8825]) {
+        const gps = readIfd(tiff + u32(ifd0[0x8825].value));
+        if (gps[2] && gps[4]) {
+            const lat = degrees(gps[2]) * (gps[1] && ascii(gps[1]) === 'S' ? -1 : 1);
+            const lng = degrees(gps[4]) * (gps[3] && ascii(gps[3]) === 'W' ? -1 : 1);
+            if (isFinite(lat) && isFinite(lng) && Math.abs(lat) <= 90 && Math.abs(lng) <= 180) {
+                meta.latitude = lat.toFixed(6);
+                meta.longitude = lng.toFixed(6);
+            }
+        }
+    }
 }
 
 function renderPhotos() {
     const grid = document.getElementById('photo-grid');
-    grid.innerHTML = capturedPhotos.map((blob, i) => {
+    grid.innerHTML = capturedPhotos.map(({ blob }, i) => {
         const url = URL.createObjectURL(blob);
         return `<img src="${url}" alt="Foto ${i + 1}">`;
     }).join('') + `<div class="photo-add" onclick="capturePhoto()">+</div>`;
@@ -361,16 +555,6 @@ async function submitPOD() {
 
     try {
         const gps = await getCurrentPosition();
-        const signatureBlob = await getSignatureBlob();
-
-        const formData = new FormData();
-        formData.append('delivery_result', document.getElementById('pod-result').value);
-        formData.append('recipient_signer_name', document.getElementById('pod-signer').value);
-        formData.append('notes', document.getElementById('pod-notes').value);
-        formData.append('recorded_at', new Date().toISOString());
-        if (gps.latitude) formData.append('latitude', gps.latitude);
-        if (gps.longitude) formData.append('longitude', gps.longitude);
-        if (signatureBlob) formData.append('signature_image', signatureBlob, 'signature.png');
 
         // Device ID for offline dedup
         let deviceUUID = localStorage.getItem('device_uuid');
@@ -378,63 +562,40 @@ async function submitPOD() {
             deviceUUID = crypto.randomUUID();
             localStorage.setItem('device_uuid', deviceUUID);
         }
-        formData.append('device_uuid', deviceUUID);
-        formData.append('local_record_id', crypto.randomUUID());
-
-        if (navigator.onLine) {
-            // Online: submit directly
-            const res = await fetch(`${API_BASE}/driver/shipments/${currentShipment.uuid}/pod/`, {
-                method: 'POST',
-                headers: { 'Authorization': `Bearer ${authToken}` },
-                body: formData,
-            });
 
-            if (!res.ok) {
-                const err = await res.json();
-                showToast('Errore: ' + (err.error || 'invio fallito'));
-                return;
-            }
+        const record = {
+            shipment_uuid: currentShipment.uuid,
+            delivery_result: document.getElementById('pod-result').value,
+            recipient_signer_name: document.getElementById('pod-signer').value,
+            notes: document.getElementById('pod-notes').value,
+            recorded_at: new Date().toISOString(),
+            latitude: gps.latitude,
+            longitude: gps.longitude,
+            signature_strokes: encodeSignature(),
+            device_uuid: deviceUUID,
+            local_record_id: crypto.randomUUID(),
+        };
 
-            const podRecord = await res.json();
-
-            // Upload photos
-            for (const photo of capturedPhotos) {
-                const photoData = new FormData();
-                photoData.append('image', photo, `photo_${Date.now()}.jpg`);
-                await fetch(`${API_BASE}/pod/${podRecord.uuid}/photos/`, {
-                    method: 'POST',
-                    headers: { 'Authorization': `Bearer ${authToken}` },
-                    body: photoData,
-                });
+        let sent = false;
+        if (navigator.onLine) {
+            try {
+                sent = await sendPOD(record);
+            } catch (err) {
+                // Rete instabile: il POD finisce nella coda offline
+                sent = false;
             }
+            if (sent === null) return;
+        }
 
-            showToast('POD registrato con successo!');
+        if (sent) {
+            showToast(sent.queued
+                ? `POD registrato, ${sent.queued} immagini in coda di invio`
+                : 'POD registrato con successo!');
+            if (sent.queued) requestSync();
         } else {
-            // Offline: save to IndexedDB
-            const db = await openDB();
-            const tx = db.transaction('pending_pods', 'readwrite');
-            tx.objectStore('pending_pods').add({
-                data: {
-                    shipment_uuid: currentShipment.uuid,
-                    delivery_result: document.getElementById('pod-result').value,
-                    recipient_signer_name: document.getElementById('pod-signer').value,
-                    notes: document.getElementById('pod-notes').value,
-                    recorded_at: new Date().toISOString(),
-                    latitude: gps.latitude,
-                    longitude: gps.longitude,
-                    device_uuid: deviceUUID,
-                    local_record_id: crypto.randomUUID(),
-                },
-                timestamp: Date.now(),
-            });
-
+            await queuePODOffline(record, capturedPhotos);
             showToast('POD salvato offline. Verra sincronizzato automaticamente.');
-
-            // Register background sync
-            if ('serviceWorker' in navigator && 'sync' in ServiceWorkerRegistration.prototype) {
-                const reg = await navigator.serviceWorker.ready;
-                await reg.sync.register('pod-sync');
-            }
+            requestSync();
         }
 
         // Back to list
@@ -449,21 +610,275 @@ async function submitPOD() {
     }
 }
 
+// Invio diretto: { queued: immagini non caricate, messe in coda offline } se
+// registrato, null se rifiutato dal server
+async function sendPOD(record) {
+    const formData = new FormData();
+    for (const [key, value] of Object.entries(record)) {
+        if (key !== 'shipment_uuid' && value !== null && value !== undefined) {
+            formData.append(key, typeof value === 'object' ? JSON.stringify(value) : value);
+        }
+    }
+
+    const res = await fetch(`${API_BASE}/driver/shipments/${record.shipment_uuid}/pod/`, {
+        method: 'POST',
+        headers: { 'Authorization': `Bearer ${authToken}` },
+        body: formData,
+    });
+
+    if (!res.ok) {
+        const err = await res.json();
+        showToast('Errore: ' + (err.error || 'invio fallito'));
+        return null;
+    }
+
+    const podRecord = await res.json();
+
+    // Le foto vanno direttamente sullo storage (la firma è nel record)
+    const images = capturedPhotos.map((photo) => ({ kind: 'photo', ...photo }));
+    const failed = [];
+    for (const image of images) {
+        try {
+            await uploadImageWithFallback(podRecord.uuid, image);
+        } catch (err) {
+            console.error('Image upload error:', err);
+            failed.push(image);
+        }
+    }
+    // Le immagini non arrivate restano in coda: il service worker le associa
+    // al POD con (device_uuid, local_record_id) e le riprova
+    if (failed.length) await queuePODOffline(record, failed, { photosOnly: true });
+    return { queued: failed.length };
+}
+
+// Upload diretto: autorizzazione, byte sull'URL firmato (S3 o fallback
+// locale), conferma al server
+async function uploadImage(podUUID, image) {
+    const grantRes = await fetch(`${API_BASE}/pod/${podUUID}/uploads/`, {
+        method: 'POST',
+        headers: apiHeaders(),
+        body: JSON.stringify({
+            kind: image.kind,
+            content_type: image.blob.type,
+            size: image.blob.size,
+            sha256: await blobSHA256(image.blob),
+        }),
+    });
+    if (!grantRes.ok) throw new Error(`autorizzazione rifiutata (${grantRes.status})`);
+    const grant = await grantRes.json();
+    // Immagine già sul server (reinvio): nessun upload
+    if (grant.duplicate) return grant.photo || grant.pod;
+
+    let uploadRes;
+    if (grant.method === 'POST') {
+        const form = new FormData();
+        for (const [key, value] of Object.entries(grant.fields)) form.append(key, value);
+        // Il file deve essere l'ultimo campo del POST presigned
+        form.append('file', image.blob);
+        uploadRes = await fetch(grant.url, { method: 'POST', body: form });
+    } else {
+        uploadRes = await fetch(grant.url, {
+            method: 'PUT',
+            headers: grant.headers,
+            body: image.blob,
+        });
+    }
+    if (!uploadRes.ok) throw new Error(`upload fallito (${uploadRes.status})`);
+
+    const confirmRes = await fetch(`${API_BASE}/pod/${podUUID}/uploads/confirm/`, {
+        method: 'POST',
+        headers: apiHeaders(),
+        body: JSON.stringify({
+            token: grant.token,
+            taken_at: image.taken_at ?? null,
+            latitude: image.latitude ?? null,
+            longitude: image.longitude ?? null,
+        }),
+    });
+    if (!confirmRes.ok) throw new Error(`conferma fallita (${confirmRes.status})`);
+    return confirmRes.json();
+}
+
+// Su rete lenta l'upload va direttamente a blocchi; altrimenti diretto, con
+// i blocchi come ripiego se si interrompe
+async function uploadImageWithFallback(podUUID, image) {
+    if (!isSlowConnection()) {
+        try {
+            return await uploadImage(podUUID, image);
+        } catch (err) {
+            console.warn('Upload diretto fallito, riprovo a blocchi:', err);
+        }
+    }
+    return uploadImageResumable(podUUID, image);
+}
+
+function isSlowConnection() {
+    const conn = navigator.connection;
+    return !!conn && (conn.saveData || ['slow-2g', '2g', '3g'].includes(conn.effectiveType));
+}
+
+const CHUNK_MIN_BYTES = 64 * 1024;
+const CHUNK_MAX_BYTES = 1024 * 1024;
+const CHUNK_RETRIES = 6;
+
+// Upload riprendibile: i byte vanno a blocchi con l'offset di partenza; dopo
+// un errore si rilegge l'offset raggiunto dal server e si riprende da li.
+// Il blocco si allarga se la rete regge e si restringe se i blocchi falliscono
+async function uploadImageResumable(podUUID, image) {
+    const createRes = await fetch(`${API_BASE}/pod/${podUUID}/chunked-uploads/`, {
+        method: 'POST',
+        headers: apiHeaders(),
+        body: JSON.stringify({
+            kind: image.kind,
+            content_type: image.blob.type,
+            size: image.blob.size,
+            sha256: await blobSHA256(image.blob),
+        }),
+    });
+    if (!createRes.ok) throw new Error(`upload a blocchi rifiutato (${createRes.status})`);
+    const upload = await createRes.json();
+    if (upload.duplicate) return upload.photo || upload.pod;
+
+    const blob = image.blob;
+    let offset = 0;
+    let chunkSize = CHUNK_MIN_BYTES * 4;
+    let failures = 0;
+    while (offset < blob.size) {
+        const started = Date.now();
+        let res = null;
+        try {
+            res = await fetch(upload.url, {
+                method: 'PATCH',
+                headers: {
+                    'Authorization': `Bearer ${authToken}`,
+                    'Content-Type': 'application/offset+octet-stream',
+                    'Upload-Offset': String(offset),
+                    'Tus-Resumable': '1.0.0',
+                },
+                body: blob.slice(offset, offset + chunkSize),
+            });
+        } catch (err) {
+            res = null;
+        }
+
+        if (res && (res.ok || res.status === 409)) {
+            // 409: il server e gia oltre (blocco arrivato ma risposta persa)
+            offset = Number(res.headers.get('Upload-Offset'));
+            failures = 0;
+            const elapsed = Date.now() - started;
+            if (res.ok && elapsed < 2000) chunkSize = Math.min(CHUNK_MAX_BYTES, chunkSize * 2);
+            if (elapsed > 8000) chunkSize = Math.max(CHUNK_MIN_BYTES, chunkSize / 2);
+            continue;
+        }
+        if (res && res.status < 500) throw new Error(`blocco rifiutato (${res.status})`);
+
+        // Rete o server non disponibili: attesa crescente, poi riallineamento
+        if (++failures > CHUNK_RETRIES) throw new Error('upload a blocchi interrotto');
+        chunkSize = Math.max(CHUNK_MIN_BYTES, chunkSize / 2);
+        await sleep(Math.min(30000, 1000 * 2 ** failures));
+        offset = await uploadOffset(upload.url, offset);
+    }
+
+    const completeRes = await fetch(`${upload.url}complete/`, {
+        method: 'POST',
+        headers: apiHeaders(),
+        body: JSON.stringify({
+            taken_at: image.taken_at ?? null,
+            latitude: image.latitude ?? null,
+            longitude: image.longitude ?? null,
+        }),
+    });
+    if (!completeRes.ok) throw new Error(`conclusione fallita (${completeRes.status})`);
+    return completeRes.json();
+}
+
+// Offset raggiunto dal server; quello noto se non raggiungibile
+async function uploadOffset(url, fallback) {
+    try {
+        const res = await fetch(url, {
+            method: 'HEAD',
+            headers: { 'Authorization': `Bearer ${authToken}`, 'Tus-Resumable': '1.0.0' },
+        });
+        if (res.ok) return Number(res.headers.get('Upload-Offset'));
+    } catch (err) {
+        // offline: si riprova dall'offset noto
+    }
+    return fallback;
+}
+
+function sleep(ms) {
+    return new Promise((resolve) => setTimeout(resolve, ms));
+}
+
+// Coda offline: POD e immagini in IndexedDB, inviati a blocchi dal service
+// worker. Con photosOnly il POD è già sul server e si accodano solo le immagini
+async function queuePODOffline(record, photos, { photosOnly = false } = {}) {
+    const db = await openDB();
+    const tx = db.transaction(['pending_pods', 'pending_photos'], 'readwrite');
+    if (!photosOnly) {
+        tx.objectStore('pending_pods').add({ data: record, timestamp: Date.now() });
+    }
+
+    // La firma vettoriale resta nel record, nel batch JSON
+    for (const image of photos) {
+        tx.objectStore('pending_photos').add({
+            device_uuid: record.device_uuid,
+            local_record_id: record.local_record_id,
+            local_photo_id: crypto.randomUUID(),
+            kind: 'photo',
+            caption: '',
+            taken_at: image.taken_at,
+            latitude: image.latitude ?? null,
+            longitude: image.longitude ?? null,
+            blob: image.blob,
+        });
+    }
+
+    await new Promise((resolve, reject) => {
+        tx.oncomplete = resolve;
+        tx.onerror = () => reject(tx.error);
+    });
+}
+
+// SHA-256 esadecimale; crypto.subtle c'è solo in HTTPS (o localhost)
+async function blobSHA256(blob) {
+    if (!(window.crypto && crypto.subtle)) return undefined;
+    const digest = await crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+    return Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, '0')).join('');
+}
+
+// Chiede al service worker di svuotare la coda (background sync se disponibile)
+async function requestSync() {
+    if (!('serviceWorker' in navigator)) return;
+    const reg = await navigator.serviceWorker.ready;
+    if ('sync' in reg) {
+        await reg.sync.register('pod-sync');
+    } else if (reg.active) {
+        reg.active.postMessage('pod-sync');
+    }
+}
+
 // ============================================================
 // IndexedDB Helper
 // ============================================================
 
 function openDB() {
     return new Promise((resolve, reject) => {
-        const request = indexedDB.open('pod_db', 1);
+        const request = indexedDB.open('pod_db', 2);
         request.onupgradeneeded = (e) => {
             const db = e.target.result;
             if (!db.objectStoreNames.contains('pending_pods')) {
                 db.createObjectStore('pending_pods', { keyPath: 'id', autoIncrement: true });
             }
+            if (!db.objectStoreNames.contains('pending_photos')) {
+                db.createObjectStore('pending_photos', { keyPath: 'id', autoIncrement: true });
+            }
             if (!db.objectStoreNames.contains('auth')) {
                 db.createObjectStore('auth', { keyPath: 'key' });
             }
+            if (!db.objectStoreNames.contains('sync_state')) {
+                db.createObjectStore('sync_state', { keyPath: 'key' });
+            }
         };
         request.onsuccess = () => resolve(request.result);
         request.onerror = () => reject(request.error);
@@ -1,4 +1,7 @@
-const CACHE_NAME = 'pod-v1';
+const CACHE_NAME = 'pod-v9';
+// Manifest del giorno materializzato: i delta dal server vi si applicano sopra
+const MANIFEST_CACHE = 'pod-manifest';
+const MANIFEST_PATH = '/api/v1/driver/shipments/manifest/';
 const STATIC_ASSETS = [
     '/pwa/',
     '/static/pwa/app.js',
@@ -20,7 +23,8 @@ self.addEventListener('activate', (event) => {
     event.waitUntil(
         caches.keys().then((keys) =>
             Promise.all(
-                keys.filter((key) => key !== CACHE_NAME).map((key) => caches.delete(key))
+                keys.filter((key) => key !== CACHE_NAME && key !== MANIFEST_CACHE)
+                    .map((key) => caches.delete(key))
             )
         )
     );
@@ -31,6 +35,13 @@ self.addEventListener('activate', (event) => {
 self.addEventListener('fetch', (event) => {
     const url = new URL(event.request.url);
 
+    // Manifest: delta dal server applicato alla copia in cache, che resta
+    // disponibile offline
+    if (url.pathname === MANIFEST_PATH && event.request.method === 'GET') {
+        event.respondWith(fetchManifest(event.request));
+        return;
+    }
+
     // API requests: network only (offline handled by app)
     if (url.pathname.startsWith('/api/')) {
         event.respondWith(
@@ -44,6 +55,9 @@ self.addEventListener('fetch', (event) => {
         return;
     }
 
+    // Upload diretti sullo storage e altre scritture: nessuna cache
+    if (event.request.method !== 'GET') return;
+
     // Static assets: cache first
     event.respondWith(
         caches.match(event.request).then((cached) => {
@@ -62,75 +76,291 @@ self.addEventListener('fetch', (event) => {
     );
 });
 
-// Background sync for offline POD records
+async function fetchManifest(request) {
+    const cache = await caches.open(MANIFEST_CACHE);
+    const cached = await cache.match(MANIFEST_PATH);
+    const manifest = cached ? await cached.json() : null;
+
+    const url = new URL(request.url);
+    const headers = new Headers(request.headers);
+    if (manifest) {
+        url.searchParams.set('since', manifest.cursor);
+        if (manifest.etag) headers.set('If-None-Match', manifest.etag);
+    }
+
+    let response;
+    try {
+        response = await fetch(url, { headers, cache: 'no-store' });
+    } catch (e) {
+        if (manifest) return manifestResponse({ ...manifest, offline: true });
+        return new Response(JSON.stringify({ offline: true }), {
+            headers: { 'Content-Type': 'application/json' },
+            status: 503,
+        });
+    }
+
+    if (response.status === 304 && manifest) return manifestResponse(manifest);
+    if (!response.ok) return response;
+
+    const delta = await response.json();
+    const merged = mergeManifest(delta.full ? null : manifest, delta);
+    merged.etag = response.headers.get('ETag');
+    await cache.put(MANIFEST_PATH, manifestResponse(merged));
+    return manifestResponse(merged);
+}
+
+function mergeManifest(manifest, delta) {
+    const byUuid = new Map((manifest ? manifest.shipments : []).map((s) => [s.uuid, s]));
+    delta.removed.forEach((uuid) => byUuid.delete(uuid));
+    delta.shipments.forEach((s) => byUuid.set(s.uuid, s));
+
+    // Stesso ordine del server: giro di consegna, poi data di creazione
+    const shipments = [...byUuid.values()].sort((a, b) =>
+        (a.route_position ?? Infinity) - (b.route_position ?? Infinity)
+        || a.created_at.localeCompare(b.created_at)
+    );
+    return { cursor: delta.cursor, full: true, shipments, removed: [] };
+}
+
+function manifestResponse(manifest) {
+    return new Response(JSON.stringify(manifest), {
+        headers: { 'Content-Type': 'application/json' },
+    });
+}
+
+// ============================================================
+// Outbox offline: POD e immagini inviati a blocchi
+// ============================================================
+
+// Limiti dei blocchi (il server accetta 500 POD e 20 immagini per richiesta)
+const SYNC_BATCH_RECORDS = 100;
+const SYNC_BATCH_BYTES = 256 * 1024;
+const SYNC_PHOTO_BATCH = 10;
+const SYNC_PHOTO_BATCH_BYTES = 4 * 1024 * 1024;
+
+// Backoff esponenziale con jitter dopo errori di rete o del server
+const BACKOFF_BASE_MS = 5000;
+const BACKOFF_MAX_MS = 15 * 60 * 1000;
+
+// Esiti definitivi: il record lascia la coda
+const SYNCED_RECORD = ['created', 'duplicate', 'invalid_transition'];
+const SYNCED_PHOTO = ['created', 'duplicate'];
+
+let syncInFlight = null;
+
 self.addEventListener('sync', (event) => {
     if (event.tag === 'pod-sync') {
-        event.waitUntil(syncOfflinePODs());
+        event.waitUntil(syncOutbox());
     }
 });
 
-async function syncOfflinePODs() {
-    // Get pending records from IndexedDB
+// Browser senza Background Sync: la pagina chiede la sincronizzazione
+self.addEventListener('message', (event) => {
+    if (event.data === 'pod-sync') {
+        event.waitUntil(syncOutbox().catch((e) => console.warn('Sync rimandato:', e.message)));
+    }
+});
+
+function syncOutbox() {
+    // Riconnessioni ravvicinate condividono lo stesso giro di invio
+    if (!syncInFlight) {
+        syncInFlight = runSync().finally(() => { syncInFlight = null; });
+    }
+    return syncInFlight;
+}
+
+async function runSync() {
     const db = await openDB();
-    const tx = db.transaction('pending_pods', 'readonly');
-    const store = tx.objectStore('pending_pods');
-    const records = await getAllFromStore(store);
-
-    for (const record of records) {
-        try {
-            const token = await getStoredToken();
-            const response = await fetch('/api/v1/pod/sync/', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                    'Authorization': `Bearer ${token}`,
-                },
-                body: JSON.stringify([record.data]),
-            });
+    const state = (await idbGet(db, 'sync_state', 'backoff')) || { key: 'backoff', attempt: 0, next_at: 0 };
+    if (Date.now() < state.next_at) {
+        // Il rifiuto fa ripianificare il background sync al browser
+        throw new Error('Sincronizzazione in backoff');
+    }
 
-            if (response.ok) {
-                // Remove synced record
-                const deleteTx = db.transaction('pending_pods', 'readwrite');
-                deleteTx.objectStore('pending_pods').delete(record.id);
+    const auth = await idbGet(db, 'auth', 'access_token');
+    if (!auth || !auth.value) return;
+
+    try {
+        await syncRecords(db, auth.value);
+        await syncPhotos(db, auth.value);
+        await idbPut(db, 'sync_state', { key: 'backoff', attempt: 0, next_at: 0 });
+    } catch (e) {
+        if (e.permanent) return;  // 401: serve un nuovo login, la coda resta
+        const attempt = state.attempt + 1;
+        const delay = Math.min(BACKOFF_BASE_MS * 2 ** (attempt - 1), BACKOFF_MAX_MS);
+        await idbPut(db, 'sync_state', {
+            key: 'backoff',
+            attempt,
+            next_at: Date.now() + delay * (0.5 + Math.random() / 2),
+        });
+        throw e;
+    }
+}
+
+async function syncRecords(db, token) {
+    const pending = (await idbGetAll(db, 'pending_pods')).filter((r) => !r.failed);
+    const batches = inBatches(pending, SYNC_BATCH_RECORDS, SYNC_BATCH_BYTES,
+        (r) => JSON.stringify(r.data).length);
+
+    for (const batch of batches) {
+        const response = await postJSON('/api/v1/pod/sync/', batch.map((r) => r.data), token);
+        const { results } = await response.json();
+
+        // Esito per record: un blocco parzialmente riuscito non si reinvia intero
+        const tx = db.transaction('pending_pods', 'readwrite');
+        const store = tx.objectStore('pending_pods');
+        results.forEach((result, i) => {
+            if (SYNCED_RECORD.includes(result.status)) {
+                store.delete(batch[i].id);
+            } else {
+                store.put({ ...batch[i], failed: result });
             }
-        } catch (e) {
-            console.error('Sync failed for record:', record.id, e);
+        });
+        await txDone(tx);
+    }
+}
+
+async function syncPhotos(db, token) {
+    // Le immagini partono solo dopo il loro POD
+    const waiting = new Set(
+        (await idbGetAll(db, 'pending_pods')).map((r) => r.data.local_record_id)
+    );
+    const pending = (await idbGetAll(db, 'pending_photos'))
+        .filter((p) => !p.failed && !waiting.has(p.local_record_id));
+    const batches = inBatches(pending, SYNC_PHOTO_BATCH, SYNC_PHOTO_BATCH_BYTES, (p) => p.blob.size);
+
+    for (const batch of batches) {
+        const form = new FormData();
+        form.append('items', JSON.stringify(batch.map((p) => ({
+            device_uuid: p.device_uuid,
+            local_record_id: p.local_record_id,
+            local_photo_id: p.local_photo_id,
+            kind: p.kind,
+            caption: p.caption,
+            taken_at: p.taken_at,
+            latitude: p.latitude ?? null,
+            longitude: p.longitude ?? null,
+        }))));
+        batch.forEach((p) => {
+            const extension = { 'image/webp': 'webp', 'image/png': 'png' }[p.blob.type] || 'jpg';
+            form.append(p.local_photo_id, p.blob, `${p.local_photo_id}.${extension}`);
+        });
+
+        const response = checkResponse(await fetch('/api/v1/pod/sync/photos/', {
+            method: 'POST',
+            headers: { 'Authorization': `Bearer ${token}` },
+            body: form,
+        }));
+        const { results } = await response.json();
+
+        // unknown_record con il POD non più in coda: il POD è stato scartato
+        // come duplicato di un altro, l'immagine non troverà mai il suo record
+        const tx = db.transaction('pending_photos', 'readwrite');
+        const store = tx.objectStore('pending_photos');
+        results.forEach((result, i) => {
+            if (SYNCED_PHOTO.includes(result.status)) {
+                store.delete(batch[i].id);
+            } else {
+                store.put({ ...batch[i], failed: result });
+            }
+        });
+        await txDone(tx);
+    }
+}
+
+async function postJSON(url, payload, token) {
+    const headers = {
+        'Content-Type': 'application/json',
+        'Authorization': `Bearer ${token}`,
+    };
+    let body = JSON.stringify(payload);
+    if ('CompressionStream' in self) {
+        body = await new Response(
+            new Blob([body]).stream().pipeThrough(new CompressionStream('gzip'))
+        ).blob();
+        headers['Content-Encoding'] = 'gzip';
+    }
+    return checkResponse(await fetch(url, { method: 'POST', headers, body }));
+}
+
+function checkResponse(response) {
+    if (response.status === 401) {
+        throw Object.assign(new Error('Non autenticato'), { permanent: true });
+    }
+    if (!response.ok) {
+        throw new Error(`HTTP ${response.status}`);
+    }
+    return response;
+}
+
+function inBatches(items, maxCount, maxBytes, sizeOf) {
+    const batches = [];
+    let batch = [];
+    let bytes = 0;
+    for (const item of items) {
+        const size = sizeOf(item);
+        if (batch.length && (batch.length >= maxCount || bytes + size > maxBytes)) {
+            batches.push(batch);
+            batch = [];
+            bytes = 0;
         }
+        batch.push(item);
+        bytes += size;
     }
+    if (batch.length) batches.push(batch);
+    return batches;
 }
 
+// ============================================================
+// IndexedDB
+// ============================================================
+
 function openDB() {
     return new Promise((resolve, reject) => {
-        const request = indexedDB.open('pod_db', 1);
+        const request = indexedDB.open('pod_db', 2);
         request.onupgradeneeded = (e) => {
             const db = e.target.result;
             if (!db.objectStoreNames.contains('pending_pods')) {
                 db.createObjectStore('pending_pods', { keyPath: 'id', autoIncrement: true });
             }
+            if (!db.objectStoreNames.contains('pending_photos')) {
+                db.createObjectStore('pending_photos', { keyPath: 'id', autoIncrement: true });
+            }
             if (!db.objectStoreNames.contains('auth')) {
                 db.createObjectStore('auth', { keyPath: 'key' });
             }
+            if (!db.objectStoreNames.contains('sync_state')) {
+                db.createObjectStore('sync_state', { keyPath: 'key' });
+            }
         };
         request.onsuccess = () => resolve(request.result);
         request.onerror = () => reject(request.error);
     });
 }
 
-function getAllFromStore(store) {
+function idbRequest(request) {
     return new Promise((resolve, reject) => {
-        const request = store.getAll();
         request.onsuccess = () => resolve(request.result);
         request.onerror = () => reject(request.error);
     });
 }
 
-async function getStoredToken() {
-    const db = await openDB();
-    const tx = db.transaction('auth', 'readonly');
-    const store = tx.objectStore('auth');
-    return new Promise((resolve) => {
-        const request = store.get('access_token');
-        request.onsuccess = () => resolve(request.result?.value || '');
-        request.onerror = () => resolve('');
+function idbGet(db, storeName, key) {
+    return idbRequest(db.transaction(storeName, 'readonly').objectStore(storeName).get(key));
+}
+
+function idbGetAll(db, storeName) {
+    return idbRequest(db.transaction(storeName, 'readonly').objectStore(storeName).getAll());
+}
+
+function idbPut(db, storeName, value) {
+    return idbRequest(db.transaction(storeName, 'readwrite').objectStore(storeName).put(value));
+}
+
+function txDone(tx) {
+    return new Promise((resolve, reject) => {
+        tx.oncomplete = resolve;
+        tx.onerror = () => reject(tx.error);
+        tx.onabort = () => reject(tx.error);
     });
 }